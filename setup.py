@@ -38,10 +38,12 @@ setup(name='synapseclient',
         'requests>=1.2',
         'six',
         'future',
-        'backports.csv'
+        'backports.csv',
+        'futures; python_version == "2.7"'
     ],
     extras_require = {
         'pandas':  ["pandas"],
+        'pyarrow': ["pyarrow"],
         'pysftp': ["pysftp>=0.2.8"]
     },
     test_suite='nose.collector',
@@ -0,0 +1,179 @@
+"""
+**********************
+Asynchronous Job Queue
+**********************
+
+Many Synapse operations, such as table queries and bulk file downloads, run as
+`asynchronous jobs <http://docs.synapse.org/rest/org/sagebionetworks/repo/model/asynch/AsynchronousJobStatus.html>`_
+that are started with one request and then polled until they finish. Rather
+than blocking a thread per job, :py:func:`synapseclient.Synapse.submitAsyncJob`
+hands the job to a scheduler that polls all outstanding jobs from a single
+background thread and returns a
+`Future <https://docs.python.org/3/library/concurrent.futures.html#future-objects>`_::
+
+    futures = [syn.tableQueryAsync("select * from %s" % table_id) for table_id in table_ids]
+    results = gather(futures)
+
+.. autofunction:: synapseclient.async_job.gather
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from synapseclient.exceptions import SynapseTimeoutError
+
+CONTINUATION_THREADS = 4
+
+
+def gather(futures, timeout=None):
+    """
+    Wait for a collection of futures and return their results in order.
+
+    :param futures: a list of futures, such as those returned by
+                    :py:func:`synapseclient.Synapse.submitAsyncJob` or
+                    :py:func:`synapseclient.Synapse.tableQueryAsync`
+    :param timeout: maximum number of seconds to wait for all of the results
+
+    :returns: a list of results. If any of the futures failed, its exception is raised.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    return [future.result(None if deadline is None else max(0, deadline - time.time())) for future in futures]
+
+
+class _PendingJob(object):
+
+    def __init__(self, uri, token, endpoint, future, intervals, then=None):
+        self.uri = uri
+        self.token = token
+        self.endpoint = endpoint
+        self.future = future
+        self.intervals = intervals
+        self.then = then
+        self.next_poll = time.time() + next(intervals)
+        self.last_progress = time.time()
+        self.progress = None
+
+
+class AsyncJobScheduler(object):
+    """
+    Polls any number of Synapse asynchronous jobs from one background thread.
+    The thread is started when a job is submitted and exits when no jobs remain.
+
+    :param syn: a Synapse object used to start and poll the jobs
+    """
+
+    def __init__(self, syn):
+        self.syn = syn
+        self._jobs = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = None
+
+    def submit(self, uri, request, endpoint=None, then=None):
+        """
+        Start an asynchronous job and return a Future for its response.
+
+        :param uri:      the URI of the asynchronous job without the trailing /start or /get
+        :param request:  the body of the job request
+        :param endpoint: Server endpoint, defaults to the repository endpoint
+        :param then:     optional function applied to the job response on a worker thread,
+                         for example to download the file a job produced. Its return value
+                         becomes the result of the future.
+        """
+        if endpoint is None:
+            endpoint = self.syn.repoEndpoint
+
+        ## start the job in the calling thread so bad requests fail right away
+        token = self.syn._startAsyncJob(uri, request, endpoint=endpoint)
+
+        future = Future()
+        job = _PendingJob(uri, token, endpoint, future, self.syn._asyncPollIntervals(), then)
+        with self._condition:
+            self._jobs.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll_jobs)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def pending(self):
+        """Return the number of jobs still being polled."""
+        with self._condition:
+            return len(self._jobs)
+
+    def _poll_jobs(self):
+        while True:
+            with self._condition:
+                self._jobs = [job for job in self._jobs if not job.future.cancelled()]
+                if not self._jobs:
+                    self._thread = None
+                    return
+                now = time.time()
+                due = [job for job in self._jobs if job.next_poll <= now]
+                if not due:
+                    self._condition.wait(min(job.next_poll for job in self._jobs) - now)
+                    continue
+
+            finished = [job for job in due if self._poll(job)]
+
+            if finished:
+                with self._condition:
+                    self._jobs = [job for job in self._jobs if job not in finished]
+
+    def _poll(self, job):
+        """Check on a job, returning True once it has finished one way or another."""
+        try:
+            result = self.syn._getAsyncJobStatus(job.uri, job.token, endpoint=job.endpoint)
+            now = time.time()
+            if result.get('jobState', None) == 'PROCESSING':
+                progress = (result.get('progressMessage', None), result.get('progressCurrent', None))
+                if progress != job.progress:
+                    job.progress = progress
+                    job.last_progress = now
+                elif now - job.last_progress >= self.syn.table_query_timeout:
+                    raise SynapseTimeoutError('Timeout waiting for asynchronous job %s: %0.1f seconds ' % (job.token, now - job.last_progress))
+                job.next_poll = now + next(job.intervals)
+                return False
+            self.syn._checkAsyncJobResult(result)
+        except Exception:
+            exc_info = sys.exc_info()
+            if job.future.set_running_or_notify_cancel():
+                self._set_exception(job.future, exc_info)
+            return True
+
+        ## a future cancelled while its job ran is simply dropped
+        if not job.future.set_running_or_notify_cancel():
+            return True
+        if job.then is None:
+            job.future.set_result(result)
+        else:
+            self._run_continuation(job, result)
+        return True
+
+    def _run_continuation(self, job, result):
+        with self._condition:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=CONTINUATION_THREADS)
+            executor = self._executor
+
+        def continuation():
+            try:
+                job.future.set_result(job.then(result))
+            except Exception:
+                self._set_exception(job.future, sys.exc_info())
+        executor.submit(continuation)
+
+    @staticmethod
+    def _set_exception(future, exc_info):
+        if hasattr(future, 'set_exception_info'):
+            ## the Python 2 backport of concurrent.futures keeps the traceback this way
+            future.set_exception_info(exc_info[1], exc_info[2])
+        else:
+            future.set_exception(exc_info[1])
@@ -17,13 +17,19 @@ from __future__ import unicode_literals
 from builtins import str
 
 import collections
+import contextlib
+import copy
 import datetime
+import hashlib
 import json
 import operator
 import os
 import re
 import shutil
 import six
+import sqlite3
+import threading
+import time
 from math import floor
 import synapseclient.utils as utils
 from synapseclient.lock import Lock
@@ -314,3 +320,397 @@ class Cache():
                 count += 1
         return count
 
+
+
+_quoted_or_unquoted_sql = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|[^'"]+)""")
+
+
+def normalize_sql(query):
+    """
+    Collapse runs of whitespace in a SQL query into single spaces, leaving quoted strings as they are.
+    """
+    parts = []
+    for part in _quoted_or_unquoted_sql.findall(query.strip()):
+        parts.append(part if part[0] in '\'"' else re.sub(r'\s+', ' ', part))
+    return ''.join(parts)
+
+
+class QueryResultCache(object):
+    """
+    Remember which cached CSV file holds the results of a table query, so that running the
+    same query on a table that hasn't changed since can skip the query job altogether.
+
+    Entries are keyed by the normalized query, the options of the CSV file and the etag of
+    the table, and are kept in an index in the cache root directory. The CSV files themselves
+    are stored in the file cache under their results file handle. When the files listed in
+    the index add up to more than max_size bytes, the least recently used entries are evicted
+    and their files, and any Parquet files converted from them, removed from the file cache.
+    """
+
+    def __init__(self, cache, max_size):
+        self.cache = cache
+        self.max_size = max_size
+        self.index_file_name = ".queryResultCache"
+
+
+    @staticmethod
+    def key(query, request, etag):
+        """
+        :param query:   the SQL query
+        :param request: the DownloadFromTableRequest, whose CSV options are part of the key
+        :param etag:    the etag of the queried table
+        """
+        options = {k: v for k, v in request.items() if k != 'sql'}
+        key = json.dumps([normalize_sql(query), options, etag], sort_keys=True)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+    def _read_index(self):
+        index_file = os.path.join(self.cache.cache_root_dir, self.index_file_name)
+        if not os.path.exists(index_file):
+            return {}
+        with open(index_file, 'r') as f:
+            return json.load(f)
+
+
+    def _write_index(self, index):
+        index_file = os.path.join(self.cache.cache_root_dir, self.index_file_name)
+        with open(index_file, 'w') as f:
+            json.dump(index, f)
+            f.write('\n')
+
+
+    def get(self, key):
+        """
+        :returns: a tuple of the DownloadFromTableResult and the path to the unmodified CSV file
+                  of a cached query result or None
+        """
+        with Lock(self.index_file_name, dir=self.cache.cache_root_dir):
+            index = self._read_index()
+            entry = index.get(key, None)
+            if entry is None:
+                return None
+            path = self.cache.get(entry['resultsFileHandleId'])
+            if path is None:
+                del index[key]
+            else:
+                entry['lastUsed'] = time.time()
+            self._write_index(index)
+        return None if path is None else (entry['downloadFromTableResult'], path)
+
+
+    def add(self, key, download_from_table_result, path):
+        """
+        Add the results of a query to the cache, evicting the least recently used results
+        if the cache has grown beyond its maximum size.
+        """
+        with Lock(self.index_file_name, dir=self.cache.cache_root_dir):
+            index = self._read_index()
+            index[key] = {'resultsFileHandleId': download_from_table_result['resultsFileHandleId'],
+                          'downloadFromTableResult': download_from_table_result,
+                          'size': os.path.getsize(path),
+                          'lastUsed': time.time()}
+
+            total_size = sum(entry['size'] for entry in index.values())
+            for old_key, entry in sorted(index.items(), key=lambda item: item[1]['lastUsed']):
+                if total_size <= self.max_size or old_key == key:
+                    break
+                for removed_path in self.cache.remove(entry['resultsFileHandleId'], delete=True):
+                    ## along with any Parquet file converted from the CSV file, see CsvFileTable.toParquet
+                    parquet_path = os.path.splitext(removed_path)[0] + '.parquet'
+                    if os.path.exists(parquet_path):
+                        os.remove(parquet_path)
+                total_size -= entry['size']
+                del index[old_key]
+
+            self._write_index(index)
+
+
+class EntityBundleCache(object):
+    """
+    An in-memory, least recently used cache of entity bundles keyed by entity ID, version
+    and bit flags.
+
+    A bundle of a specific version of an entity doesn't change, so it is kept until it is
+    evicted or invalidated. A bundle of the latest version is only trusted for ttl seconds
+    after it was fetched or last validated. After that the caller is expected to compare its
+    etag with that of the entity and call :py:meth:`validated` if they still match.
+
+    Permissions, ACLs and access requirements change without the etag or version of the
+    entity changing, so bundles that include them, of any version, are only trusted for ttl
+    seconds after they were fetched and can't be validated by their etag.
+    """
+
+    ## PERMISSIONS | ACL | ACCESS_REQUIREMENTS | UNMET_ACCESS_REQUIREMENTS
+    ACCESS_CONTROL_BIT_FLAGS = 0x4 | 0x40 | 0x200 | 0x400
+
+    def __init__(self):
+        self._bundles = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def key(entity_id, version, bitFlags):
+        return (entity_id, None if version is None else int(version), bitFlags)
+
+
+    def get(self, key, ttl):
+        """
+        :returns: a tuple of a copy of the cached bundle, or None, and whether the bundle
+                  needs to be validated before it is used
+        """
+        with self._lock:
+            entry = self._bundles.get(key, None)
+            if entry is None:
+                return None, False
+            ## move the entry to the most recently used end
+            del self._bundles[key]
+            self._bundles[key] = entry
+            bundle, validated_at = entry
+        expires = key[1] is None or self.has_access_control(key)
+        stale = expires and time.time() - validated_at >= ttl
+        return copy.deepcopy(bundle), stale
+
+
+    @classmethod
+    def has_access_control(cls, key):
+        """
+        :returns: whether the bundle includes parts that change without the entity's etag changing
+        """
+        return bool(key[2] & cls.ACCESS_CONTROL_BIT_FLAGS)
+
+
+    def put(self, key, bundle, max_size):
+        """
+        Add a bundle, evicting the least recently used bundles beyond max_size.
+        """
+        with self._lock:
+            self._bundles.pop(key, None)
+            self._bundles[key] = (copy.deepcopy(bundle), time.time())
+            while len(self._bundles) > max_size:
+                self._bundles.popitem(last=False)
+
+
+    def validated(self, key):
+        """
+        Record that the cached bundle of the latest version is still current.
+        """
+        with self._lock:
+            entry = self._bundles.get(key, None)
+            if entry is not None:
+                self._bundles[key] = (entry[0], time.time())
+
+
+    def invalidate(self, entity_id):
+        """
+        Remove every bundle of the given entity.
+        """
+        with self._lock:
+            for key in [key for key in self._bundles if key[0] == entity_id]:
+                del self._bundles[key]
+
+
+    def clear(self):
+        with self._lock:
+            self._bundles.clear()
+
+
+class UploadDestinationCache(object):
+    """
+    An in-memory cache of the upload destinations of parent containers, keyed by the parent's
+    Synapse ID.
+
+    Every file stored in a container has the same upload destination until the storage
+    settings of its project change, so a destination is reused for ttl seconds after it was
+    fetched. Only the max_size most recently fetched destinations are kept.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._destinations = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, parent_id, ttl):
+        """
+        :returns: a copy of the cached upload destination, or None if there is none younger than ttl seconds
+        """
+        with self._lock:
+            entry = self._destinations.get(parent_id, None)
+            if entry is None:
+                return None
+            destination, fetched_at = entry
+            if time.time() - fetched_at >= ttl:
+                del self._destinations[parent_id]
+                return None
+        return copy.deepcopy(destination)
+
+
+    def put(self, parent_id, destination):
+        with self._lock:
+            self._destinations.pop(parent_id, None)
+            self._destinations[parent_id] = (copy.deepcopy(destination), time.time())
+            while len(self._destinations) > self.max_size:
+                self._destinations.popitem(last=False)
+
+
+    def invalidate(self, parent_id=None):
+        """
+        Remove the upload destination of the given parent, or of every parent if none is given.
+        """
+        with self._lock:
+            if parent_id is None:
+                self._destinations.clear()
+            else:
+                self._destinations.pop(parent_id, None)
+
+
+class MetadataStore(object):
+    """
+    Keeps metadata that rarely or never changes, such as entity bundles of specific versions,
+    file handles and column models, in a SQLite database in the cache root directory, so it
+    can be reused across sessions and without a connection to Synapse.
+
+    Each record is a JSON value identified by a kind, for example 'bundle' or 'column', and a key,
+    along with the time it was stored.
+    """
+
+    def __init__(self, cache_root_dir, file_name=".metadata.db"):
+        self.cache_root_dir = cache_root_dir
+        self.path = os.path.join(cache_root_dir, file_name)
+        if not os.path.exists(cache_root_dir):
+            os.makedirs(cache_root_dir)
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS metadata ("
+                               "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, stored_at REAL, "
+                               "PRIMARY KEY (kind, key))")
+            ## stores created before records were timestamped
+            if 'stored_at' not in [row[1] for row in connection.execute("PRAGMA table_info(metadata)")]:
+                connection.execute("ALTER TABLE metadata ADD COLUMN stored_at REAL")
+
+
+    def _connect(self):
+        ## a connection per operation, so the store can be shared by threads and processes
+        return contextlib.closing(sqlite3.connect(self.path, timeout=60, isolation_level=None))
+
+
+    def get(self, kind, key, max_age=None):
+        """
+        :param max_age: if given, ignore a value stored more than this many seconds ago
+
+        :returns: the stored value or None
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT value, stored_at FROM metadata WHERE kind = ? AND key = ?", (kind, str(key))).fetchone()
+        if row is None or (max_age is not None and (row[1] is None or time.time() - row[1] >= max_age)):
+            return None
+        return json.loads(row[0])
+
+
+    def put(self, kind, key, value):
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO metadata (kind, key, value, stored_at) VALUES (?, ?, ?, ?)",
+                               (kind, str(key), json.dumps(value), time.time()))
+
+
+    def put_many(self, kind, items):
+        """
+        Store a list of (key, value) pairs in one transaction.
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN")
+            stored_at = time.time()
+            connection.executemany("INSERT OR REPLACE INTO metadata (kind, key, value, stored_at) VALUES (?, ?, ?, ?)",
+                                   [(kind, str(key), json.dumps(value), stored_at) for key, value in items])
+            connection.execute("COMMIT")
+
+
+    def remove(self, kind, key):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM metadata WHERE kind = ? AND key = ?", (kind, str(key)))
+
+
+    def remove_prefix(self, kind, prefix):
+        """
+        Remove every record of a kind whose key starts with the given prefix.
+
+        :returns: the removed values
+        """
+        prefix = str(prefix)
+        condition = "kind = ? AND substr(key, 1, ?) = ?"
+        with self._connect() as connection:
+            connection.execute("BEGIN")
+            values = [json.loads(row[0]) for row in
+                      connection.execute("SELECT value FROM metadata WHERE " + condition, (kind, len(prefix), prefix))]
+            connection.execute("DELETE FROM metadata WHERE " + condition, (kind, len(prefix), prefix))
+            connection.execute("COMMIT")
+        return values
+
+
+class Md5Index(object):
+    """
+    Remembers the MD5 of local files in a SQLite database in the cache root directory, so a file
+    is only read again once it changes. A file is identified by its device and inode and is taken
+    to be unchanged while its size and modification time in nanoseconds stay the same.
+
+    Files modified within the resolution of some file systems' timestamps of being hashed could be
+    changed again without their modification time moving, so their MD5 is not remembered.
+    """
+
+    ## coarsest timestamp resolution of common file systems, in nanoseconds
+    _TIMESTAMP_RESOLUTION_NS = 2 * 10**9
+
+    def __init__(self, cache_root_dir, file_name=".md5.db"):
+        self.cache_root_dir = cache_root_dir
+        self.path = os.path.join(cache_root_dir, file_name)
+        if not os.path.exists(cache_root_dir):
+            os.makedirs(cache_root_dir)
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS md5 ("
+                               "device INTEGER NOT NULL, inode INTEGER NOT NULL, size INTEGER NOT NULL, "
+                               "mtime_ns INTEGER NOT NULL, md5 TEXT NOT NULL, PRIMARY KEY (device, inode))")
+
+
+    def _connect(self):
+        return contextlib.closing(sqlite3.connect(self.path, timeout=60, isolation_level=None))
+
+
+    @staticmethod
+    def _stat(path):
+        st = os.stat(path)
+        mtime_ns = getattr(st, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(st.st_mtime * 10**9)
+        return st.st_dev, st.st_ino, st.st_size, mtime_ns
+
+
+    def get(self, path):
+        """
+        :returns: the remembered hex digest of the file's MD5, or None if it is not known
+        """
+        device, inode, size, mtime_ns = self._stat(path)
+        with self._connect() as connection:
+            row = connection.execute("SELECT md5 FROM md5 WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                                     (device, inode, size, mtime_ns)).fetchone()
+        return None if row is None else row[0]
+
+
+    def md5_for_file(self, path, hash_file=None):
+        """
+        :param hash_file: optional function returning the hex digest of the MD5 of the file at a path,
+                          called when the file has to be hashed
+
+        :returns: the hex digest of the file's MD5, hashing the file only if it changed since it was last hashed
+        """
+        md5 = self.get(path)
+        if md5 is not None:
+            return md5
+
+        started_ns = int(time.time() * 10**9)
+        before = self._stat(path)
+        md5 = hash_file(path) if hash_file else utils.md5_for_file(path).hexdigest()
+        if before == self._stat(path) and before[3] < started_ns - self._TIMESTAMP_RESOLUTION_NS:
+            with self._connect() as connection:
+                connection.execute("INSERT OR REPLACE INTO md5 (device, inode, size, mtime_ns, md5) VALUES (?, ?, ?, ?, ?)",
+                                   before + (md5,))
+        return md5
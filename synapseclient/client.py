@@ -43,9 +43,10 @@ except ImportError:
     import ConfigParser as configparser
 
 import collections
-import os, sys, re, json, time
+import os, sys, re, json, time, random
 import base64, hashlib, hmac
 import six
+from six.moves import queue
 
 try:
     from urllib.parse import urlparse
@@ -62,6 +63,7 @@ except ImportError:
 
 import webbrowser
 import shutil
+from multiprocessing.dummy import Pool
 import zipfile
 import mimetypes
 import tempfile
@@ -74,6 +76,7 @@ import synapseclient
 from synapseclient import concrete_types
 from . import cache
 from . import exceptions
+from . import hashing
 from .exceptions import *
 from .version_check import version_check
 from .utils import id_of, get_properties, MB, memoize, _is_json, _extract_synapse_id_from_query, find_data_file_handle, log_error, _extract_zip_file_to_directory, _is_integer
@@ -83,10 +86,14 @@ from .entity import Entity, File, Versionable, split_entity_namespaces, is_versi
 from .dict_object import DictObject
 from .evaluation import Evaluation, Submission, SubmissionStatus
 from .table import Schema, Column, TableQueryResult, CsvFileTable
+from .table import aggregate_pattern as table_aggregate_pattern
 from .team import UserProfile, Team, TeamMember, UserGroupHeader
 from .wiki import Wiki, WikiAttachment
 from .retry import _with_retry
 from .multipart_upload import multipart_upload, multipart_upload_string
+from .async_job import AsyncJobScheduler
+from .zip_stream import ZipStreamExtractor
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
 PRODUCTION_ENDPOINTS = {'repoEndpoint':'https://repo-prod.prod.sagebase.org/repo/v1',
@@ -231,10 +238,26 @@ class Synapse:
         self.debug = debug
         self.skip_checks = skip_checks
 
-        self.table_query_sleep = 2
-        self.table_query_backoff = 1.1
+        self.table_query_sleep = 0.1
+        self.table_query_backoff = 1.5
         self.table_query_max_sleep = 20
+        self.table_query_jitter = 0.2 # fraction of each sleep randomized to spread out polling
         self.table_query_timeout = 600 # in seconds
+        self.table_query_cache_size = 0 # in bytes, set above zero to reuse the results of repeated queries
+        self.entity_bundle_cache_size = 0 # number of entity bundles kept in memory, set above zero to enable
+        self.entity_bundle_cache_ttl = 0 # in seconds, how long bundles of the latest version, or with permissions or access requirements, are trusted
+
+        self._entity_bundle_cache = cache.EntityBundleCache()
+
+        self.upload_destination_cache_ttl = 300 # in seconds, how long the upload destination of a container is reused, zero to disable
+        self._upload_destination_cache = cache.UploadDestinationCache()
+
+        self.prefer_cache = False # reuse metadata kept in the cache root directory, see _metadataStore
+        self.offline = False # like prefer_cache, but fail rather than make any request to Synapse
+        self._metadata_store = None
+        self._md5_index = None
+
+        self._async_job_scheduler = AsyncJobScheduler(self)
 
 
 
@@ -703,10 +726,10 @@ class Synapse:
         :param filepath: path to local file
         :param limitSearch:   Limits the places in Synapse where the file is searched for.
         """
-        results = self.restGET('/entity/md5/%s' %utils.md5_for_file(filepath).hexdigest())['results']
+        results = self.restGET('/entity/md5/%s' % self._md5ForFile(filepath))['results']
         if limitSearch is not None:
             #Go through and find the path of every entity found
-            paths = [self.restGET('/entity/%s/path' %ent['id']) for ent in results]
+            paths = [self._getEntityPath(ent) for ent in results]
             #Filter out all entities whose path does not contain limitSearch
             results = [ent for ent, path in zip(results, paths) if
                        utils.is_in_path(limitSearch, path)]
@@ -897,6 +920,12 @@ class Synapse:
                                     or review board approval for this entity.
                                     You will be contacted with regards to the specific data being restricted
                                     and the requirements of access.
+        :param batch_rows:          For a Table backed by a CSV file or DataFrame, upload its rows in batches of
+                                    this many rows, each applied to the table in its own transaction. Only
+                                    batches that fail to upload are retried. Storing anything else with
+                                    batch_rows or max_parallel raises a ValueError.
+        :param max_parallel:        When uploading a Table in batches, the number of batches to upload at once.
+                                    Defaults to 1.
 
         :returns: A Synapse Entity, Evaluation, or Wiki
 
@@ -922,12 +951,21 @@ class Synapse:
             test_entity = File('/path/to/data/file.xyz', description='Fancy new data', parent=project)
             test_entity = syn.store(test_entity, activity=activity)
 
+        Appending a large DataFrame to a table 100,000 rows at a time, uploading 4 batches at once::
+
+            table = syn.store(Table(schema, df), batch_rows=100000, max_parallel=4)
+
         """
         createOrUpdate = kwargs.get('createOrUpdate', True)
         forceVersion = kwargs.get('forceVersion', True)
         versionLabel = kwargs.get('versionLabel', None)
         isRestricted = kwargs.get('isRestricted', False)
 
+        ## only tables backed by a CSV file or DataFrame take options for how their rows are uploaded
+        table_kwargs = {key: kwargs[key] for key in ('batch_rows', 'max_parallel') if key in kwargs}
+        if table_kwargs and not isinstance(obj, CsvFileTable):
+            raise ValueError("batch_rows and max_parallel only apply to a Table backed by a CSV file or DataFrame, not %s" % type(obj).__name__)
+
         ## _before_store hook
         ## give objects a chance to do something before being stored
         if hasattr(obj, '_before_synapse_store'):
@@ -936,7 +974,7 @@ class Synapse:
         ## _synapse_store hook
         ## for objects that know how to store themselves
         if hasattr(obj, '_synapse_store'):
-            return obj._synapse_store(self)
+            return obj._synapse_store(self, **table_kwargs)
 
         # Handle all non-Entity objects
         if not (isinstance(obj, Entity) or type(obj) == dict):
@@ -987,6 +1025,13 @@ class Synapse:
                     ## modified, we want to upload the new version.
                     ## If synapeStore is false then we must upload a ExternalFileHandle
                     needs_upload = not entity['synapseStore'] or not self.cache.contains(bundle['entity']['dataFileHandleId'], entity['path'])
+
+                    ## A file that isn't in the cache, such as one copied from elsewhere, doesn't need
+                    ## to be uploaded again if it has the same content as the stored one
+                    if needs_upload and entity['synapseStore'] and fileHandle and fileHandle.get('contentMd5', None) \
+                            and os.path.isfile(entity['path']) and fileHandle['contentMd5'] == self._md5ForFile(entity['path']):
+                        self.cache.add(fileHandle['id'], entity['path'])
+                        needs_upload = False
             elif entity.get('dataFileHandleId',None) is not None:
                 needs_upload = False
             else:
@@ -1024,52 +1069,6 @@ class Synapse:
                     local_state['cacheDir'] = os.path.dirname(cached_path)
                     local_state['files'] = [os.path.basename(cached_path)]
 
-        # Create or update Entity in Synapse
-        if 'id' in properties:
-            properties = self._updateEntity(properties, forceVersion, versionLabel)
-        else:
-            #If Link, get the target name, version number and concrete type and store in link properties
-            if properties['concreteType']=="org.sagebionetworks.repo.model.Link":
-                target_properties = self._getEntity(properties['linksTo']['targetId'], version=properties['linksTo']['targetVersionNumber'])
-                properties['linksToClassName'] = target_properties['concreteType']
-                if target_properties.get('versionNumber') is not None:
-                    properties['linksTo']['targetVersionNumber'] = target_properties['versionNumber']
-                properties['name'] = target_properties['name']
-            try:
-                properties = self._createEntity(properties)
-            except SynapseHTTPError as ex:
-                if createOrUpdate and ex.response.status_code == 409:
-                    # Get the existing Entity's ID via the name and parent
-                    existing_entity_id = self._findEntityIdByNameAndParent(properties['name'], properties.get('parentId', None))
-                    if existing_entity_id is None: raise
-
-                    # get existing properties and annotations
-                    if not bundle:
-                        bundle = self._getEntityBundle(existing_entity_id, bitFlags=0x1|0x2)
-
-                    # Need some fields from the existing entity: id, etag, and version info.
-                    existing_entity = bundle['entity']
-
-                    # Update the conflicting Entity
-                    existing_entity.update(properties)
-                    properties = self._updateEntity(existing_entity, forceVersion, versionLabel)
-
-                    # Merge new annotations with existing annotations
-                    existing_annos = from_synapse_annotations(bundle['annotations'])
-                    existing_annos.update(annotations)
-                    annotations = existing_annos
-                else:
-                    raise
-
-        # Deal with access restrictions
-        if isRestricted:
-            self._createAccessRequirementIfNone(properties)
-
-        # Update annotations
-        annotations['etag'] = properties['etag']
-        annotations = self.setAnnotations(properties, annotations)
-        properties['etag'] = annotations.etag
-
         # If the parameters 'used' or 'executed' are given, create an Activity object
         activity = kwargs.get('activity', None)
         used = kwargs.get('used', None)
@@ -1082,9 +1081,88 @@ class Synapse:
             activityDescription = kwargs.get('activityDescription', None)
             activity = Activity(name=activityName, description=activityDescription, used=used, executed=executed)
 
-        # If we have an Activity, set it as the Entity's provenance record
+        # Save the Activity first, so the Entity can be linked to it by the same request
+        # that creates or updates it rather than by a separate one followed by a GET for the new etag
+        generatedBy = None
+        new_activity_id = None
         if activity:
-            activity = self.setProvenance(properties, activity)
+            is_new_activity = 'id' not in activity
+            activity = self._saveActivity(activity)
+            generatedBy = activity['id']
+            if is_new_activity:
+                new_activity_id = generatedBy
+        annotations_stored = False
+
+        # Create or update Entity in Synapse
+        try:
+            if 'id' in properties:
+                ## new versions are created through a URI that can't link the Activity
+                if is_versionable(properties) and (forceVersion or versionLabel is not None):
+                    properties = self._updateEntity(properties, forceVersion, versionLabel)
+                else:
+                    properties = self._updateEntity(properties, forceVersion, versionLabel, generatedBy=generatedBy)
+                    generatedBy = None
+            else:
+                #If Link, get the target name, version number and concrete type and store in link properties
+                if properties['concreteType']=="org.sagebionetworks.repo.model.Link":
+                    target_properties = self._getEntity(properties['linksTo']['targetId'], version=properties['linksTo']['targetVersionNumber'])
+                    properties['linksToClassName'] = target_properties['concreteType']
+                    if target_properties.get('versionNumber') is not None:
+                        properties['linksTo']['targetVersionNumber'] = target_properties['versionNumber']
+                    properties['name'] = target_properties['name']
+                try:
+                    ## create the Entity and its annotations together
+                    created = self._createEntityBundle(properties, annotations, generatedBy=generatedBy)
+                    properties = created['entity']
+                    annotations = from_synapse_annotations(created['annotations'])
+                    annotations_stored = True
+                    generatedBy = None
+                except SynapseHTTPError as ex:
+                    if createOrUpdate and ex.response.status_code == 409:
+                        # Get the existing Entity's ID via the name and parent
+                        existing_entity_id = self._findEntityIdByNameAndParent(properties['name'], properties.get('parentId', None))
+                        if existing_entity_id is None: raise
+
+                        # get existing properties and annotations
+                        if not bundle:
+                            bundle = self._getEntityBundle(existing_entity_id, bitFlags=0x1|0x2)
+
+                        # Need some fields from the existing entity: id, etag, and version info.
+                        existing_entity = bundle['entity']
+
+                        # Update the conflicting Entity
+                        existing_entity.update(properties)
+                        properties = self._updateEntity(existing_entity, forceVersion, versionLabel)
+
+                        # Merge new annotations with existing annotations
+                        existing_annos = from_synapse_annotations(bundle['annotations'])
+                        existing_annos.update(annotations)
+                        annotations = existing_annos
+                    else:
+                        raise
+        except Exception:
+            ## don't leave behind an Activity created for an Entity that couldn't be stored
+            exc_info = sys.exc_info()
+            if new_activity_id is not None:
+                try:
+                    self.restDELETE('/activity/%s' % new_activity_id)
+                except Exception as ex:
+                    log_error('Failed to delete Activity %s: %s' % (new_activity_id, str(ex)), self.debug)
+            six.reraise(*exc_info)
+
+        # Deal with access restrictions
+        if isRestricted:
+            self._createAccessRequirementIfNone(properties)
+
+        # Update annotations
+        if not annotations_stored:
+            annotations['etag'] = properties['etag']
+            annotations = self.setAnnotations(properties, annotations)
+            properties['etag'] = annotations.etag
+
+        # If the Activity couldn't be linked as the Entity was stored, set it as its provenance record now
+        if generatedBy is not None:
+            self._linkActivity(properties, generatedBy)
 
             # 'etag' has changed, so get the new Entity
             properties = self._getEntity(properties)
@@ -1129,6 +1207,14 @@ class Synapse:
 
             bundle = syn._getEntityBundle('syn111111', bitFlags=0x800|0x2|0x1)
 
+        When entity_bundle_cache_size is above zero, up to that many bundles are kept in memory.
+        Bundles of a specific version are reused as they are. Bundles of the latest version are
+        reused for entity_bundle_cache_ttl seconds, after which they are reused only if the etag
+        of the entity hasn't changed. Bundles that include permissions, ACLs or access requirements,
+        which change without the etag changing, are reused for entity_bundle_cache_ttl seconds
+        whatever their version, and then fetched again. Storing or deleting an entity, or setting
+        its annotations or provenance, removes its bundles.
+
         :returns: An EntityBundle with the requested fields or by default Entity header, annotations, unmet access requirements, and file handles
         """
 
@@ -1144,15 +1230,133 @@ class Synapse:
         except ValueError:
             return None
 
+        metadata_store = self._metadataStore()
+        if metadata_store is not None and version is not None:
+            store_key = '%s.%d.%d' % (id_of(entity), int(version), bitFlags)
+            ## access control changes without the version changing, but offline it can't be fetched again
+            max_age = self.entity_bundle_cache_ttl if bitFlags & cache.EntityBundleCache.ACCESS_CONTROL_BIT_FLAGS and not self.offline else None
+            bundle = metadata_store.get('bundle', store_key, max_age=max_age)
+            if bundle is not None:
+                return bundle
+
+        ## without the entity, a bundle of the latest version has no etag to validate it against
+        use_cache = self.entity_bundle_cache_size > 0 and (version is not None or bitFlags & 0x1)
+        if use_cache:
+            key = cache.EntityBundleCache.key(id_of(entity), version, bitFlags)
+            bundle, stale = self._entity_bundle_cache.get(key, self.entity_bundle_cache_ttl)
+            if bundle is not None:
+                if not stale:
+                    return bundle
+                if not cache.EntityBundleCache.has_access_control(key) \
+                        and self._getEntity(id_of(entity))['etag'] == bundle['entity']['etag']:
+                    self._entity_bundle_cache.validated(key)
+                    return bundle
+
         if version is not None:
             uri = '/entity/%s/version/%d/bundle?mask=%d' %(id_of(entity), version, bitFlags)
         else:
             uri = '/entity/%s/bundle?mask=%d' %(id_of(entity), bitFlags)
         bundle = self.restGET(uri)
 
+        if use_cache:
+            self._entity_bundle_cache.put(key, bundle, self.entity_bundle_cache_size)
+        if metadata_store is not None and version is not None:
+            metadata_store.put('bundle', store_key, bundle)
+            metadata_store.put_many('fileHandle', [(handle['id'], handle) for handle in bundle.get('fileHandles', [])])
         return bundle
 
 
+    def _metadataStore(self):
+        """
+        With prefer_cache or offline set, metadata that doesn't change once created is kept in a
+        SQLite database in the cache root directory and looked up there before asking Synapse.
+        This covers entity bundles of specific versions, file handles, column models and entity
+        paths. Paths change when entities are moved, so the kept ones may be out of date. Bundles
+        that include permissions, ACLs or access requirements are only reused for
+        entity_bundle_cache_ttl seconds, except in offline mode.
+
+        In offline mode, anything else raises a SynapseOfflineError, so an entity whose metadata
+        and file are both cached can be retrieved without a connection::
+
+            syn = synapseclient.Synapse(skip_checks=True)
+            syn.offline = True
+            entity = syn.get('syn1906479', version=3)
+
+        :returns: a :py:class:`synapseclient.cache.MetadataStore` or None if neither mode is set
+        """
+        if not (self.prefer_cache or self.offline):
+            return None
+        if self._metadata_store is None or self._metadata_store.cache_root_dir != self.cache.cache_root_dir:
+            self._metadata_store = cache.MetadataStore(self.cache.cache_root_dir)
+        return self._metadata_store
+
+
+    def _md5ForFile(self, path):
+        """
+        Gets the hex digest of the MD5 of a local file, from the index kept in the cache root
+        directory when the file hasn't changed since it was last hashed.
+        See :py:class:`synapseclient.cache.Md5Index`.
+        """
+        return self._md5Index().md5_for_file(path)
+
+
+    def _md5ForFiles(self, paths, max_workers=hashing.DEFAULT_MAX_WORKERS, use_processes=False, progress=False):
+        """
+        Gets the hex digests of the MD5s of many local files, hashing those that aren't in the index
+        kept in the cache root directory concurrently. See :py:func:`synapseclient.hashing.md5_for_files`.
+
+        :param progress: print a progress bar and, when done, the statistics of the files hashed to stdout
+
+        :returns: an OrderedDict from each path to its MD5
+        """
+        md5s, stats = hashing.md5_for_files(paths, md5_index=self._md5Index(), max_workers=max_workers,
+                                            use_processes=use_processes, progress=progress)
+        if progress and stats.hashed > 0:
+            sys.stdout.write('%s\n' % stats)
+        return md5s
+
+
+    def _md5Index(self):
+        if self._md5_index is None or self._md5_index.cache_root_dir != self.cache.cache_root_dir:
+            self._md5_index = cache.Md5Index(self.cache.cache_root_dir)
+        return self._md5_index
+
+
+    def _getEntityPath(self, entity):
+        """
+        Get the `EntityPath <http://docs.synapse.org/rest/org/sagebionetworks/repo/model/EntityPath.html>`_
+        from the root of Synapse to the given entity.
+        """
+        metadata_store = self._metadataStore()
+        if metadata_store is not None:
+            path = metadata_store.get('entityPath', id_of(entity))
+            if path is not None:
+                return path
+        path = self.restGET('/entity/%s/path' % id_of(entity))
+        if metadata_store is not None:
+            metadata_store.put('entityPath', id_of(entity), path)
+        return path
+
+
+    def _invalidateEntityBundles(self, entity):
+        """
+        Forget any cached bundles of the given entity after it changes, including those
+        persisted by the metadata store, along with their file handles and the entity's path.
+        """
+        try:
+            entity_id = id_of(entity)
+        except ValueError:
+            return
+        self._entity_bundle_cache.invalidate(entity_id)
+
+        metadata_store = self._metadataStore()
+        if metadata_store is not None:
+            for bundle in metadata_store.remove_prefix('bundle', '%s.' % entity_id):
+                for handle in bundle.get('fileHandles', []):
+                    metadata_store.remove('fileHandle', handle['id'])
+            metadata_store.remove('entityPath', entity_id)
+
+
     def delete(self, obj, version=None):
         """
         Removes an object from Synapse.
@@ -1164,6 +1368,8 @@ class Synapse:
 
         """
         # Handle all strings as the Entity ID for backward compatibility
+        if isinstance(obj, (six.string_types, Entity)):
+            self._invalidateEntityBundles(obj)
         if isinstance(obj, six.string_types):
             if version:
                 self.restDELETE(uri='/entity/%s/version/%s' % (id_of(obj), version))
@@ -1357,6 +1563,7 @@ class Synapse:
         :returns: A dictionary
         """
         uri = '/entity/%s/annotations' % id_of(entity)
+        self._invalidateEntityBundles(entity)
 
         annotations.update(kwargs)
         synapseAnnos = to_synapse_annotations(annotations)
@@ -1733,18 +1940,29 @@ class Synapse:
         """
 
         # Assert that the entity was generated by a given Activity.
+        activity = self._saveActivity(activity)
+        return self._linkActivity(entity, activity['id'])
+
+
+    def _saveActivity(self, activity):
+        """
+        Create an Activity, or update it if it already has an ID.
+        """
         if 'id' in activity:
             # We're updating provenance
             uri = '/activity/%s' % activity['id']
-            activity = Activity(data=self.restPUT(uri, json.dumps(activity)))
-        else:
-            activity = self.restPOST('/activity', body=json.dumps(activity))
+            return Activity(data=self.restPUT(uri, json.dumps(activity)))
+        return self.restPOST('/activity', body=json.dumps(activity))
 
-        # assert that an entity is generated by an activity
-        uri = '/entity/%s/generatedBy?generatedBy=%s' % (id_of(entity), activity['id'])
-        activity = Activity(data=self.restPUT(uri))
 
-        return activity
+    def _linkActivity(self, entity, activityId):
+        """
+        Record that an entity was generated by the Activity with the given ID.
+        """
+        # assert that an entity is generated by an activity
+        uri = '/entity/%s/generatedBy?generatedBy=%s' % (id_of(entity), activityId)
+        self._invalidateEntityBundles(entity)
+        return Activity(data=self.restPUT(uri))
 
 
     def deleteProvenance(self, entity):
@@ -1759,6 +1977,7 @@ class Synapse:
         if not activity: return
 
         uri = '/entity/%s/generatedBy' % id_of(entity)
+        self._invalidateEntityBundles(entity)
         self.restDELETE(uri)
 
         ## TODO: what happens if the activity is shared by more than one entity?
@@ -1810,7 +2029,7 @@ class Synapse:
         return results['requestedFiles'][0]
 
 
-    def _downloadFileHandle(self, fileHandleId, objectId, objectType, destination, retries=5):
+    def _downloadFileHandle(self, fileHandleId, objectId, objectType, destination, retries=5, chunk_callback=None):
         """
         Download a file from the given URL to the local file system.
         
@@ -1820,6 +2039,7 @@ class Synapse:
         :param destination: destination on local file system
         :param retries:     (default=5) Number of download retries attempted before
                             throwing an exception.
+        :param chunk_callback: (optional) see :py:meth:`_download`
 
         :returns: path to downloaded file
         """
@@ -1833,7 +2053,8 @@ class Synapse:
                 fileResult = self._getFileHandleDownload(fileHandleId,
                                                         objectId, objectType)
                 fileHandle = fileResult['fileHandle']
-                downloaded_path = self._download(fileResult['preSignedURL'], destination, fileHandle['id'], fileHandle.get('contentMd5'))
+                downloaded_path = self._download(fileResult['preSignedURL'], destination, fileHandle['id'], fileHandle.get('contentMd5'),
+                                                 chunk_callback=chunk_callback)
                 self.cache.add(fileHandle['id'], downloaded_path)
                 return downloaded_path
             except Exception as ex:
@@ -1847,7 +2068,7 @@ class Synapse:
         raise exc_info[0](exc_info[1])
 
 
-    def _download(self, url, destination, fileHandleId=None, expected_md5=None):
+    def _download(self, url, destination, fileHandleId=None, expected_md5=None, chunk_callback=None):
         """
         Download a file from the given URL to the local file system.
 
@@ -1859,6 +2080,9 @@ class Synapse:
                                file from previous sessions
         :param expected_md5:   (optional) if given, check that the MD5 of the
                                downloaded file matched the expected MD5
+        :param chunk_callback: (optional) a function called with the offset in the file and the
+                               bytes of each chunk written during an HTTP download, so the file
+                               can be processed while it downloads
 
         :returns: path to downloaded file
         """
@@ -1874,16 +2098,16 @@ class Synapse:
                 destination = utils.file_url_to_path(url, verify_exists=True)
                 if destination is None:
                     raise IOError("Local file (%s) does not exist." % url)
-                actual_md5 = utils.md5_for_file(destination).hexdigest()
+                actual_md5 = self._md5ForFile(destination)
                 break
             elif scheme == 'sftp':
                 destination = self._sftpDownloadFile(url, destination)
-                actual_md5 = utils.md5_for_file(destination).hexdigest()
+                actual_md5 = self._md5ForFile(destination)
                 break
             elif scheme == 'ftp':
                 #username, password = self.__getUserCredentials(parsedURL.scheme+'://'+parsedURL.hostname, username, password)
                 urlretrieve(url, destination)
-                actual_md5 = utils.md5_for_file(destination).hexdigest()
+                actual_md5 = self._md5ForFile(destination)
                 break
             elif scheme == 'http' or scheme == 'https':
                 ## if a partial download exists with the temporary name,
@@ -1935,9 +2159,13 @@ class Synapse:
                     try:
                         with open(temp_destination, mode) as fd:
                             t0 = time.time()
+                            offset = previouslyTransferred
                             for nChunks, chunk in enumerate(response.iter_content(FILE_BUFFER_SIZE)):
                                 fd.write(chunk)
                                 sig.update(chunk)
+                                if chunk_callback is not None:
+                                    chunk_callback(offset, chunk)
+                                offset += len(chunk)
 
                                 # the 'content-length' header gives the total number of bytes that will be transfered to us
                                 # len(chunk) cannot be used to track progress because iter_content
@@ -2026,8 +2254,17 @@ class Synapse:
     def _getFileHandle(self, fileHandle):
         """Retrieve a fileHandle from the fileHandle service (experimental)."""
 
+        metadata_store = self._metadataStore()
+        if metadata_store is not None:
+            file_handle = metadata_store.get('fileHandle', id_of(fileHandle))
+            if file_handle is not None:
+                return file_handle
+
         uri = "/fileHandle/%s" % (id_of(fileHandle),)
-        return self.restGET(uri, endpoint=self.fileHandleEndpoint)
+        file_handle = self.restGET(uri, endpoint=self.fileHandleEndpoint)
+        if metadata_store is not None:
+            metadata_store.put('fileHandle', file_handle['id'], file_handle)
+        return file_handle
 
 
     def _deleteFileHandle(self, fileHandle):
@@ -2049,8 +2286,39 @@ class Synapse:
     ############################################################
 
     def _getDefaultUploadDestination(self, entity):
-        return self.restGET('/entity/%s/uploadDestination'% entity['parentId'],
-                     endpoint=self.fileHandleEndpoint)
+        """
+        Gets the upload destination of the entity's parent container. Destinations are reused for
+        upload_destination_cache_ttl seconds, see :py:func:`Synapse.invalidateUploadDestinations`.
+        """
+        parent_id = entity['parentId']
+        if self.upload_destination_cache_ttl > 0:
+            destination = self._upload_destination_cache.get(parent_id, self.upload_destination_cache_ttl)
+            if destination is not None:
+                return destination
+
+        destination = self.restGET('/entity/%s/uploadDestination' % parent_id,
+                                   endpoint=self.fileHandleEndpoint)
+        if self.upload_destination_cache_ttl > 0:
+            self._upload_destination_cache.put(parent_id, destination)
+        return destination
+
+
+    def invalidateUploadDestinations(self, parent=None):
+        """
+        Forgets cached upload destinations, so the next file stored gets the current one from Synapse.
+        This happens on its own when project settings are changed through this client, but should be
+        called when the storage settings of a project are changed elsewhere.
+
+        :param parent: the container, or its Synapse ID, whose destination to forget. Defaults to
+                       all of them, as a change to a project's settings applies to every folder in it.
+        """
+        self._upload_destination_cache.invalidate(None if parent is None else id_of(parent))
+
+
+    def _invalidateOnWrite(self, uri):
+        """Forgets cached state that a write to the given URI may have changed."""
+        if urlparse(uri).path.startswith('/projectSettings'):
+            self.invalidateUploadDestinations()
 
 
     def __uploadExternallyStoringProjects(self, entity, local_state):
@@ -2080,7 +2348,7 @@ class Synapse:
                 #If the url is a local path compute the md5
                 url = urlparse(entity['path'])
                 if os.path.isfile(url.path) and url.scheme=='file':
-                    local_state_file_handle['contentMd5'] = utils.md5_for_file(url.path).hexdigest()
+                    local_state_file_handle['contentMd5'] = self._md5ForFile(url.path)
                 return entity['path'], local_state, None
 
         location =  self._getDefaultUploadDestination(entity)
@@ -2101,7 +2369,7 @@ class Synapse:
                 uploadLocation = self._sftpUploadFile(entity['path'], unquote(location['url']))
                 local_state_file_handle['externalURL'] = uploadLocation
                 local_state_file_handle['contentSize'] = os.stat(entity['path']).st_size
-                local_state_file_handle['contentMd5'] = utils.md5_for_file(entity['path']).hexdigest()
+                local_state_file_handle['contentMd5'] = self._md5ForFile(entity['path'])
                 if local_state_file_handle.get('contentType', None) is None:
                     mimetype, enc = mimetypes.guess_type(entity['path'], strict=False)
                     local_state_file_handle['contentType'] = mimetype
@@ -2721,18 +2989,57 @@ class Synapse:
     ##                     Tables                             ##
     ############################################################
 
+    def _startAsyncJob(self, uri, request, endpoint=None):
+        """
+        Start an asynchronous job and return its job token.
+
+        :param request: the request of the job, or its JSON text if it has already been serialized
+        """
+        body = request if isinstance(request, six.string_types) else json.dumps(request)
+        return self.restPOST(uri+'/start', body=body, endpoint=endpoint)['token']
+
+
+    def _getAsyncJobStatus(self, uri, token, endpoint=None):
+        """
+        Get the response of a finished asynchronous job or, while it is still running,
+        its `AsynchronousJobStatus <http://docs.synapse.org/rest/org/sagebionetworks/repo/model/asynch/AsynchronousJobStatus.html>`_.
+        """
+        return self.restGET(uri+'/get/%s' % token, endpoint=endpoint)
+
+
+    def _asyncPollIntervals(self):
+        """
+        Generate the time to sleep between status checks of asynchronous jobs. Polling
+        starts quickly so small jobs return promptly and backs off exponentially up to
+        table_query_max_sleep, with some jitter so that many clients don't poll in lock step.
+        """
+        sleep = self.table_query_sleep
+        while True:
+            jitter = random.uniform(-self.table_query_jitter, self.table_query_jitter)
+            yield min(self.table_query_max_sleep, sleep * (1 + jitter))
+            sleep = min(self.table_query_max_sleep, sleep * self.table_query_backoff)
+
+
+    def _checkAsyncJobResult(self, result):
+        if result.get('jobState', None) == 'FAILED':
+            error = SynapseError('%s\n%s' % (result.get('errorMessage', None), result.get('errorDetails', None)))
+            error.asynchronousJobStatus = result
+            raise error
+        return result
+
+
     def _waitForAsync(self, uri, request, endpoint=None):
         if endpoint is None:
             endpoint = self.repoEndpoint
 
-        async_job_id = self.restPOST(uri+'/start', body=json.dumps(request), endpoint=endpoint)
+        token = self._startAsyncJob(uri, request, endpoint=endpoint)
 
         # http://docs.synapse.org/rest/org/sagebionetworks/repo/model/asynch/AsynchronousJobStatus.html
-        sleep = self.table_query_sleep
+        intervals = self._asyncPollIntervals()
         start_time = time.time()
         lastMessage, lastProgress, lastTotal, progressed = '', 0, 1, False
         while time.time()-start_time < self.table_query_timeout:
-            result = self.restGET(uri+'/get/%s'%async_job_id['token'], endpoint=endpoint)
+            result = self._getAsyncJobStatus(uri, token, endpoint=endpoint)
             if result.get('jobState', None) == 'PROCESSING':
                 progressed=True
                 message = result.get('progressMessage', lastMessage)
@@ -2744,19 +3051,83 @@ class Synapse:
                 if message != lastMessage or lastProgress != progress:
                     start_time = time.time()
                     lastMessage, lastProgress, lastTotal = message, progress, total
-                sleep = min(self.table_query_max_sleep, sleep * self.table_query_backoff)
-                time.sleep(sleep)
+                time.sleep(next(intervals))
             else:
                 break
         else:
             raise SynapseTimeoutError('Timeout waiting for query results: %0.1f seconds ' % (time.time()-start_time))
-        if result.get('jobState', None) == 'FAILED':
-            raise SynapseError(result.get('errorMessage', None) + '\n' + result.get('errorDetails', None), asynchronousJobStatus=result)
+        self._checkAsyncJobResult(result)
         if progressed:
             utils.printTransferProgress(total ,total, message, isBytes=False)
         return result
 
 
+    def _waitForAsyncJobs(self, jobs, endpoint=None):
+        """
+        Start several asynchronous jobs and wait for all of them in a single polling loop.
+
+        :param jobs:     a list of (uri, request) pairs, as would be passed to _waitForAsync
+        :param endpoint: Server endpoint, defaults to self.repoEndpoint
+
+        :returns: a list of the job responses in the same order as the given jobs
+        """
+        if endpoint is None:
+            endpoint = self.repoEndpoint
+
+        tokens = [self._startAsyncJob(uri, request, endpoint=endpoint) for uri, request in jobs]
+        results = [None] * len(jobs)
+        pending = list(range(len(jobs)))
+
+        intervals = self._asyncPollIntervals()
+        start_time = time.time()
+        while pending:
+            still_pending = []
+            for i in pending:
+                result = self._getAsyncJobStatus(jobs[i][0], tokens[i], endpoint=endpoint)
+                if result.get('jobState', None) == 'PROCESSING':
+                    still_pending.append(i)
+                else:
+                    results[i] = self._checkAsyncJobResult(result)
+
+            #Reset the time whenever a job finishes
+            if len(still_pending) < len(pending):
+                start_time = time.time()
+                utils.printTransferProgress(len(jobs)-len(still_pending), len(jobs), 'Asynchronous jobs completed', isBytes=False)
+            pending = still_pending
+
+            if pending:
+                if time.time()-start_time >= self.table_query_timeout:
+                    raise SynapseTimeoutError('Timeout waiting for %d asynchronous jobs: %0.1f seconds ' % (len(pending), time.time()-start_time))
+                time.sleep(next(intervals))
+        return results
+
+
+    def submitAsyncJob(self, uri, request, endpoint=None):
+        """
+        Start an asynchronous job without waiting for it to finish.
+
+        All submitted jobs are polled by a single background thread, so many jobs can be
+        in flight at once without tying up a thread per job.
+
+        :param uri:      the URI of the asynchronous job without the trailing /start, for example
+                         "/entity/syn123/table/query/async"
+        :param request:  the job request as a dictionary
+        :param endpoint: Server endpoint, defaults to self.repoEndpoint
+
+        :returns: a `Future <https://docs.python.org/3/library/concurrent.futures.html#future-objects>`_
+                  whose result is the response of the finished job
+
+        Example::
+
+            from synapseclient.async_job import gather
+
+            futures = [syn.submitAsyncJob('/file/bulk/async', request, endpoint=syn.fileHandleEndpoint)
+                       for request in requests]
+            responses = gather(futures)
+        """
+        return self._async_job_scheduler.submit(uri, request, endpoint=endpoint)
+
+
     def getColumn(self, id):
         """
         Gets a Column object from Synapse by ID.
@@ -2767,7 +3138,13 @@ class Synapse:
 
             column = syn.getColumn(123)
         """
-        return Column(**self.restGET(Column.getURI(id)))
+        metadata_store = self._metadataStore()
+        column = metadata_store.get('column', id) if metadata_store is not None else None
+        if column is None:
+            column = self.restGET(Column.getURI(id))
+            if metadata_store is not None:
+                metadata_store.put('column', column['id'], column)
+        return Column(**column)
 
 
     def getColumns(self, x, limit=100, offset=0):
@@ -2820,11 +3197,11 @@ class Synapse:
 
             SELECT * from syn12345
 
-        :param resultsAs: select whether results are returned as a CSV file ("csv") or incrementally
-                          downloaded as sets of rows ("rowset").
+        :param resultsAs: select whether results are returned as a CSV file ("csv"), incrementally
+                          downloaded as sets of rows ("rowset") or as an Arrow table ("arrow").
 
         :return: A Table object that serves as a wrapper around a CSV file (or generator over
-                 Row objects if resultsAs="rowset").
+                 Row objects if resultsAs="rowset", or a pyarrow.Table if resultsAs="arrow").
 
         You can receive query results either as a generator over rows or as a CSV file. For
         smallish tables, either method will work equally well. Use of a "rowset" generator allows
@@ -2838,6 +3215,8 @@ class Synapse:
         :param isConsistent: defaults to True. If set to False, return results based on current
                              state of the index without waiting for pending writes to complete.
                              Only use this if you know what you're doing.
+        :param prefetch: number of result pages to request in the background while the current
+                         page is being consumed, defaults to 0 (no read-ahead).
 
         For CSV files, there are several parameters to control the format of the resulting file:
 
@@ -2847,6 +3226,13 @@ class Synapse:
         :param separator: defaults to comma
         :param header: True by default
         :param includeRowIdAndRowVersion: True by default
+        :param shards: split the query into this many queries over consecutive windows of rows,
+                       which are run and downloaded concurrently and joined into one CSV file.
+                       Queries that aggregate rows or have a LIMIT or OFFSET are not split.
+
+        The "arrow" option takes the same parameters as CSV files. It requires pyarrow and converts
+        the downloaded CSV file into a Parquet file kept in the cache, so repeated loads of the
+        same results are memory-mapped rather than parsed. See :py:meth:`synapseclient.table.CsvFileTable.toParquet`.
 
         NOTE: When performing queries on frequently updated tables,
               the table can be inaccessible for a period leading to a
@@ -2857,6 +3243,14 @@ class Synapse:
 
               syn.table_query_timeout = 300  #Sets the max timeout to 5 minutes.
 
+        To skip running queries whose results are already cached, set table_query_cache_size to
+        the number of bytes of query results to keep. A query of a table that hasn't changed since
+        the same query, with the same CSV options, was last run is then answered with the CSV file
+        it downloaded before, at the cost of one request to check the table's etag. Least recently
+        used results are evicted from the cache once their total size exceeds the limit::
+
+              syn.table_query_cache_size = 2*synapseclient.utils.GB
+
 
 
         """
@@ -2864,10 +3258,61 @@ class Synapse:
             return TableQueryResult(self, query, **kwargs)
         elif resultsAs.lower()=="csv":
             return CsvFileTable.from_table_query(self, query, **kwargs)
+        elif resultsAs.lower()=="arrow":
+            return CsvFileTable.from_table_query(self, query, **kwargs).asArrowTable()
         else:
             raise ValueError("Unknown return type requested from tableQuery: " + str(resultsAs))
 
 
+    def tableQueryAsync(self, query, resultsAs="csv", **kwargs):
+        """
+        Start a query of a Synapse Table without waiting for the results.
+
+        Takes the same arguments as :py:func:`synapseclient.Synapse.tableQuery`. The query is
+        polled along with any other asynchronous jobs by a single background thread, so many
+        queries can be run at once without using a thread for each.
+
+        :returns: a `Future <https://docs.python.org/3/library/concurrent.futures.html#future-objects>`_
+                  whose result is the Table object tableQuery would have returned
+
+        Example::
+
+            from synapseclient.async_job import gather
+
+            futures = [syn.tableQueryAsync("select * from %s" % table_id) for table_id in table_ids]
+            tables = gather(futures)
+        """
+        if resultsAs.lower()=="rowset":
+            limit = kwargs.pop('limit', None)
+            offset = kwargs.pop('offset', None)
+            isConsistent = kwargs.pop('isConsistent', True)
+            uri, request = self._queryTableRequest(query, limit=limit, offset=offset, isConsistent=isConsistent)
+            then = lambda result: TableQueryResult(self, query, limit=limit, offset=offset, isConsistent=isConsistent,
+                                                   queryResultBundle=result, **kwargs)
+        elif resultsAs.lower() in ("csv", "arrow"):
+            uri, request = self._queryTableCsvRequest(query, **kwargs)
+
+            def to_table(download_result):
+                table = CsvFileTable._from_download_result(*download_result, **kwargs)
+                return table.asArrowTable() if resultsAs.lower()=="arrow" else table
+
+            query_result_cache, key = self._queryResultCacheKey(query, request)
+            cached = query_result_cache.get(key) if key is not None else None
+            if cached is not None:
+                future = Future()
+                future.set_result(to_table(cached))
+                return future
+
+            def then(result):
+                download_result = self._downloadQueryTableCsvResult(query, result)
+                if key is not None:
+                    query_result_cache.add(key, *download_result)
+                return to_table(download_result)
+        else:
+            raise ValueError("Unknown return type requested from tableQueryAsync: " + str(resultsAs))
+        return self._async_job_scheduler.submit(uri, request, then=then)
+
+
     def _queryTable(self, query, limit=None, offset=None, isConsistent=True, partMask=None):
         """
         Query a table and return the first page of results as a `QueryResultBundle <http://docs.synapse.org/rest/org/sagebionetworks/repo/model/table/QueryResultBundle.html>`_.
@@ -2882,7 +3327,16 @@ class Synapse:
                             Max Rows Per Page (maxRowsPerPage) = 0x8
         """
 
-        # See: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/table/QueryBundleRequest.html
+        uri, query_bundle_request = self._queryTableRequest(query, limit=limit, offset=offset,
+                                                            isConsistent=isConsistent, partMask=partMask)
+        return self._waitForAsync(uri=uri, request=query_bundle_request)
+
+
+    def _queryTableRequest(self, query, limit=None, offset=None, isConsistent=True, partMask=None):
+        """
+        Build the URI and `QueryBundleRequest <http://docs.synapse.org/rest/org/sagebionetworks/repo/model/table/QueryBundleRequest.html>`_
+        of the asynchronous job run by :py:meth:`~._queryTable`.
+        """
         query_bundle_request = {
             "concreteType": "org.sagebionetworks.repo.model.table.QueryBundleRequest",
             "query": {
@@ -2900,8 +3354,7 @@ class Synapse:
         query_bundle_request["query"]["isConsistent"] = isConsistent
 
         uri = '/entity/{id}/table/query/async'.format(id=_extract_synapse_id_from_query(query))
-
-        return self._waitForAsync(uri=uri, request=query_bundle_request)
+        return uri, query_bundle_request
 
 
     def _queryTableNext(self, nextPageToken, tableId):
@@ -2921,7 +3374,17 @@ class Synapse:
         """
 
         fileHandleId = multipart_upload(self, filepath, contentType="text/csv")
+        return self._uploadCsvFileHandle(fileHandleId, schema, updateEtag=updateEtag, quoteCharacter=quoteCharacter,
+                                         escapeCharacter=escapeCharacter, lineEnd=lineEnd, separator=separator,
+                                         header=header, linesToSkip=linesToSkip)
+
 
+    def _uploadCsvFileHandle(self, fileHandleId, schema, updateEtag=None, quoteCharacter='"', escapeCharacter="\\", lineEnd=os.linesep, separator=",", header=True, linesToSkip=0):
+        """
+        Apply a CSV file that has already been uploaded to a table, as for :py:meth:`~._uploadCsv`.
+
+        :param fileHandleId: the ID of the file handle of the CSV file
+        """
         uploadRequest = {
             "concreteType":"org.sagebionetworks.repo.model.table.UploadToTableRequest",
             "csvTableDescriptor": {
@@ -2946,7 +3409,7 @@ class Synapse:
         return self._waitForAsync(uri=uri, request=request)
 
 
-    def _queryTableCsv(self, query, quoteCharacter='"', escapeCharacter="\\", lineEnd=os.linesep, separator=",", header=True, includeRowIdAndRowVersion=True):
+    def _queryTableCsv(self, query, quoteCharacter='"', escapeCharacter="\\", lineEnd=os.linesep, separator=",", header=True, includeRowIdAndRowVersion=True, shards=None):
         """
         Query a Synapse Table and download a CSV file containing the results.
 
@@ -2960,8 +3423,125 @@ class Synapse:
          * concreteType: STRING
          * etag: STRING, Any RowSet returned from Synapse will contain the current etag of the change set. To update any rows from a RowSet the etag must be provided with the POST.
          * tableId: STRING, The ID of the table identified in the from clause of the table query.
+
+        If shards is more than one, the query is split into that many queries over consecutive
+        windows of rows which are run concurrently, see :py:meth:`~._queryTableCsvSharded`.
+        """
+        if shards is not None and shards > 1:
+            sharded_result = self._queryTableCsvSharded(
+                query, shards, quoteCharacter=quoteCharacter, escapeCharacter=escapeCharacter, lineEnd=lineEnd,
+                separator=separator, header=header, includeRowIdAndRowVersion=includeRowIdAndRowVersion)
+            if sharded_result is not None:
+                return sharded_result
+
+        uri, download_from_table_request = self._queryTableCsvRequest(
+            query, quoteCharacter=quoteCharacter, escapeCharacter=escapeCharacter, lineEnd=lineEnd,
+            separator=separator, header=header, includeRowIdAndRowVersion=includeRowIdAndRowVersion)
+
+        query_result_cache, key = self._queryResultCacheKey(query, download_from_table_request)
+        if key is not None:
+            cached = query_result_cache.get(key)
+            if cached is not None:
+                return cached
+
+        download_from_table_result = self._waitForAsync(uri=uri, request=download_from_table_request)
+        download_from_table_result, path = self._downloadQueryTableCsvResult(query, download_from_table_result)
+        if key is not None:
+            query_result_cache.add(key, download_from_table_result, path)
+        return (download_from_table_result, path)
+
+
+    def _queryTableCsvSharded(self, query, shards, **csv_options):
+        """
+        Run a CSV query as several queries, each over a consecutive window of rows selected with
+        LIMIT and OFFSET, and join the resulting CSV files. The windows are sized by first asking
+        Synapse for the number of rows the query returns. The queries run concurrently and their
+        CSV files are downloaded in parallel.
+
+        The joined file is kept in the cache under the results file handle of the first shard, in
+        place of the CSV files of the shards, which are removed once they have been joined.
+
+        :returns: a tuple of the DownloadFromTableResult of the first shard and the path to the
+                  joined CSV file, or None if the query can't be split, for example because it
+                  aggregates rows or has its own LIMIT, or if the table changed while the shards
+                  were being queried
         """
+        sharded = self._shardQuery(query, shards)
+        if sharded is None:
+            return None
+        etag, shard_queries = sharded
+
+        results = self._waitForAsyncJobs([self._queryTableCsvRequest(shard_query, **csv_options) for shard_query in shard_queries])
+        ## the windows only line up if every shard saw the same version of the table
+        if any(result.get('etag', None) != etag for result in results):
+            return None
+
+        ## the same shards have been joined before
+        file_handle_id = results[0]['resultsFileHandleId']
+        suffix = '_%d_shards.csv' % len(results)
+        cached_file_path = self.cache.get(file_handle_id)
+        if cached_file_path is not None and cached_file_path.endswith(suffix):
+            return (results[0], cached_file_path)
 
+        pool = Pool(min(len(results), 8))
+        try:
+            downloads = pool.map(lambda args: self._downloadQueryTableCsvResult(*args), zip(shard_queries, results))
+        finally:
+            pool.terminate()
+
+        path = os.path.join(self.cache.get_cache_dir(file_handle_id),
+                            os.path.splitext(os.path.basename(downloads[0][1]))[0] + suffix)
+        with open(path, 'wb') as joined:
+            for i, (result, shard_path) in enumerate(downloads):
+                with open(shard_path, 'rb') as f:
+                    ## keep the header of the first file only
+                    if i > 0 and csv_options.get('header', True):
+                        f.readline()
+                    shutil.copyfileobj(f, joined)
+
+        for result, shard_path in downloads:
+            self.cache.remove(result['resultsFileHandleId'], shard_path)
+            os.remove(shard_path)
+        self.cache.add(file_handle_id, path)
+        return (results[0], path)
+
+
+    def _shardQuery(self, query, shards):
+        """
+        Split a query into queries over consecutive windows of its rows. The rows are ordered by
+        ROW_ID, after the query's own ORDER BY clause if it has one, so that the windows don't
+        overlap.
+
+        :returns: a tuple of the etag of the table when its rows were counted and the list of
+                  queries, or None if the query can't be split
+        """
+        unquoted = re.sub(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"", "''", query)
+        if re.search(r'\b(limit|offset|group\s+by|distinct)\b', unquoted, re.IGNORECASE) \
+                or table_aggregate_pattern.search(unquoted.lower()):
+            return None
+
+        query_result_bundle = self._queryTable(query, limit=1, partMask=0x3)
+        count = query_result_bundle['queryCount']
+        if count == 0:
+            return None
+        etag = query_result_bundle['queryResult']['queryResults'].get('etag', None)
+
+        shard_size = (count + shards - 1) // shards
+        order_by = re.search(r'\border\s+by\b(.*)$', unquoted, re.IGNORECASE | re.DOTALL)
+        if order_by is None:
+            order_by = ' ORDER BY ROW_ID'
+        elif re.search(r'\brow_id\b', order_by.group(1), re.IGNORECASE):
+            order_by = ''
+        else:
+            order_by = ', ROW_ID'
+        return etag, ['%s%s LIMIT %d OFFSET %d' % (query.strip(), order_by, shard_size, offset)
+                      for offset in range(0, count, shard_size)]
+
+
+    def _queryTableCsvRequest(self, query, quoteCharacter='"', escapeCharacter="\\", lineEnd=os.linesep, separator=",", header=True, includeRowIdAndRowVersion=True):
+        """
+        Build the URI and DownloadFromTableRequest of the asynchronous job run by :py:meth:`~._queryTableCsv`.
+        """
         download_from_table_request = {
             "concreteType": "org.sagebionetworks.repo.model.table.DownloadFromTableRequest",
             "csvTableDescriptor": {
@@ -2975,7 +3555,33 @@ class Synapse:
             "includeRowIdAndRowVersion": includeRowIdAndRowVersion}
 
         uri = "/entity/{id}/table/download/csv/async".format(id=_extract_synapse_id_from_query(query))
-        download_from_table_result = self._waitForAsync(uri=uri, request=download_from_table_request)
+        return uri, download_from_table_request
+
+
+    def _queryResultCacheKey(self, query, download_from_table_request):
+        """
+        Look up the current etag of the queried table to key its results in the query result cache.
+        Only queries of TableEntities are cached, as the etag of a view doesn't change with the
+        entities in its scope.
+
+        :returns: a tuple of a :py:class:`synapseclient.cache.QueryResultCache` and the key of
+                  the query, or (None, None) if the results of the query aren't to be cached
+        """
+        if not self.table_query_cache_size:
+            return (None, None)
+        table = self.restGET('/entity/%s' % _extract_synapse_id_from_query(query))
+        if table.get('concreteType', None) != concrete_types.TABLE_ENTITY:
+            return (None, None)
+        query_result_cache = cache.QueryResultCache(self.cache, self.table_query_cache_size)
+        return (query_result_cache, query_result_cache.key(query, download_from_table_request, table['etag']))
+
+
+    def _downloadQueryTableCsvResult(self, query, download_from_table_result):
+        """
+        Download (or find in the cache) the CSV file produced by a DownloadFromTableRequest.
+
+        :returns: a tuple of the DownloadFromTableResult and the path to the CSV file
+        """
         file_handle_id = download_from_table_result['resultsFileHandleId']
         cached_file_path = self.cache.get(file_handle_id=file_handle_id)
         if cached_file_path is not None:
@@ -3101,6 +3707,9 @@ class Synapse:
         :param table:            table query result
         :param columns:           a list of column names as strings
 
+        The max_files_per_request and max_parallel keyword arguments are passed on to
+        :py:meth:`iterDownloadTableColumns`.
+
         :returns: a dictionary from file handle ID to path in the local file system.
 
         For example, consider a Synapse table whose ID is "syn12345" with two columns of type File
@@ -3116,12 +3725,37 @@ class Synapse:
                 with open(path) as f:
                     data[file_handle_id] = f.read()
 
+        To start working on the files as they arrive, use :py:meth:`iterDownloadTableColumns`.
+        """
+        download_kwargs = {key: kwargs[key] for key in ('max_files_per_request', 'max_parallel') if key in kwargs}
+        return OrderedDict(self.iterDownloadTableColumns(table, columns, **download_kwargs))
+
+
+    def iterDownloadTableColumns(self, table, columns, max_files_per_request=2500, max_parallel=4):
+        """
+        Bulk download of table-associated files, generating each file as soon as it is in the cache.
+
+        Files already in the cache come first. The rest are requested in zip files of up to
+        max_files_per_request files, several at once, and the entries of each zip file are
+        extracted into the cache while it downloads.
+
+        :param table:                 table query result
+        :param columns:               a list of column names as strings
+        :param max_files_per_request: the number of files in each zip file
+        :param max_parallel:          the number of zip files requested and downloaded at once
+
+        :returns: a generator of (file handle ID, path in the local file system) pairs
+
+        Example::
+
+            results = syn.tableQuery('SELECT * FROM syn12345')
+            for file_handle_id, path in syn.iterDownloadTableColumns(results, ['foo']):
+                process(path)
         """
 
         FAILURE_CODES = ["NOT_FOUND", "UNAUTHORIZED", "DUPLICATE", "EXCEEDS_SIZE_LIMIT", "UNKNOWN_ERROR"]
         RETRIABLE_FAILURE_CODES = ["EXCEEDS_SIZE_LIMIT"]
         MAX_DOWNLOAD_TRIES = 100
-        max_files_per_request = kwargs.get('max_files_per_request', 2500)
         #Rowset tableQuery result not allowed
         if isinstance(table, TableQueryResult):
             raise ValueError("downloadTableColumn doesn't work with rowsets. Please use default tableQuery settings.")
@@ -3134,67 +3768,100 @@ class Synapse:
 
         print("Downloading %d files, %d cached locally" % (len(file_handle_associations), len(file_handle_to_path_map)))
 
-        permanent_failures = OrderedDict()
+        for file_handle_id, path in file_handle_to_path_map.items():
+            yield file_handle_id, path
 
+        permanent_failures = OrderedDict()
+        downloaded = set()
+
+        ## extracted files and finished jobs are reported through this queue by the
+        ## threads downloading the zip files
+        results = queue.Queue()
+        pending = collections.deque(file_handle_associations[i:i+max_files_per_request]
+                                    for i in range(0, len(file_handle_associations), max_files_per_request))
+        in_flight = {}
         attempts = 0
-        while len(file_handle_associations) > 0 and attempts < MAX_DOWNLOAD_TRIES:
-            attempts += 1
-
-            file_handle_associations_batch = file_handle_associations[:max_files_per_request]
-
-            ##------------------------------------------------------------
-            ## call async service to build zip file
-            ##------------------------------------------------------------
-
-            ## returns a BulkFileDownloadResponse:
-            ##   http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/BulkFileDownloadResponse.html
-            request = dict(
-                concreteType="org.sagebionetworks.repo.model.file.BulkFileDownloadRequest",
-                requestedFiles=file_handle_associations_batch)
-            response = self._waitForAsync(uri='/file/bulk/async', request=request, endpoint=self.fileHandleEndpoint)
-
-            ##------------------------------------------------------------
-            ## download zip file
-            ##------------------------------------------------------------
-
-            temp_dir = tempfile.mkdtemp()
-            zipfilepath = os.path.join(temp_dir,"table_file_download.zip")
-            try:
-                zipfilepath = self._downloadFileHandle(response['resultZipFileHandleId'], table.tableId , 'TableEntity', zipfilepath)
-                ## TODO handle case when no zip file is returned
-                ## TODO test case when we give it partial or all bad file handles
-                ## TODO test case with deleted fileHandleID
-                ## TODO return null for permanent failures
+        ## the scheduler only waits for the jobs, the zip files are downloaded on threads of their own
+        executor = ThreadPoolExecutor(max_workers=max_parallel)
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < max_parallel and attempts < MAX_DOWNLOAD_TRIES:
+                    attempts += 1
+                    batch = pending.popleft()
+
+                    ## returns a BulkFileDownloadResponse:
+                    ##   http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/BulkFileDownloadResponse.html
+                    request = dict(
+                        concreteType="org.sagebionetworks.repo.model.file.BulkFileDownloadRequest",
+                        requestedFiles=batch)
+                    job = self._async_job_scheduler.submit('/file/bulk/async', request, endpoint=self.fileHandleEndpoint)
+                    future = executor.submit(lambda job: self._downloadBulkZip(job.result(), table.tableId, results), job)
+                    in_flight[future] = (batch, job)
+                    future.add_done_callback(lambda future: results.put(('done', future)))
+                if not in_flight:
+                    ## TODO if there are files we still haven't downloaded
+                    break
 
-                ##------------------------------------------------------------
-                ## unzip into cache
-                ##------------------------------------------------------------
+                message = results.get()
+                if message[0] == 'file':
+                    file_handle_id, path = message[1:]
+                    downloaded.add(file_handle_id)
+                    yield file_handle_id, path
+                    continue
+
+                future = message[1]
+                batch, job = in_flight.pop(future)
+                response = future.result()
+                for summary in response['fileSummary']:
+                    if summary['status'] != 'SUCCESS' and summary['failureCode'] not in RETRIABLE_FAILURE_CODES:
+                        permanent_failures[summary['fileHandleId']] = summary
+
+                ## Do we have remaining files to download?
+                remaining = [fha for fha in batch
+                             if fha['fileHandleId'] not in downloaded
+                             and fha['fileHandleId'] not in permanent_failures]
+                if remaining:
+                    pending.append(remaining)
+        finally:
+            for future, (batch, job) in in_flight.items():
+                job.cancel()
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+    def _downloadBulkZip(self, response, table_id, results):
+        """
+        Download the zip file of a BulkFileDownloadResponse, extracting its files into the cache
+        and putting ('file', file handle ID, path) on the results queue for each one.
+        """
+        ## the directory structure within the zip follows that of the cache:
+        ## {fileHandleId modulo 1000}/{fileHandleId}/{fileName}
+        entries = {summary['zipEntryName']: summary['fileHandleId']
+                   for summary in response['fileSummary'] if summary['status'] == 'SUCCESS'}
+
+        def extracted(entry_name, filepath):
+            self.cache.add(entries[entry_name], filepath)
+            results.put(('file', entries[entry_name], filepath))
+
+        extractor = ZipStreamExtractor({name: self.cache.get_cache_dir(file_handle_id) for name, file_handle_id in entries.items()},
+                                       extracted)
+        temp_dir = tempfile.mkdtemp()
+        zipfilepath = os.path.join(temp_dir, "table_file_download.zip")
+        try:
+            ## TODO handle case when no zip file is returned
+            zipfilepath = self._downloadFileHandle(response['resultZipFileHandleId'], table_id, 'TableEntity', zipfilepath,
+                                                   chunk_callback=extractor.feed)
 
+            ## entries that could not be extracted as the zip streamed in are read from the whole file
+            remaining = [name for name in entries if name not in extractor.extracted]
+            if remaining:
                 with zipfile.ZipFile(zipfilepath) as zf:
-                    ## the directory structure within the zip follows that of the cache:
-                    ## {fileHandleId modulo 1000}/{fileHandleId}/{fileName}
-                    for summary in response['fileSummary']:
-                        if summary['status'] == 'SUCCESS':
-                            cache_dir = self.cache.get_cache_dir(summary['fileHandleId'])
-                            filepath = _extract_zip_file_to_directory(zf, summary['zipEntryName'], cache_dir)
-                            self.cache.add(summary['fileHandleId'], filepath)
-                            file_handle_to_path_map[summary['fileHandleId']] = filepath
-                        elif summary['failureCode'] not in RETRIABLE_FAILURE_CODES:
-                            permanent_failures[summary['fileHandleId']] = summary
-
-            finally:
-                if os.path.exists(zipfilepath):
-                    os.remove(zipfilepath)
-
-            ## Do we have remaining files to download?
-            file_handle_associations = [
-                fha for fha in file_handle_associations
-                    if fha['fileHandleId'] not in file_handle_to_path_map
-                    and fha['fileHandleId'] not in permanent_failures.keys()]
-
-        ## TODO if there are files we still haven't downloaded
-
-        return file_handle_to_path_map
+                    for name in remaining:
+                        extracted(name, _extract_zip_file_to_directory(zf, name, self.cache.get_cache_dir(entries[name])))
+        finally:
+            extractor.close()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        return response
 
 
     def _build_table_download_file_handle_list(self, table, columns):
@@ -3262,24 +3929,48 @@ class Synapse:
         return self.restPOST(uri='/entity', body=json.dumps(get_properties(entity)))
 
 
-    def _updateEntity(self, entity, incrementVersion=True, versionLabel=None):
+    def _createEntityBundle(self, entity, annotations, generatedBy=None):
+        """
+        Create a new entity and its annotations in Synapse with a single request.
+
+        :param entity:      A dictionary representing an Entity or a Synapse Entity object
+        :param annotations: A dictionary of annotations in Synapse format or a Python format
+        :param generatedBy: Optional ID of the Activity that generated the entity
+
+        :returns: An `EntityBundle <http://docs.synapse.org/rest/org/sagebionetworks/repo/model/EntityBundle.html>`_
+                  holding the entity and its annotations
+        """
+        synapseAnnos = to_synapse_annotations(annotations)
+        synapseAnnos = {key: value for key, value in synapseAnnos.items() if key not in ('id', 'etag')}
+        uri = '/entity/bundle'
+        if generatedBy is not None:
+            uri += '?generatedBy=%s' % generatedBy
+        bundle = {'entity': get_properties(entity), 'annotations': synapseAnnos}
+        return self.restPOST(uri, body=json.dumps(bundle))
+
+
+    def _updateEntity(self, entity, incrementVersion=True, versionLabel=None, generatedBy=None):
         """
         Update an existing entity in Synapse.
 
-        :param entity: A dictionary representing an Entity or a Synapse Entity object
+        :param entity:      A dictionary representing an Entity or a Synapse Entity object
+        :param generatedBy: Optional ID of the Activity that generated the entity. Ignored when
+                            a new version is created.
 
         :returns: A dictionary containing an Entity's properties
         """
 
         uri = '/entity/%s' % id_of(entity)
+        self._invalidateEntityBundles(entity)
 
-        if is_versionable(entity):
-            if incrementVersion or versionLabel is not None:
-                uri += '/version'
-                if 'versionNumber' in entity:
-                    entity['versionNumber'] += 1
-                    if 'versionLabel' in entity:
-                        entity['versionLabel'] = str(entity['versionNumber'])
+        if is_versionable(entity) and (incrementVersion or versionLabel is not None):
+            uri += '/version'
+            if 'versionNumber' in entity:
+                entity['versionNumber'] += 1
+                if 'versionLabel' in entity:
+                    entity['versionLabel'] = str(entity['versionNumber'])
+        elif generatedBy is not None:
+            uri += '?generatedBy=%s' % generatedBy
 
         if versionLabel:
             entity['versionLabel'] = str(versionLabel)
@@ -3396,6 +4087,7 @@ class Synapse:
 
         :returns: JSON encoding of response
         """
+        self._invalidateOnWrite(uri)
         uri, headers = self._build_uri_and_headers(uri, endpoint, headers)
         retryPolicy = self._build_retry_policy(retryPolicy)
 
@@ -3417,6 +4109,7 @@ class Synapse:
         :returns: JSON encoding of response
         """
 
+        self._invalidateOnWrite(uri)
         uri, headers = self._build_uri_and_headers(uri, endpoint, headers)
         retryPolicy = self._build_retry_policy(retryPolicy)
 
@@ -3436,6 +4129,7 @@ class Synapse:
         :param kwargs:   Any other arguments taken by a `requests <http://docs.python-requests.org/en/latest/>`_ method
         """
 
+        self._invalidateOnWrite(uri)
         uri, headers = self._build_uri_and_headers(uri, endpoint, headers)
         retryPolicy = self._build_retry_policy(retryPolicy)
 
@@ -3447,6 +4141,9 @@ class Synapse:
     def _build_uri_and_headers(self, uri, endpoint=None, headers=None):
         """Returns a tuple of the URI and headers to request with."""
 
+        if self.offline:
+            raise SynapseOfflineError("Can't request %s in offline mode" % uri)
+
         if endpoint == None:
             endpoint = self.repoEndpoint
 
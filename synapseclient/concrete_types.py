@@ -5,4 +5,6 @@ Constant variables for Synapse's concreteType
 #Concrete types for UploadDestinations
 SYNAPSE_S3_UPLOAD_DESTINATION = 'org.sagebionetworks.repo.model.file.S3UploadDestination'
 EXTERNAL_UPLOAD_DESTINATION = 'org.sagebionetworks.repo.model.file.ExternalUploadDestination'
-EXTERNAL_S3_UPLOAD_DESTINATION = 'org.sagebionetworks.repo.model.file.ExternalS3UploadDestination'
\ No newline at end of file
+EXTERNAL_S3_UPLOAD_DESTINATION = 'org.sagebionetworks.repo.model.file.ExternalS3UploadDestination'
+#Concrete types for Tables
+TABLE_ENTITY = 'org.sagebionetworks.repo.model.table.TableEntity'
@@ -51,6 +51,9 @@ class SynapseUnmetAccessRestrictions(SynapseError):
 class SynapseProvenanceError(SynapseError):
     """Incorrect usage of provenance objects."""
 
+class SynapseOfflineError(SynapseError):
+    """A request to Synapse was needed while the client was in offline mode."""
+
 class SynapseHTTPError(SynapseError, requests.exceptions.HTTPError):
     """Wraps recognized HTTP errors.  See `HTTPError <http://docs.python-requests.org/en/latest/api/?highlight=exceptions#requests.exceptions.HTTPError>`_"""
 
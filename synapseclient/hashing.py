@@ -0,0 +1,113 @@
+"""
+************
+Bulk hashing
+************
+
+Computes the MD5s of many local files at once, as needed to upload a manifest of files or to
+look up local files used as provenance. Files are hashed concurrently by a pool of threads, as
+hashlib releases the GIL while it hashes large blocks, or by a pool of processes, which can help
+on file systems where reads hold the GIL or each file has a long latency::
+
+    md5s, stats = md5_for_files(paths, max_workers=8)
+    print(stats)
+
+.. autofunction:: synapseclient.hashing.md5_for_files
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import synapseclient.utils as utils
+
+DEFAULT_BLOCK_SIZE = 8*utils.MB
+DEFAULT_MAX_WORKERS = min(8, (os.cpu_count() if hasattr(os, 'cpu_count') else None) or 4)
+
+
+def _md5_hexdigest(path, block_size=DEFAULT_BLOCK_SIZE):
+    ## a module level function, so it can be sent to a process pool
+    return utils.md5_for_file(path, block_size=block_size).hexdigest()
+
+
+class HashingStats(object):
+    """
+    Counts the files and bytes hashed by :py:func:`md5_for_files`.
+
+    :ivar files:   number of files whose MD5 was returned
+    :ivar hashed:  number of those that had to be read, rather than being found in an index
+    :ivar bytes:   number of bytes read
+    :ivar seconds: time taken
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.hashed = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def throughput(self):
+        """Bytes read per second."""
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return 'Hashed %d of %d files, %s in %.1f seconds (%s/s)' % (self.hashed, self.files, utils.humanizeBytes(self.bytes),
+                                                                    self.seconds, utils.humanizeBytes(self.throughput))
+
+
+def md5_for_files(paths, md5_index=None, max_workers=DEFAULT_MAX_WORKERS, use_processes=False,
+                  block_size=DEFAULT_BLOCK_SIZE, progress=False):
+    """
+    Computes the MD5 of each of a collection of local files.
+
+    :param paths:         the paths of the files. Repeated paths are hashed once.
+    :param md5_index:     an optional :py:class:`synapseclient.cache.Md5Index` consulted before hashing
+                          a file and updated afterwards
+    :param max_workers:   the number of files hashed at the same time
+    :param use_processes: hash files in a pool of processes rather than threads
+    :param block_size:    the number of bytes read at a time from each file
+    :param progress:      print a progress bar of the bytes hashed to stdout
+
+    :returns: a tuple of an OrderedDict from each path to the hex digest of its MD5, in the order
+              given, and the :py:class:`HashingStats` of the work done
+    """
+    paths = list(collections.OrderedDict.fromkeys(paths))
+    stats = HashingStats()
+    stats.files = len(paths)
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    lock = threading.Lock()
+    started = time.time()
+    processes = ProcessPoolExecutor(max_workers) if use_processes else None
+
+    def hash_file(path):
+        if processes is not None:
+            md5 = processes.submit(_md5_hexdigest, path, block_size).result()
+        else:
+            md5 = _md5_hexdigest(path, block_size)
+        with lock:
+            stats.hashed += 1
+            stats.bytes += os.path.getsize(path)
+            if progress:
+                utils.printTransferProgress(stats.bytes, total_bytes, prefix='Hashing', dt=time.time() - started)
+        return md5
+
+    def md5_for_file(path):
+        if md5_index is not None:
+            return md5_index.md5_for_file(path, hash_file=hash_file)
+        return hash_file(path)
+
+    try:
+        ## threads wait on the processes, and look up and record MD5s in the index either way
+        with ThreadPoolExecutor(max(1, max_workers)) as threads:
+            md5s = list(threads.map(md5_for_file, paths))
+    finally:
+        if processes is not None:
+            processes.shutdown()
+    stats.seconds = time.time() - started
+    return collections.OrderedDict(zip(paths, md5s)), stats
@@ -16,6 +16,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from builtins import str
 
+import bisect
 import hashlib
 import json
 import math
@@ -37,7 +38,7 @@ except ImportError:
     from urlparse import parse_qs
 
 import synapseclient.exceptions as exceptions
-from .utils import printTransferProgress, md5_for_file, MB
+from .utils import printTransferProgress, MB
 from .dict_object import DictObject
 from .exceptions import SynapseError
 from .exceptions import SynapseHTTPError
@@ -197,7 +198,7 @@ def multipart_upload(syn, filepath, filename=None, contentType=None, storageLoca
     fileSize = os.path.getsize(filepath)
     if not filename:
         filename = os.path.basename(filepath)
-    md5 = md5_for_file(filepath).hexdigest()
+    md5 = syn._md5ForFile(filepath)
 
     if contentType is None:
         (mimetype, enc) = mimetypes.guess_type(filepath, strict=False)
@@ -259,6 +260,80 @@ def multipart_upload_string(syn, text, filename=None, contentType=None, storageL
     return status["resultFileHandleId"]
 
 
+def multipart_upload_chunks(syn, generate_chunks, filename, contentType=None, storageLocationId=None, **kwargs):
+    """
+    Upload data that is produced a piece at a time, for example by serializing a large data
+    structure, without first writing it to a file. The data is generated once to find its size
+    and MD5, and again as each part is uploaded, so that only about a part's worth of data is
+    held in memory at a time.
+
+    :param syn: a Synapse object
+    :param generate_chunks: a function that takes the index of a chunk and returns an iterator
+                            over the chunks of data, as bytes, starting at that chunk. It must
+                            produce the same data every time it's called.
+    :param filename: a string containing the base filename
+    :param contentType: `contentType`_
+    :param partSize: number of bytes per part. Minimum 5MB.
+    :param storageLocationId: a id indicating where the data should be stored. retrieved from Synapse's UploadDestination
+
+    :return: a File Handle ID
+
+    Keyword arguments are passed down to :py:func:`_multipart_upload` and
+    :py:func:`_start_multipart_upload`.
+
+    .. _contentType: https://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.17
+    """
+    ## the multipart upload is started with the size and MD5 of the whole
+    ## file, so make one pass over the data to find them, remembering where
+    ## each chunk starts
+    md5 = hashlib.md5()
+    fileSize = 0
+    offsets = []
+    for chunk in generate_chunks(0):
+        offsets.append(fileSize)
+        md5.update(chunk)
+        fileSize += len(chunk)
+
+    if not contentType:
+        contentType = "application/octet-stream"
+
+    get_chunk_function = lambda n,partSize: get_generated_chunk(generate_chunks, offsets, n, partSize)
+
+    status = _multipart_upload(syn, filename, contentType,
+                               get_chunk_function=get_chunk_function,
+                               md5=md5.hexdigest(),
+                               fileSize=fileSize,
+                               storageLocationId=storageLocationId,
+                               **kwargs)
+
+    return status["resultFileHandleId"]
+
+
+def get_generated_chunk(generate_chunks, offsets, n, chunksize=8*MB):
+    """
+    Return the nth chunk of data produced by a function, generating only the pieces that overlap it.
+
+    :param generate_chunks: see :py:func:`multipart_upload_chunks`
+    :param offsets: the offsets at which each of the pieces produced by generate_chunks starts
+    """
+    start = (n-1)*chunksize
+    end = start + chunksize
+    if not offsets or start >= end:
+        return b''
+    i = max(0, bisect.bisect_right(offsets, start) - 1)
+    position = offsets[i]
+    pieces = []
+    chunks = generate_chunks(i)
+    ## stop before generating a piece that starts past the end of the chunk
+    while position < end:
+        piece = next(chunks, None)
+        if piece is None:
+            break
+        pieces.append(piece[max(0, start-position):end-position])
+        position += len(piece)
+    return b''.join(pieces)
+
+
 def _upload_chunk(part, completed, status, syn, filename, get_chunk_function,
                   fileSize, partSize, t0, expired, bytes_already_uploaded = 0):
     partNumber=part["partNumber"]
@@ -89,6 +89,20 @@ Get query results as a `DataFrame <http://pandas.pydata.org/pandas-docs/stable/a
     results = syn.tableQuery("select * from %s where Chromosome='2'" % table.schema.id)
     df = results.asDataFrame()
 
+-------------------
+Arrow and Parquet
+-------------------
+
+If `pyarrow <https://arrow.apache.org/docs/python/>`_ is installed, query results can be
+returned as an Arrow table whose columns are typed according to the table's columns::
+
+    arrow_table = syn.tableQuery("select * from %s" % table.schema.id, resultsAs="arrow")
+
+The downloaded CSV is converted to a Parquet file kept in the cache next to the CSV, so
+loading the same query results again reads the memory-mapped Parquet file without
+parsing any text. A CSV query result can also be written to a Parquet file of your
+choosing with :py:meth:`CsvFileTable.toParquet`.
+
 --------------
 Changing Data
 --------------
@@ -237,6 +251,21 @@ Row
 .. autoclass:: synapseclient.table.Row
    :members: __init__
 
+Large query results can be held in a RowSet whose values are stored column by column,
+which takes a fraction of the memory of one :py:class:`Row` per row::
+
+    rowset = syn.tableQuery("select * from %s" % table.schema.id).asRowSet(compact=True)
+
+.. autoclass:: synapseclient.table.ColumnarRows
+   :members:
+
+To change only some of the cells of existing rows, store a :py:class:`PartialRowSet`::
+
+    syn.store(PartialRowSet(schema, [PartialRow({column.id: 'new value'}, rowId=5)]))
+
+.. autoclass:: synapseclient.table.PartialRowSet
+.. autoclass:: synapseclient.table.PartialRow
+
 ~~~~~~
 Table
 ~~~~~~
@@ -274,22 +303,29 @@ from future.utils import bytes_to_native_str
 from builtins import str
 
 from backports import csv
+import array
+import collections
 import io
 import json
+import math
 import os
 import re
 import six
 import sys
 import tempfile
+import threading
 from collections import OrderedDict
+from six.moves import queue
 from builtins import zip
 from abc import ABCMeta, abstractmethod, abstractproperty
+from concurrent.futures import ThreadPoolExecutor
 
 import synapseclient
 import synapseclient.utils as utils
 from synapseclient.exceptions import *
 from synapseclient.dict_object import DictObject
 from synapseclient.entity import Entity, Versionable
+from synapseclient.multipart_upload import multipart_upload, multipart_upload_chunks
 
 
 aggregate_pattern = re.compile(r'(count|max|min|avg|sum)\((.+)\)')
@@ -317,6 +353,19 @@ def test_import_pandas():
         raise
 
 
+def test_import_pyarrow():
+    try:
+        import pyarrow
+    except:
+        sys.stderr.write("""\n\npyarrow not installed!\n
+        The synapseclient package recommends but doesn't require the
+        installation of pyarrow. If you'd like to use Arrow tables or
+        Parquet files, refer to the installation instructions at:
+          https://arrow.apache.org/docs/python/install.html.
+        \n\n\n""")
+        raise
+
+
 def encode_param_in_python2(a, encoding=None):
     """
     In Python2, the csv module takes parameters that must be encoded byte
@@ -417,9 +466,150 @@ def row_labels_from_id_and_version(rows):
 def row_labels_from_rows(rows):
     return row_labels_from_id_and_version([(row['rowId'], row['versionNumber']) for row in rows])
 
+## pandas dtypes used to read each Synapse column type when asDataFrame is asked
+## to use the column types. STRING columns with few distinct values are further
+## converted to categoricals once they are read.
+PANDAS_DTYPES = {'STRING': 'string',
+                 'DOUBLE': 'float64',
+                 'INTEGER': 'Int64',
+                 'BOOLEAN': 'boolean',
+                 'DATE': 'Int64',
+                 'FILEHANDLEID': 'string',
+                 'ENTITYID': 'string',
+                 'LINK': 'string',
+                 'LARGETEXT': 'string',
+                 'USERID': 'string'}
+
+## number of rows of a data frame serialized at a time when streaming it to Synapse
+DATA_FRAME_CHUNK_ROWS = 10000
+
+## number of times a batch of rows is retried when storing a table in batches
+MAX_BATCH_RETRIES = 3
+
+## a STRING column becomes a category when its number of distinct values is at
+## most this fraction of the number of rows
+CATEGORY_MAX_DISTINCT_FRACTION = 0.5
+
+
+def pandas_dtypes_from_headers(headers, exclude=()):
+    """
+    Map column names to the pandas dtypes that hold values of their Synapse column type.
+    ROW_ID and ROW_VERSION are integers. Requires pandas 1.0 or later, which has
+    nullable integer, boolean and string types.
+
+    :param headers: a list of :py:class:`synapseclient.table.SelectColumn` objects
+    :param exclude: names of columns to leave out, for example DATE columns parsed as datetimes
+    """
+    import pandas as pd
+    if not hasattr(pd, 'StringDtype'):
+        raise ValueError("Reading tables using their column types requires pandas 1.0 or later, found %s" % pd.__version__)
+
+    dtypes = {}
+    for header in headers:
+        if header.name in exclude:
+            continue
+        if header.name in ('ROW_ID', 'ROW_VERSION'):
+            dtypes[header.name] = 'Int64'
+        else:
+            dtypes[header.name] = PANDAS_DTYPES[header.get('columnType', 'STRING')]
+    return dtypes
+
+
+def _unknown_column_type(columnType):
+    def convert(field):
+        raise ValueError("Unknown column type: %s" % columnType)
+    return convert
+
+
+## functions converting non-empty fields of each column type from strings
+_COLUMN_TYPE_CONVERTERS = {'DOUBLE': float,
+                           'INTEGER': int,
+                           'BOOLEAN': to_boolean,
+                           'DATE': utils.from_unix_epoch_time}
+
+## column types whose values are left as strings
+_STRING_COLUMN_TYPES = frozenset(['STRING', 'ENTITYID', 'FILEHANDLEID', 'LARGETEXT', 'USERID', 'LINK'])
+
+
+def row_decoder(headers):
+    """
+    Build a function that converts a row of table query results from strings to the correct
+    column types. The converter for each column is looked up once, so the returned function
+    is much faster than :py:func:`cast_values` for converting many rows with the same headers.
+
+    See: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/table/ColumnType.html
+    """
+    converters = []
+    for header in headers:
+        columnType = header.get('columnType', 'STRING')
+        if columnType in _STRING_COLUMN_TYPES:
+            converters.append(None)
+        else:
+            converters.append(_COLUMN_TYPE_CONVERTERS.get(columnType) or _unknown_column_type(columnType))
+    converters = tuple(converters)
+    n_columns = len(converters)
+
+    def check_length(values):
+        if len(values) != n_columns:
+            raise ValueError('Each field in the row must have a matching column header. %d fields, %d headers' % (len(values), n_columns))
+
+    if not any(converters):
+        ## all fields are strings, only empty fields need converting
+        def decode_strings(values):
+            check_length(values)
+            return [None if field == '' else field for field in values]
+        return decode_strings
+
+    def decode(values):
+        check_length(values)
+        return [None if field is None or field == '' else (convert(field) if convert else field)
+                for convert, field in zip(converters, values)]
+    return decode
+
+
+def arrow_types_from_headers(headers):
+    """
+    Map column names to the Arrow types used to read each Synapse column type from a CSV
+    file. DATE columns are read as integer milliseconds, see :py:func:`arrow_schema_from_headers`.
+
+    :param headers: a list of :py:class:`synapseclient.table.SelectColumn` objects
+    """
+    import pyarrow as pa
+    arrow_types = {'STRING': pa.string(),
+                   'DOUBLE': pa.float64(),
+                   'INTEGER': pa.int64(),
+                   'BOOLEAN': pa.bool_(),
+                   'DATE': pa.int64(),
+                   'FILEHANDLEID': pa.string(),
+                   'ENTITYID': pa.string(),
+                   'LINK': pa.string(),
+                   'LARGETEXT': pa.string(),
+                   'USERID': pa.string()}
+
+    types = {}
+    for header in headers:
+        if header.name in ('ROW_ID', 'ROW_VERSION'):
+            types[header.name] = pa.int64()
+        else:
+            types[header.name] = arrow_types[header.get('columnType', 'STRING')]
+    return types
+
+
+def arrow_schema_from_headers(schema, headers):
+    """
+    Change the fields of an Arrow schema read from a CSV file that hold Synapse DATE columns
+    into UTC timestamps with millisecond resolution.
+    """
+    import pyarrow as pa
+    date_columns = set(header.name for header in headers if header.get('columnType', None) == 'DATE')
+    return pa.schema([pa.field(field.name, pa.timestamp('ms', tz='UTC')) if field.name in date_columns else field
+                      for field in schema])
+
+
 def cast_values(values, headers):
     """
     Convert a row of table query results from strings to the correct column type.
+    To convert many rows, build a converter once using :py:func:`row_decoder`.
 
     See: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/table/ColumnType.html
     """
@@ -434,32 +624,87 @@ def cast_values(values, headers):
         ## convert field to column type
         if field is None or field=='':
             result.append(None)
-        elif columnType in {'STRING', 'ENTITYID', 'FILEHANDLEID', 'LARGETEXT', 'USERID'}:
+        elif columnType in _STRING_COLUMN_TYPES:
             result.append(field)
-        elif columnType=='DOUBLE':
-            result.append(float(field))
-        elif columnType=='INTEGER':
-            result.append(int(field))
-        elif columnType=='BOOLEAN':
-            result.append(to_boolean(field))
-        elif columnType=='DATE':
-            result.append(utils.from_unix_epoch_time(field))
+        elif columnType in _COLUMN_TYPE_CONVERTERS:
+            result.append(_COLUMN_TYPE_CONVERTERS[columnType](field))
         else:
             raise ValueError("Unknown column type: %s" % columnType)
 
     return result
 
 
-def cast_row(row, headers):
-    row['values'] = cast_values(row['values'], headers)
+def cast_row(row, headers, decode=None):
+    row['values'] = (decode or row_decoder(headers))(row['values'])
     return row
 
 
 def cast_row_set(rowset):
-    for i, row in enumerate(rowset['rows']):
-        rowset['rows'][i]['values'] = cast_row(row, rowset['headers'])
+    decode = row_decoder(rowset['headers'])
+    for row in rowset['rows']:
+        row['values'] = decode(row['values'])
     return rowset
 
+
+def _csv_line_ends_in_quotes(line, quote, escape, in_quotes=False):
+    """
+    Given whether a line of a CSV file starts inside a quoted field, return whether it ends inside one.
+    """
+    if quote is None:
+        return False
+    if escape is None or escape not in line:
+        return in_quotes != (line.count(quote) % 2 == 1)
+    escaped = False
+    for c in line:
+        if escaped:
+            escaped = False
+        elif c == escape:
+            escaped = True
+        elif c == quote:
+            in_quotes = not in_quotes
+    return in_quotes
+
+
+class _PagePrefetcher(object):
+    """
+    Retrieves the pages of a rowset query on a background thread so that the
+    next page is requested while the current one is being consumed. At most
+    `depth` pages are held in memory waiting to be consumed.
+    """
+    def __init__(self, syn, tableId, nextPageToken, depth=1):
+        self._pages = queue.Queue(maxsize=max(1, depth))
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._fetch_pages, args=(syn, tableId, nextPageToken))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fetch_pages(self, syn, tableId, nextPageToken):
+        while nextPageToken and not self._stopped.is_set():
+            try:
+                result = syn._queryTableNext(nextPageToken, tableId)
+                nextPageToken = result.get('nextPageToken', None)
+                page = (result, None)
+            except Exception:
+                nextPageToken = None
+                page = (None, sys.exc_info())
+            ## block while the buffer is full, but give up if the consumer goes away
+            while not self._stopped.is_set():
+                try:
+                    self._pages.put(page, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def get(self):
+        """Return the next page, re-raising any error encountered while fetching it."""
+        result, exc_info = self._pages.get()
+        if exc_info is not None:
+            six.reraise(*exc_info)
+        return result
+
+    def stop(self):
+        self._stopped.set()
+
 @six.add_metaclass(ABCMeta)
 class SchemaBase(Entity, Versionable):
     '''
@@ -709,7 +954,8 @@ class RowSet(DictObject):
     @classmethod
     def from_json(cls, json):
         headers=[SelectColumn(**header) for header in json.get('headers', [])]
-        rows=[cast_row(Row(**row), headers) for row in json.get('rows', [])]
+        decode = row_decoder(headers)
+        rows=[cast_row(Row(**row), headers, decode) for row in json.get('rows', [])]
         return cls(headers=headers, rows=rows,
             **{ key: json[key] for key in json.keys() if key not in ['headers', 'rows'] })
 
@@ -740,10 +986,27 @@ class RowSet(DictObject):
             toAppend=self,
             entityId=self.tableId)
 
+        if isinstance(self.get('rows', None), ColumnarRows):
+            ## serialize the rows straight from their columns rather than a dict per row
+            del arsr['toAppend']
+            arsr = _json_with(arsr, 'toAppend',
+                              _json_with({key: value for key, value in self.items() if key != 'rows'}, 'rows', self.rows.json()))
+
         uri = "/entity/{id}/table/append/async".format(id=self.tableId)
         response = syn._waitForAsync(uri=uri, request=arsr)
         return response.get('rowReferenceSet', response)
 
+    def _json_dict(self):
+        if isinstance(self.get('rows', None), ColumnarRows):
+            return dict(self, rows=list(self.rows.iter_json()))
+        return self
+
+    def __str__(self):
+        return json.dumps(self._json_dict(), sort_keys=True, indent=2)
+
+    def json(self, ensure_ascii=True):
+        return json.dumps(self._json_dict(), sort_keys=True, indent=2, ensure_ascii=ensure_ascii)
+
     def _synapse_delete(self, syn):
         """
         Delete the rows in the RowSet.
@@ -774,6 +1037,149 @@ class Row(DictObject):
             self.versionNumber = versionNumber
 
 
+## typecode of the arrays holding row IDs and version numbers, with -1 for rows that have none
+_ROW_ID_TYPECODE = str('q') if six.PY3 else str('l')
+
+
+class ColumnarRows(collections.Sequence):
+    """
+    The rows of a :py:class:`RowSet` stored as one list of values per column plus arrays of
+    row IDs and version numbers, rather than as a :py:class:`Row` per row. Indexing or iterating
+    creates :py:class:`Row` objects on the fly, so changes made to those rows are not kept.
+
+    :param n_columns: the number of values in each row
+    :param rows:      optional :py:class:`Row` objects to add
+    """
+    def __init__(self, n_columns, rows=()):
+        self.columns = [[] for i in range(n_columns)]
+        self.rowIds = array.array(_ROW_ID_TYPECODE)
+        self.versionNumbers = array.array(_ROW_ID_TYPECODE)
+        for row in rows:
+            self.append(row)
+
+    def append(self, row):
+        """
+        Add a row, given as a :py:class:`Row` or a list of values.
+        """
+        if isinstance(row, collections.Mapping):
+            values, rowId, versionNumber = row['values'], row.get('rowId', None), row.get('versionNumber', None)
+        else:
+            values, rowId, versionNumber = row, None, None
+        if len(values) != len(self.columns):
+            raise ValueError('Each row must have %d values, got %d' % (len(self.columns), len(values)))
+        for column, value in zip(self.columns, values):
+            column.append(value)
+        self.rowIds.append(-1 if rowId is None else int(rowId))
+        self.versionNumbers.append(-1 if versionNumber is None else int(versionNumber))
+
+    def __len__(self):
+        return len(self.rowIds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        rowId = self.rowIds[index]
+        versionNumber = self.versionNumbers[index]
+        return Row([column[index] for column in self.columns],
+                   rowId=None if rowId < 0 else rowId,
+                   versionNumber=None if versionNumber < 0 else versionNumber)
+
+    def __iter__(self):
+        for row in self.iter_json():
+            yield Row(**row)
+
+    def iter_json(self):
+        """
+        Generate the rows in the shape of the REST API's `Row <http://docs.synapse.org/rest/org/sagebionetworks/repo/model/table/Row.html>`_.
+        """
+        for rowId, versionNumber, values in zip(self.rowIds, self.versionNumbers, zip(*self.columns) if self.columns else [()] * len(self)):
+            row = {'values': list(values)}
+            if rowId >= 0:
+                row['rowId'] = rowId
+            if versionNumber >= 0:
+                row['versionNumber'] = versionNumber
+            yield row
+
+    def json(self):
+        """
+        Serialize the rows to a JSON array of `Rows <http://docs.synapse.org/rest/org/sagebionetworks/repo/model/table/Row.html>`_,
+        written one row at a time from the columns, without creating a dictionary per row.
+        """
+        out = six.StringIO()
+        out.write('[')
+        for i, (rowId, versionNumber, values) in enumerate(zip(self.rowIds, self.versionNumbers, zip(*self.columns) if self.columns else [()] * len(self))):
+            out.write(', {"values": ' if i > 0 else '{"values": ')
+            out.write(json.dumps(values))
+            if rowId >= 0:
+                out.write(', "rowId": %d' % rowId)
+            if versionNumber >= 0:
+                out.write(', "versionNumber": %d' % versionNumber)
+            out.write('}')
+        out.write(']')
+        return out.getvalue()
+
+
+def _json_with(obj, key, value_json):
+    """
+    Serialize a dictionary to JSON text, adding a key whose value is text that's already JSON.
+    """
+    text = json.dumps(obj)
+    return text[:-1] + (', ' if obj else '') + json.dumps(key) + ': ' + value_json + '}'
+
+
+class PartialRowSet(DictObject):
+    """
+    A Synapse object of type `org.sagebionetworks.repo.model.table.PartialRowSet <http://docs.synapse.org/rest/org/sagebionetworks/repo/model/table/PartialRowSet.html>`_,
+    which changes individual cells of existing rows without sending the cells that stay the same.
+
+    :param tableId: The ID of the TableEntity that owns these rows
+    :param rows:    The :py:class:`synapseclient.table.PartialRow`s of this set
+
+    Example::
+
+        row = PartialRow({'1234': 'new value'}, rowId=5)
+        syn.store(PartialRowSet('syn123', [row]))
+    """
+    def __init__(self, tableId, rows, **kwargs):
+        kwargs['tableId'] = utils.id_of(tableId)
+        kwargs['rows'] = list(rows)
+        kwargs['concreteType'] = 'org.sagebionetworks.repo.model.table.PartialRowSet'
+        super(PartialRowSet, self).__init__(kwargs)
+
+    def _synapse_store(self, syn):
+        """
+        Creates and POSTs an AppendableRowSetRequest_
+
+        .. AppendableRowSetRequest: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/table/AppendableRowSetRequest.html
+        """
+        arsr = dict(
+            concreteType='org.sagebionetworks.repo.model.table.AppendableRowSetRequest',
+            toAppend=self,
+            entityId=self.tableId)
+
+        uri = "/entity/{id}/table/append/async".format(id=self.tableId)
+        response = syn._waitForAsync(uri=uri, request=arsr)
+        return response.get('rowReferenceSet', response)
+
+
+class PartialRow(DictObject):
+    """
+    A `partial row <http://docs.synapse.org/rest/org/sagebionetworks/repo/model/table/PartialRow.html>`_
+    of a :py:class:`PartialRowSet`, giving new values for some of the cells of a row.
+
+    :param values: A dictionary from column ID to the new value of the cell, or None to clear it
+    :param rowId:  The ID of the row to change, or None to append a new row
+    """
+    def __init__(self, values, rowId=None):
+        super(PartialRow, self).__init__()
+        ## cells are sent as strings
+        self.values = {str(column_id): None if value is None else
+                                       json.dumps(value) if isinstance(value, bool) else str(value)
+                       for column_id, value in values.items()}
+        if rowId is not None:
+            self.rowId = rowId
+
+
 class RowSelection(DictObject):
     """
     A set of rows to be `deleted <http://docs.synapse.org/rest/POST/entity/id/table/deleteRows.html>`_.
@@ -880,11 +1286,15 @@ class TableAbstractBaseClass(object):
         except (KeyError, TypeError) as ex1:
             raise ValueError("asInteger is only valid for queries such as count queries whose first value is an integer.")
 
-    def asRowSet(self):
+    def asRowSet(self, compact=False):
+        """
+        :param compact: store the values column by column in a :py:class:`ColumnarRows`
+        """
+        rows = (row if isinstance(row, Row) else Row(row) for row in self)
         return RowSet(headers=self.headers,
                       tableId=self.tableId,
                       etag=self.etag,
-                      rows=[row if isinstance(row, Row) else Row(row) for row in self])
+                      rows=ColumnarRows(len(self.headers), rows) if compact else list(rows))
 
     def _synapse_store(self, syn):
         raise NotImplementedError()
@@ -927,9 +1337,11 @@ class RowSetTable(TableAbstractBaseClass):
         else:
             rownames = None
 
+        rows = self.rowset['rows']
         series = OrderedDict()
         for i, header in enumerate(self.rowset["headers"]):
-            series[header.name] = pd.Series(name=header.name, data=[row['values'][i] for row in self.rowset['rows']], index=rownames)
+            data = rows.columns[i] if isinstance(rows, ColumnarRows) else [row['values'][i] for row in rows]
+            series[header.name] = pd.Series(name=header.name, data=data, index=rownames)
 
         return pd.DataFrame(data=series, index=rownames)
 
@@ -944,8 +1356,9 @@ class RowSetTable(TableAbstractBaseClass):
 
     def __iter__(self):
         def iterate_rows(rows, headers):
+            decode = row_decoder(headers)
             for row in rows:
-                yield cast_values(row, headers)
+                yield decode(row)
         return iterate_rows(self.rowset['rows'], self.rowset['headers'])
 
 
@@ -958,20 +1371,34 @@ class TableQueryResult(TableAbstractBaseClass):
         results = syn.tableQuery("select * from syn1234")
         for row in results:
             print(row)
+
+    Setting prefetch to a number of pages requests those pages in the background
+    while the current page is being consumed. Call close() (or use the result as
+    a context manager) to stop the read-ahead when abandoning iteration early::
+
+        with syn.tableQuery("select * from syn1234", resultsAs="rowset", prefetch=2) as results:
+            for row in results:
+                if row['values'][0] == 'stop here':
+                    break
     """
-    def __init__(self, synapse, query, limit=None, offset=None, isConsistent=True):
+    def __init__(self, synapse, query, limit=None, offset=None, isConsistent=True, prefetch=0, queryResultBundle=None):
         self.syn = synapse
 
         self.query = query
         self.limit = limit
         self.offset = offset
         self.isConsistent = isConsistent
-
-        result = self.syn._queryTable(
-            query=query,
-            limit=limit,
-            offset=offset,
-            isConsistent=isConsistent)
+        self.prefetch = prefetch
+        self._prefetcher = None
+
+        ## the first page may already have been retrieved, for example by Synapse.tableQueryAsync
+        result = queryResultBundle
+        if result is None:
+            result = self.syn._queryTable(
+                query=query,
+                limit=limit,
+                offset=offset,
+                isConsistent=isConsistent)
 
         self.rowset = RowSet.from_json(result['queryResult']['queryResults'])
 
@@ -986,9 +1413,41 @@ class TableQueryResult(TableAbstractBaseClass):
             headers=self.rowset.headers,
             etag=self.rowset.get('etag', None))
 
+        if self.prefetch and self.nextPageToken:
+            self._prefetcher = _PagePrefetcher(self.syn, self.tableId, self.nextPageToken, self.prefetch)
+
     def _synapse_store(self, syn):
         raise SynapseError("A TableQueryResult is a read only object and can't be stored in Synapse. Convert to a DataFrame or RowSet instead.")
 
+    def _fetch_next_page(self):
+        """
+        Replace the current page of rows with the next one, taking it from the
+        prefetch buffer if read-ahead is enabled.
+        """
+        if self._prefetcher is not None:
+            result = self._prefetcher.get()
+        else:
+            result = self.syn._queryTableNext(self.nextPageToken, self.tableId)
+        self.rowset = RowSet.from_json(result['queryResults'])
+        self.nextPageToken = result.get('nextPageToken', None)
+        self.i = 0
+
+    def close(self):
+        """
+        Stop fetching pages in the background. Call this when abandoning
+        iteration before the end of the results.
+        """
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
+        self.nextPageToken = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def asDataFrame(self):
         """
         Convert query result to a Pandas DataFrame.
@@ -996,49 +1455,62 @@ class TableQueryResult(TableAbstractBaseClass):
         test_import_pandas()
         import pandas as pd
 
-        ## To turn a TableQueryResult into a data frame, we add a page of rows
-        ## at a time on the untested theory that it's more efficient than
-        ## adding a single row at a time to the data frame.
-
-        def construct_rownames(rowset, offset=0):
-            try:
-                return row_labels_from_rows(rowset['rows'])
-            except KeyError:
-                ## if we don't have row id and version, just number the rows
-                # python3 cast range to list for safety
-                return list(range(offset,offset+len(rowset['rows'])))
+        ## To turn a TableQueryResult into a data frame, we collect the values of
+        ## each column page by page and construct the data frame once at the end,
+        ## which keeps the work linear in the number of rows.
+        columns = OrderedDict((header.name, []) for header in self.rowset['headers'])
+        rownames = []
+        for page_rownames, page_columns in self._iter_page_columns():
+            rownames.extend(page_rownames)
+            for values, column_values in zip(columns.values(), page_columns):
+                values.extend(column_values)
 
-        ## first page of rows
-        offset = 0
-        rownames = construct_rownames(self.rowset, offset)
-        offset += len(self.rowset['rows'])
-        series = OrderedDict()
-        for i, header in enumerate(self.rowset["headers"]):
-            column_name = header.name
-            series[column_name] = pd.Series(name=column_name, data=[row['values'][i] for row in self.rowset['rows']], index=rownames)
+        return pd.DataFrame(data=columns, index=rownames)
 
-        # subsequent pages of rows
-        while self.nextPageToken:
-            result = self.syn._queryTableNext(self.nextPageToken, self.tableId)
-            self.rowset = RowSet.from_json(result['queryResults'])
-            self.nextPageToken = result.get('nextPageToken', None)
-            self.i = 0
+    def iterDataFrames(self):
+        """
+        Iterate over the query results a page at a time, yielding each page as a Pandas
+        DataFrame, so that only one page of results needs to be held in memory.
+        """
+        test_import_pandas()
+        import pandas as pd
 
-            rownames = construct_rownames(self.rowset, offset)
-            offset += len(self.rowset['rows'])
-            for i, header in enumerate(self.rowset["headers"]):
-                column_name = header.name
-                series[column_name] = series[column_name].append(pd.Series(name=column_name, data=[row['values'][i] for row in self.rowset['rows']], index=rownames), verify_integrity=True)
+        names = [header.name for header in self.rowset['headers']]
+        for rownames, page_columns in self._iter_page_columns():
+            yield pd.DataFrame(data=OrderedDict((name, list(values)) for name, values in zip(names, page_columns)),
+                               columns=names, index=rownames)
 
-        return pd.DataFrame(data=series)
+    def _iter_page_columns(self):
+        """
+        Yield the row labels and the column values of the current page and each following one.
+        """
+        n_rows = 0
+        while True:
+            rows = self.rowset['rows']
+            try:
+                rownames = row_labels_from_rows(rows)
+            except KeyError:
+                ## if we don't have row id and version, just number the rows
+                rownames = list(range(n_rows, n_rows+len(rows)))
+            n_rows += len(rows)
+            if rows:
+                yield rownames, list(zip(*(row['values'] for row in rows)))
+            else:
+                yield rownames, [()] * len(self.rowset['headers'])
+            if not self.nextPageToken:
+                break
+            self._fetch_next_page()
 
-    def asRowSet(self):
+    def asRowSet(self, compact=False):
+        """
+        :param compact: store the values column by column in a :py:class:`ColumnarRows`
+        """
         ## Note that as of stack 60, an empty query will omit the headers field
         ## see PLFM-3014
         return RowSet(headers=self.headers,
                       tableId=self.tableId,
                       etag=self.etag,
-                      rows=[row for row in self])
+                      rows=ColumnarRows(len(self.headers), self) if compact else [row for row in self])
 
     def asInteger(self):
         try:
@@ -1056,10 +1528,7 @@ class TableQueryResult(TableAbstractBaseClass):
         self.i += 1
         if self.i >= len(self.rowset['rows']):
             if self.nextPageToken:
-                result = self.syn._queryTableNext(self.nextPageToken, self.tableId)
-                self.rowset = RowSet.from_json(result['queryResults'])
-                self.nextPageToken = result.get('nextPageToken', None)
-                self.i = 0
+                self._fetch_next_page()
             else:
                 raise StopIteration()
         return self.rowset['rows'][self.i]
@@ -1078,7 +1547,7 @@ class CsvFileTable(TableAbstractBaseClass):
     """
 
     @classmethod
-    def from_table_query(cls, synapse, query, quoteCharacter='"', escapeCharacter="\\", lineEnd=str(os.linesep), separator=",", header=True, includeRowIdAndRowVersion=True):
+    def from_table_query(cls, synapse, query, quoteCharacter='"', escapeCharacter="\\", lineEnd=str(os.linesep), separator=",", header=True, includeRowIdAndRowVersion=True, shards=None):
         """
         Create a Table object wrapping a CSV file resulting from querying a Synapse table.
         Mostly for internal use.
@@ -1091,8 +1560,23 @@ class CsvFileTable(TableAbstractBaseClass):
             lineEnd=lineEnd,
             separator=separator,
             header=header,
+            includeRowIdAndRowVersion=includeRowIdAndRowVersion,
+            shards=shards)
+
+        return cls._from_download_result(
+            download_from_table_result, path,
+            quoteCharacter=quoteCharacter,
+            escapeCharacter=escapeCharacter,
+            lineEnd=lineEnd,
+            separator=separator,
+            header=header,
             includeRowIdAndRowVersion=includeRowIdAndRowVersion)
 
+    @classmethod
+    def _from_download_result(cls, download_from_table_result, path, quoteCharacter='"', escapeCharacter="\\", lineEnd=str(os.linesep), separator=",", header=True, includeRowIdAndRowVersion=True):
+        """
+        Create a Table object wrapping the CSV file downloaded for a DownloadFromTableResult.
+        """
         ## A dirty hack to find out if we got back row ID and Version
         ## in particular, we don't get these back from aggregate queries
         with io.open(path, 'r', encoding='utf-8') as f:
@@ -1118,6 +1602,7 @@ class CsvFileTable(TableAbstractBaseClass):
             header=header,
             includeRowIdAndRowVersion=includeRowIdAndRowVersion,
             headers=[SelectColumn(**header) for header in download_from_table_result['headers']])
+        self.resultsFileHandleId = download_from_table_result.get('resultsFileHandleId', None)
 
         return self
 
@@ -1151,13 +1636,35 @@ class CsvFileTable(TableAbstractBaseClass):
 
             df = df2
             includeRowIdAndRowVersion = True
+        elif not filepath:
+            ## changes made to the caller's data frame after the table is built must not change what's stored
+            df = df.copy()
+
+        self = cls(
+            schema=schema,
+            filepath=filepath,
+            etag=etag,
+            quoteCharacter=quoteCharacter,
+            escapeCharacter=escapeCharacter,
+            lineEnd=lineEnd,
+            separator=separator,
+            header=header,
+            includeRowIdAndRowVersion=includeRowIdAndRowVersion,
+            headers=headers)
+
+        ## Unless asked for a file, hold on to a copy of the data frame. It's written to a temporary
+        ## CSV file only if the file is needed, for example by asDataFrame, and is otherwise
+        ## streamed straight to Synapse when the table is stored.
+        self._data_frame = df
+        self._na_rep = kwargs.get('na_rep', '')
+        if filepath:
+            self._write_data_frame(filepath)
+
+        return self
 
+    def _write_data_frame(self, filepath):
         f = None
         try:
-            if not filepath:
-                temp_dir = tempfile.mkdtemp()
-                filepath = os.path.join(temp_dir, 'table.csv')
-
             if six.PY2:
                 ## pandas uses the Python standard library csv module
                 ## see: http://stackoverflow.com/a/3348664/199166
@@ -1165,28 +1672,42 @@ class CsvFileTable(TableAbstractBaseClass):
             else:
                 f = io.open(filepath, mode='w', encoding='utf-8', newline='')
 
-            df.to_csv(f,
-                index=False,
-                sep=encode_param_in_python2(separator),
-                header=encode_param_in_python2(header),
-                quotechar=encode_param_in_python2(quoteCharacter),
-                escapechar=encode_param_in_python2(escapeCharacter),
-                line_terminator=encode_param_in_python2(lineEnd),
-                na_rep=encode_param_in_python2(kwargs.get('na_rep','')))
+            self._data_frame.to_csv(f, **self._data_frame_csv_options(self.header))
         finally:
             if f: f.close()
 
-        return cls(
-            schema=schema,
-            filepath=filepath,
-            etag=etag,
-            quoteCharacter=quoteCharacter,
-            escapeCharacter=escapeCharacter,
-            lineEnd=lineEnd,
-            separator=separator,
-            header=header,
-            includeRowIdAndRowVersion=includeRowIdAndRowVersion,
-            headers=headers)
+    def _data_frame_csv_options(self, header):
+        return dict(index=False,
+                    sep=encode_param_in_python2(self.separator),
+                    header=encode_param_in_python2(header),
+                    quotechar=encode_param_in_python2(self.quoteCharacter),
+                    escapechar=encode_param_in_python2(self.escapeCharacter),
+                    line_terminator=encode_param_in_python2(self.lineEnd),
+                    na_rep=encode_param_in_python2(self._na_rep))
+
+    def _generate_data_frame_csv(self, start_chunk=0):
+        """
+        Serialize the data frame to CSV a chunk of rows at a time, starting with the given chunk,
+        yielding the same bytes as would be written to the CSV file.
+        """
+        df = self._data_frame
+        n_chunks = max(1, int(math.ceil(len(df) / float(DATA_FRAME_CHUNK_ROWS))))
+        for i in range(start_chunk, n_chunks):
+            text = df.iloc[i*DATA_FRAME_CHUNK_ROWS:(i+1)*DATA_FRAME_CHUNK_ROWS].to_csv(
+                None, **self._data_frame_csv_options(self.header and i == 0))
+            yield text.encode('utf-8') if isinstance(text, six.text_type) else text
+
+    @property
+    def filepath(self):
+        if self._filepath is None and self._data_frame is not None:
+            filepath = os.path.join(tempfile.mkdtemp(), 'table.csv')
+            self._write_data_frame(filepath)
+            self._filepath = filepath
+        return self._filepath
+
+    @filepath.setter
+    def filepath(self, filepath):
+        self._filepath = filepath
 
     @staticmethod
     def _insert_dataframe_column_if_not_exist(dataframe, insert_index, col_name, insert_column_data):
@@ -1254,6 +1775,7 @@ class CsvFileTable(TableAbstractBaseClass):
 
 
     def __init__(self, schema, filepath, etag=None, quoteCharacter='"', escapeCharacter="\\", lineEnd=str(os.linesep), separator=",", header=True, linesToSkip=0, includeRowIdAndRowVersion=None, headers=None):
+        self._data_frame = None
         self.filepath = filepath
 
         self.includeRowIdAndRowVersion = includeRowIdAndRowVersion
@@ -1270,14 +1792,33 @@ class CsvFileTable(TableAbstractBaseClass):
 
         self.setColumnHeaders(headers)
 
-    def _synapse_store(self, syn):
+    def _synapse_store(self, syn, batch_rows=None, max_parallel=1):
+        """
+        :param batch_rows:   if given, upload the rows in batches of this many rows, each applied to the
+                             table in its own transaction, see :py:meth:`_store_batches`
+        :param max_parallel: the number of batches to upload at once
+        """
         if isinstance(self.schema, Schema) and self.schema.get('id', None) is None:
             ## store schema
             self.schema = syn.store(self.schema)
             self.tableId = self.schema.id
 
-        result = syn._uploadCsv(
-            self.filepath,
+        if batch_rows:
+            self._store_batches(syn, batch_rows, max_parallel)
+            return self
+
+        if self._filepath is None and self._data_frame is not None:
+            ## stream the data frame to Synapse rather than writing it to a file first
+            fileHandleId = multipart_upload_chunks(syn, self._generate_data_frame_csv, 'table.csv', contentType="text/csv")
+        else:
+            fileHandleId = multipart_upload(syn, self.filepath, contentType="text/csv")
+
+        self._apply_upload(syn, fileHandleId, self.linesToSkip)
+        return self
+
+    def _apply_upload(self, syn, fileHandleId, linesToSkip):
+        result = syn._uploadCsvFileHandle(
+            fileHandleId,
             self.schema if self.schema else self.tableId,
             updateEtag=self.etag,
             quoteCharacter=self.quoteCharacter,
@@ -1285,7 +1826,7 @@ class CsvFileTable(TableAbstractBaseClass):
             lineEnd=self.lineEnd,
             separator=self.separator,
             header=self.header,
-            linesToSkip=self.linesToSkip)
+            linesToSkip=linesToSkip)
 
         upload_to_table_result = result['results'][0]
 
@@ -1293,7 +1834,95 @@ class CsvFileTable(TableAbstractBaseClass):
                                                           'org.sagebionetworks.repo.model.table.UploadToTableResult'), "Not an UploadToTableResult or EntityUpdateResults."
         if 'etag' in upload_to_table_result:
             self.etag = upload_to_table_result['etag']
-        return self
+
+    def _store_batches(self, syn, batch_rows, max_parallel=1):
+        """
+        Upload the rows in batches, so that a failure costs only the batch that failed rather than
+        the whole upload. Up to max_parallel batches are uploaded at once, but the batches are
+        applied to the table one after another in their original order, each using the etag
+        resulting from the one before. A batch whose file fails to upload is uploaded again up to
+        MAX_BATCH_RETRIES times. Applying a batch isn't retried, as a transaction that timed out may
+        still have added its rows.
+        """
+        if self._filepath is None and self._data_frame is not None:
+            batches = self._data_frame_batches(batch_rows)
+            total_rows = len(self._data_frame)
+        else:
+            batches = self._csv_file_batches(batch_rows)
+            total_rows = -1
+
+        upload = lambda data: multipart_upload_chunks(syn, lambda start: iter([data][start:]), 'table.csv', contentType="text/csv")
+
+        executor = ThreadPoolExecutor(max_workers=max_parallel)
+        try:
+            ## keep max_parallel uploads going ahead of the batch being applied
+            pending = collections.deque()
+
+            def upload_next_batch():
+                batch = next(batches, None)
+                if batch is not None:
+                    n_rows, data = batch
+                    pending.append((n_rows, data, executor.submit(upload, data)))
+
+            for i in range(max_parallel):
+                upload_next_batch()
+
+            rows_stored = 0
+            batch_number = 0
+            while pending:
+                n_rows, data, upload_future = pending.popleft()
+                upload_next_batch()
+                batch_number += 1
+
+                for attempt in range(MAX_BATCH_RETRIES + 1):
+                    try:
+                        fileHandleId = upload_future.result() if attempt == 0 else upload(data)
+                        break
+                    except Exception as ex:
+                        if attempt == MAX_BATCH_RETRIES:
+                            raise
+                        sys.stderr.write('\nUploading batch %d failed: %s. Retrying...\n' % (batch_number, str(ex)))
+
+                ## a failed transaction may still have been applied, so it isn't retried
+                self._apply_upload(syn, fileHandleId, 0)
+
+                rows_stored += n_rows
+                utils.printTransferProgress(rows_stored, total_rows, prefix='Stored rows', postfix='(batch %d)' % batch_number, isBytes=False)
+        finally:
+            executor.shutdown(wait=False)
+
+    def _data_frame_batches(self, batch_rows):
+        df = self._data_frame
+        for i in range(0, len(df), batch_rows):
+            text = df.iloc[i:i+batch_rows].to_csv(None, **self._data_frame_csv_options(self.header))
+            yield min(batch_rows, len(df)-i), text.encode('utf-8') if isinstance(text, six.text_type) else text
+
+    def _csv_file_batches(self, batch_rows):
+        """
+        Split the CSV file into batches of rows, each with a copy of the header. The bytes of each
+        row are kept as they are, watching quotes so as not to split rows holding line breaks.
+        """
+        quote = self.quoteCharacter or None
+        escape = self.escapeCharacter or None
+        with open(self.filepath, 'rb') as f:
+            for i in range(self.linesToSkip):
+                f.readline()
+            header = f.readline() if self.header else b''
+
+            lines = []
+            n_rows = 0
+            in_quotes = False
+            for line in f:
+                lines.append(line)
+                in_quotes = _csv_line_ends_in_quotes(line.decode('utf-8'), quote, escape, in_quotes)
+                if not in_quotes:
+                    n_rows += 1
+                    if n_rows == batch_rows:
+                        yield n_rows, header + b''.join(lines)
+                        lines = []
+                        n_rows = 0
+            if lines:
+                yield n_rows + (1 if in_quotes else 0), header + b''.join(lines)
 
     def _synapse_delete(self, syn):
         """
@@ -1318,46 +1947,106 @@ class CsvFileTable(TableAbstractBaseClass):
             etag=self.etag,
             tableId=self.tableId)))
 
-    def asDataFrame(self, rowIdAndVersionInIndex=True, convert_to_datetime = False):
+    def asDataFrame(self, rowIdAndVersionInIndex=True, convert_to_datetime = False, use_column_types=False, columns=None):
         """
         
         :param rowIdAndVersionInIndex: Make the dataframe index consist of the row_id and row_version
         :param convert_to_datetime: If set to True, will convert all Synapse DATE columns from UNIX timestamp integers into UTC datetime objects
+        :param use_column_types: If set to True, read each column with a pandas dtype chosen from its Synapse
+                                 column type rather than letting pandas guess: nullable Int64 for INTEGER
+                                 and DATE, boolean for BOOLEAN and string for STRING and ID columns, with
+                                 STRING columns having few distinct values stored as categories. Requires
+                                 pandas 1.0 or later.
+        :param columns: optional list of the names of the columns to read, by default all of them
         :return: 
         """
         test_import_pandas()
         import pandas as pd
 
         try:
-            #Handle bug in pandas 0.19 requiring quotechar to be str not unicode or newstr
-            quoteChar = bytes_to_native_str(bytes(self.quoteCharacter)) if six.PY2 else self.quoteCharacter
-
-            #determine which columns are DATE columns so we can convert milisecond timestamps into datetime objects
-            date_columns = []
-            datetime_millisecond_parser = lambda milliseconds: pd.to_datetime(milliseconds, unit='ms', utc=True) #DATEs are stored in csv as unix timestamp in milliseconds
-            if convert_to_datetime:
-                for select_column in self.headers:
-                    if select_column.columnType == "DATE":
-                        date_columns.append(select_column.name)
-
-
-            ## assign line terminator only if for single character
-            ## line terminators (e.g. not '\r\n') 'cause pandas doesn't
-            ## longer line terminators. See:
-            ##    https://github.com/pydata/pandas/issues/3501
-            ## "ValueError: Only length-1 line terminators supported"
-            df = pd.read_csv(self.filepath,
-                    sep=self.separator,
-                    lineterminator=self.lineEnd if len(self.lineEnd) == 1 else None,
-                    quotechar=quoteChar,
-                    escapechar=self.escapeCharacter,
-                    header = 0 if self.header else None,
-                    skiprows=self.linesToSkip,
-                    parse_dates=date_columns,
-                    date_parser=datetime_millisecond_parser)
+            df = self._read_csv(rowIdAndVersionInIndex, convert_to_datetime, use_column_types, columns)
         except pd.parser.CParserError as ex1:
             df = pd.DataFrame()
 
+        if use_column_types and len(df) > 0:
+            for select_column in self.headers:
+                if select_column.get('columnType', 'STRING') == 'STRING' and select_column.name in df.columns \
+                        and select_column.name not in ("ROW_ID", "ROW_VERSION"):
+                    if df[select_column.name].nunique() <= len(df) * CATEGORY_MAX_DISTINCT_FRACTION:
+                        df[select_column.name] = df[select_column.name].astype('category')
+
+        return self._set_row_labels(df, rowIdAndVersionInIndex)
+
+    def iterDataFrames(self, chunksize=100000, rowIdAndVersionInIndex=True, convert_to_datetime=False, use_column_types=False, columns=None):
+        """
+        Read the table a chunk of rows at a time, yielding each chunk as a Pandas DataFrame, so
+        that tables too large to fit in memory can be processed in pieces::
+
+            results = syn.tableQuery("select * from %s" % table_id)
+            total = 0
+            for df in results.iterDataFrames(chunksize=500000, use_column_types=True):
+                total += df['size'].sum()
+
+        :param chunksize: the number of rows in each DataFrame
+        
+        The remaining parameters are as for :py:meth:`asDataFrame`, except that STRING columns
+        are never converted to categories, whose categories would differ from chunk to chunk.
+        """
+        test_import_pandas()
+
+        reader = self._read_csv(rowIdAndVersionInIndex, convert_to_datetime, use_column_types, columns, chunksize=chunksize)
+        try:
+            for df in reader:
+                yield self._set_row_labels(df, rowIdAndVersionInIndex)
+        finally:
+            reader.close()
+
+    def _read_csv(self, rowIdAndVersionInIndex, convert_to_datetime, use_column_types, columns, chunksize=None):
+        import pandas as pd
+
+        #Handle bug in pandas 0.19 requiring quotechar to be str not unicode or newstr
+        quoteChar = bytes_to_native_str(bytes(self.quoteCharacter)) if six.PY2 else self.quoteCharacter
+
+        #determine which columns are DATE columns so we can convert milisecond timestamps into datetime objects
+        date_columns = []
+        datetime_millisecond_parser = lambda milliseconds: pd.to_datetime(milliseconds, unit='ms', utc=True) #DATEs are stored in csv as unix timestamp in milliseconds
+        if convert_to_datetime:
+            for select_column in self.headers:
+                if select_column.columnType == "DATE":
+                    date_columns.append(select_column.name)
+
+        usecols = None
+        if columns is not None:
+            usecols = list(columns)
+            header_names = [select_column.name for select_column in self.headers]
+            if rowIdAndVersionInIndex:
+                usecols += [name for name in ("ROW_ID", "ROW_VERSION") if name in header_names and name not in usecols]
+            date_columns = [name for name in date_columns if name in usecols]
+
+        dtype = pandas_dtypes_from_headers(self.headers, exclude=date_columns) if use_column_types else None
+        if dtype and usecols is not None:
+            dtype = {name: dtype[name] for name in usecols if name in dtype}
+
+        ## assign line terminator only if for single character
+        ## line terminators (e.g. not '\r\n') 'cause pandas doesn't
+        ## longer line terminators. See:
+        ##    https://github.com/pydata/pandas/issues/3501
+        ## "ValueError: Only length-1 line terminators supported"
+        return pd.read_csv(self.filepath,
+                sep=self.separator,
+                lineterminator=self.lineEnd if len(self.lineEnd) == 1 else None,
+                quotechar=quoteChar,
+                escapechar=self.escapeCharacter,
+                header = 0 if self.header else None,
+                skiprows=self.linesToSkip,
+                usecols=usecols,
+                dtype=dtype,
+                parse_dates=date_columns,
+                date_parser=datetime_millisecond_parser,
+                chunksize=chunksize)
+
+    @staticmethod
+    def _set_row_labels(df, rowIdAndVersionInIndex):
         if rowIdAndVersionInIndex and "ROW_ID" in df.columns and "ROW_VERSION" in df.columns:
             ## combine row-ids (in index) and row-versions (in column 0) to
             ## make new row labels consisting of the row id and version
@@ -1365,10 +2054,78 @@ class CsvFileTable(TableAbstractBaseClass):
             df.index = row_labels_from_id_and_version(zip(df["ROW_ID"], df["ROW_VERSION"]))
             del df["ROW_ID"]
             del df["ROW_VERSION"]
-
         return df
 
-    def asRowSet(self):
+    def toParquet(self, path=None):
+        """
+        Convert the CSV file to a Parquet file whose columns are typed according to the
+        table's columns. Requires pyarrow.
+
+        :param path: where to write the Parquet file. By default it's written next to the CSV
+                     file, which for query results is in the cache directory of the results
+                     file handle, and an existing Parquet file there that is newer than the CSV
+                     file is reused rather than converted again.
+
+        :return: the path to the Parquet file
+        """
+        test_import_pyarrow()
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+
+        if path is None:
+            path = os.path.splitext(self.filepath)[0] + '.parquet'
+            if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(self.filepath):
+                return path
+
+        read_options = pa_csv.ReadOptions(skip_rows=self.linesToSkip,
+                                          column_names=None if self.header else [header.name for header in self.headers])
+        parse_options = pa_csv.ParseOptions(delimiter=self.separator,
+                                            quote_char=self.quoteCharacter or False,
+                                            escape_char=self.escapeCharacter or False)
+        convert_options = pa_csv.ConvertOptions(column_types=arrow_types_from_headers(self.headers),
+                                                strings_can_be_null=True,
+                                                quoted_strings_can_be_null=True)
+
+        ## convert a batch of rows at a time, writing to a temporary file so an
+        ## interrupted conversion never leaves a partial Parquet file behind
+        temp_path = path + '.tmp'
+        reader = pa_csv.open_csv(self.filepath, read_options=read_options,
+                                 parse_options=parse_options, convert_options=convert_options)
+        schema = arrow_schema_from_headers(reader.schema, self.headers)
+        try:
+            writer = pq.ParquetWriter(temp_path, schema)
+            try:
+                for batch in reader:
+                    columns = [column.cast(field.type) if column.type != field.type else column
+                               for column, field in zip(batch.columns, schema)]
+                    writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            finally:
+                writer.close()
+
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+        finally:
+            ## only left over if the conversion failed
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return path
+
+    def asArrowTable(self):
+        """
+        Get the table as a `pyarrow.Table <https://arrow.apache.org/docs/python/generated/pyarrow.Table.html>`_
+        read from a memory-mapped Parquet file. See :py:meth:`toParquet`. Requires pyarrow.
+        """
+        test_import_pyarrow()
+        import pyarrow.parquet as pq
+
+        return pq.read_table(self.toParquet(), memory_map=True)
+
+    def asRowSet(self, compact=False):
+        """
+        :param compact: store the values column by column in a :py:class:`ColumnarRows`
+        """
         ## Extract row id and version, if present in rows
         row_id_col = None
         row_ver_col = None
@@ -1386,10 +2143,12 @@ class CsvFileTable(TableAbstractBaseClass):
             values = [elem for i, elem in enumerate(row) if i not in [row_id_col, row_ver_col]]
             return Row(values, rowId=rowId, versionNumber=versionNumber)
 
-        return RowSet(headers=[elem for i, elem in enumerate(self.headers) if i not in [row_id_col, row_ver_col]],
+        headers = [elem for i, elem in enumerate(self.headers) if i not in [row_id_col, row_ver_col]]
+        rows = (to_row_object(row, row_id_col, row_ver_col) for row in self)
+        return RowSet(headers=headers,
                       tableId=self.tableId,
                       etag=self.etag,
-                      rows=[to_row_object(row, row_id_col, row_ver_col) for row in self])
+                      rows=ColumnarRows(len(headers), rows) if compact else list(rows))
 
     def setColumnHeaders(self, headers):
         """
@@ -1415,8 +2174,9 @@ class CsvFileTable(TableAbstractBaseClass):
                     quotechar=self.quoteCharacter)
                 if self.header:
                     header = next(reader)
+                decode = row_decoder(headers)
                 for row in reader:
-                    yield cast_values(row, headers)
+                    yield decode(row)
         return iterate_rows(self.filepath, self.headers)
 
     def __len__(self):
@@ -35,6 +35,7 @@ except ImportError:
 
 import os, sys
 import hashlib, re
+import io
 import cgi
 import errno
 import inspect
@@ -61,23 +62,28 @@ KB = 2**10
 BUFFER_SIZE = 8*KB
 
 
-def md5_for_file(filename, block_size=2*MB):
+def md5_for_file(filename, block_size=8*MB):
     """
     Calculates the MD5 of the given file.  See `source <http://stackoverflow.com/questions/1131220/get-md5-hash-of-a-files-without-open-it-in-python>`_.
 
     :param filename:   The file to read in
     :param block_size: How much of the file to read in at once (bytes).
-                       Defaults to 2 MB
+                       Defaults to 8 MB
     :returns: The MD5
     """
 
     md5 = hashlib.md5()
-    with open(filename,'rb') as f:
+    ## read into one buffer rather than allocating each block, hashlib
+    ## releases the GIL while it hashes blocks this large
+    ## hashlib on older Python 2.7 builds won't take a memoryview, but does take a bytearray,
+    ## so only a short last block is copied
+    buffer = bytearray(block_size)
+    with io.open(filename, 'rb', buffering=0) as f:
         while True:
-            data = f.read(block_size)
-            if not data:
+            n = f.readinto(buffer)
+            if not n:
                 break
-            md5.update(data)
+            md5.update(buffer if n == block_size else buffer[:n])
     return(md5)
 
 
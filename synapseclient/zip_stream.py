@@ -0,0 +1,215 @@
+"""
+************************
+Streaming zip extraction
+************************
+
+Extracts the entries of a zip file while it is being downloaded, by reading the local
+file header in front of each entry rather than waiting for the central directory at the
+end of the file. Only the layouts written by ordinary zip encoders are understood:
+entries stored or deflated, without encryption or Zip64 extensions. When the stream holds
+anything else, the extractor stops and leaves the remaining entries to be read from the
+complete file with :py:mod:`zipfile`.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import struct
+import zlib
+
+LOCAL_FILE_HEADER = struct.Struct(str('<4sHHHHHIIIHH'))
+LOCAL_FILE_HEADER_SIGNATURE = b'PK\x03\x04'
+DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+CENTRAL_DIRECTORY_SIGNATURE = b'PK\x01\x02'
+
+STORED = 0
+DEFLATED = 8
+
+FLAG_ENCRYPTED = 0x1
+FLAG_DATA_DESCRIPTOR = 0x8
+FLAG_UTF8 = 0x800
+
+## the end of a deflated entry of unknown size can only be found where
+## the decompressor reports it, which Python 2 does not
+_DECOMPRESSOR_HAS_EOF = hasattr(zlib.decompressobj(), 'eof')
+
+
+class ZipStreamExtractor(object):
+    """
+    Extracts chosen entries of a zip file from consecutive chunks of its bytes.
+
+    :param targets:    a dictionary from the name of each entry to extract to the directory
+                       it should be written to. The file keeps the base name of the entry.
+    :param on_extract: optional function called with the entry name and the path of each
+                       file once it has been completely written and its CRC checked
+    """
+
+    def __init__(self, targets, on_extract=None):
+        self.targets = targets
+        self.on_extract = on_extract
+        self.extracted = {}
+        self.position = 0
+        self.failed = False
+        self.finished = False
+        self._buffer = bytearray()
+        self._entry = None
+
+    def feed(self, offset, chunk):
+        """
+        Consume the next chunk of the zip file.
+
+        :param offset: the position of the chunk in the file. A chunk that does not follow the
+                       previous one, as when a download restarts from the beginning, stops
+                       the extraction.
+        :param chunk:  the bytes of the chunk
+        """
+        if self.failed or self.finished:
+            return
+        if offset != self.position:
+            self._fail()
+            return
+        self.position += len(chunk)
+        self._buffer.extend(chunk)
+        try:
+            while not self.failed and not self.finished and self._step():
+                pass
+        except (zlib.error, IOError, OSError, ValueError):
+            self._fail()
+
+    def close(self):
+        """
+        Discard any partly written entry.
+        """
+        self._discard_entry()
+
+    def _step(self):
+        """Process as much of the buffer as possible, returning True to be called again."""
+        if self._entry is None:
+            return self._read_header()
+        if self._entry.reading_descriptor:
+            return self._read_descriptor()
+        return self._read_data()
+
+    def _read_header(self):
+        if len(self._buffer) < 4:
+            return False
+        signature = bytes(self._buffer[:4])
+        if signature == CENTRAL_DIRECTORY_SIGNATURE:
+            self.finished = True
+            return False
+        if signature != LOCAL_FILE_HEADER_SIGNATURE:
+            self._fail()
+            return False
+        if len(self._buffer) < LOCAL_FILE_HEADER.size:
+            return False
+        (_, _, flags, method, _, _, crc, compressed_size, _, name_length, extra_length) = \
+            LOCAL_FILE_HEADER.unpack(bytes(self._buffer[:LOCAL_FILE_HEADER.size]))
+        header_length = LOCAL_FILE_HEADER.size + name_length + extra_length
+        if len(self._buffer) < header_length:
+            return False
+
+        name = bytes(self._buffer[LOCAL_FILE_HEADER.size:LOCAL_FILE_HEADER.size + name_length])
+        name = name.decode('utf-8' if flags & FLAG_UTF8 else 'cp437')
+        has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+        if flags & FLAG_ENCRYPTED or method not in (STORED, DEFLATED) or compressed_size == 0xFFFFFFFF \
+                or (has_descriptor and (method == STORED or not _DECOMPRESSOR_HAS_EOF)):
+            self._fail()
+            return False
+        del self._buffer[:header_length]
+
+        self._entry = _Entry(name, method, None if has_descriptor else crc,
+                             None if has_descriptor else compressed_size, self.targets.get(name, None))
+        return True
+
+    def _read_data(self):
+        entry = self._entry
+        if entry.remaining is not None:
+            data = bytes(self._buffer[:entry.remaining])
+            del self._buffer[:len(data)]
+            entry.remaining -= len(data)
+            entry.write(entry.decompress(data) if entry.decompressor else data)
+            if entry.remaining > 0:
+                return False
+            if entry.decompressor:
+                entry.write(entry.decompressor.flush())
+            return self._finish_entry()
+
+        ## without the size, the end of a deflated entry is found by the decompressor
+        data = bytes(self._buffer)
+        del self._buffer[:]
+        entry.write(entry.decompress(data))
+        if not entry.decompressor.eof:
+            return False
+        self._buffer[:0] = entry.decompressor.unused_data
+        entry.reading_descriptor = True
+        return True
+
+    def _read_descriptor(self):
+        ## the descriptor may or may not start with a signature, followed by the CRC and sizes
+        if len(self._buffer) < 16:
+            return False
+        if bytes(self._buffer[:4]) == DATA_DESCRIPTOR_SIGNATURE:
+            del self._buffer[:4]
+        self._entry.crc = struct.unpack(str('<I'), bytes(self._buffer[:4]))[0]
+        del self._buffer[:12]
+        return self._finish_entry()
+
+    def _finish_entry(self):
+        entry = self._entry
+        self._entry = None
+        if entry.file is None:
+            return True
+        entry.file.close()
+        entry.file = None
+        if entry.crc != entry.actual_crc & 0xFFFFFFFF:
+            os.remove(entry.temp_path)
+            self._fail()
+            return False
+        if os.path.exists(entry.path):
+            os.remove(entry.path)
+        os.rename(entry.temp_path, entry.path)
+        self.extracted[entry.name] = entry.path
+        if self.on_extract:
+            self.on_extract(entry.name, entry.path)
+        return True
+
+    def _discard_entry(self):
+        entry = self._entry
+        self._entry = None
+        if entry is not None and entry.file is not None:
+            entry.file.close()
+            if os.path.exists(entry.temp_path):
+                os.remove(entry.temp_path)
+
+    def _fail(self):
+        self.failed = True
+        self._discard_entry()
+        del self._buffer[:]
+
+
+class _Entry(object):
+
+    def __init__(self, name, method, crc, compressed_size, target_dir):
+        self.name = name
+        self.crc = crc
+        self.remaining = compressed_size
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if method == DEFLATED else None
+        self.reading_descriptor = False
+        self.actual_crc = 0
+        self.file = None
+        if target_dir is not None:
+            if not os.path.exists(target_dir):
+                os.makedirs(target_dir)
+            self.path = os.path.join(target_dir, os.path.basename(name))
+            self.temp_path = self.path + '.zippart'
+            self.file = open(self.temp_path, 'wb')
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+    def write(self, data):
+        if self.file is not None and data:
+            self.actual_crc = zlib.crc32(data, self.actual_crc)
+            self.file.write(data)
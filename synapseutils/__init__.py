@@ -11,6 +11,7 @@ interacting with `Synapse <http://www.synapse.org>`_.  These funtionalities incl
 - :py:func:`walk.walk`
 - :py:func:`sync.syncFromSynapse`
 - :py:func:`sync.syncToSynapse`
+- :py:func:`table_sync.syncTable`
 - :py:func:`monitor.notifyMe`
 """
 
@@ -24,4 +25,5 @@ from __future__ import unicode_literals
 from .copy import copy, copyWiki, copyFileHandles, changeFileMetaData
 from .walk import walk
 from .sync import syncFromSynapse, syncToSynapse
+from .table_sync import syncTable
 from .monitor import notifyMe
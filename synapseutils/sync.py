@@ -3,24 +3,33 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
 import errno
+import hashlib
+import json
 from .monitor import notifyMe
+from .walk import _helpWalk
+from .sync_state import SyncState, UploadJournal
 from synapseclient.entity import is_container
 from synapseclient.utils import id_of, topolgical_sort, is_url
-from synapseclient import File, table
+from synapseclient import Activity, Entity, File, table
+from synapseclient.annotations import to_synapse_annotations, from_synapse_annotations
 from synapseclient.exceptions import *
 import os
 import six
 import sys
 from backports import csv
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 REQUIRED_FIELDS = ['path', 'parent']
 FILE_CONSTRUCTOR_FIELDS  = ['name', 'synapseStore', 'contentType']
 STORE_FUNCTION_FIELDS =  ['used', 'executed', 'activityName', 'activityDescription', 'forceVersion']
 MAX_RETRIES = 4
 MANIFEST_FILENAME = 'SYNAPSE_METADATA_MANIFEST.tsv'
+DEFAULT_MAX_WORKERS = 8
+JOURNAL_SUFFIX = '.journal'
 
-def syncFromSynapse(syn, entity, path=None, ifcollision='overwrite.local', allFiles = None, followLink=False):
+def syncFromSynapse(syn, entity, path=None, ifcollision='overwrite.local', allFiles = None, followLink=False, max_workers=DEFAULT_MAX_WORKERS):
     """Synchronizes all the files in a folder (including subfolders) from Synapse and adds a readme manifest with file metadata.
 
     :param syn:    A synapse object as obtained with syn = synapseclient.login()
@@ -38,6 +47,9 @@ def syncFromSynapse(syn, entity, path=None, ifcollision='overwrite.local', allFi
     :param followLink:  Determines whether the link returns the target Entity.
                         Defaults to False
 
+    :param max_workers: The number of folders listed, files downloaded and provenance records
+                        fetched at the same time. Defaults to 8
+
     :returns: list of entities (files, tables, links)
 
     This function will crawl all subfolders of the project/folder
@@ -53,6 +65,17 @@ def syncFromSynapse(syn, entity, path=None, ifcollision='overwrite.local', allFi
     the metadata (annotations, storage location and provenance of all
     downloaded files)
 
+    Folders are listed, files downloaded and their provenance fetched concurrently. A file that
+    fails to download doesn't stop the others. Once every file has been tried, the manifest is
+    written for those that were downloaded and a SynapseError naming the files that failed is
+    raised. The files that were downloaded are still added to allFiles, if it is given.
+
+    When downloading to a path, what was downloaded is recorded in a database in that path
+    (.SYNAPSE_SYNC_STATE.db). When the same path is synced again, a file whose version and
+    modification time in Synapse are those recorded and whose local copy is unchanged is
+    neither fetched nor downloaded, so only the folders are listed. Files recorded by the
+    last sync that are no longer in Synapse are reported, and left in place.
+
     See also: 
     - :py:func:`synapseutils.sync.syncToSynapse`
 
@@ -66,37 +89,134 @@ def syncFromSynapse(syn, entity, path=None, ifcollision='overwrite.local', allFi
     """
     if allFiles is None: allFiles = list()
     id = id_of(entity)
-    results = syn.chunkedQuery("select id, name, nodeType from entity where entity.parentId=='%s'" %id)
-    for result in results:
-        if is_container(result):
-            if path is not None:  #If we are downloading outside cache create directory.
-                new_path = os.path.join(path, result['entity.name'])
-                try:
-                    os.mkdir(new_path)
-                except OSError as err:
-                    if err.errno!=errno.EEXIST:
-                        raise
-                print('making dir', new_path)
-            else:
-                new_path = None
-            syncFromSynapse(syn, result['entity.id'], new_path, ifcollision, allFiles)
-        else:
-            ent = syn.get(result['entity.id'], downloadLocation = path, ifcollision = ifcollision, followLink=followLink)
+
+    #Files recorded by the last sync into the same directory are only fetched again if they changed
+    state = SyncState(path) if path is not None else None
+    recorded = state.ids() if state is not None else set()
+    listed = set()
+
+    #The local directory of each folder and the ID of its parent
+    directories = {id: path}
+    parents = {}
+    downloads = []
+    errors = []
+    download_executor = ThreadPoolExecutor(max_workers)
+    provenance_executor = ThreadPoolExecutor(max_workers) if path is not None else None
+    try:
+        for (dirpath, folder_id), dirs, nondirs in _helpWalk(syn, id, max_workers=max_workers, headers=True):
+            for header in dirs:
+                name, child_id = header['name'], header['id']
+                parents[child_id] = folder_id
+                if path is not None:  #If we are downloading outside cache create directory.
+                    new_path = os.path.join(directories[folder_id], name)
+                    try:
+                        os.makedirs(new_path)
+                    except OSError as err:
+                        if err.errno!=errno.EEXIST:
+                            raise
+                    print('making dir', new_path)
+                else:
+                    new_path = None
+                directories[child_id] = new_path
+            for header in nondirs:
+                listed.add(header['id'])
+                unchanged = state.unchanged(header) if header['id'] in recorded else None
+                if unchanged is not None:
+                    future = _completedFuture((_entityFromDict(unchanged[0]), _completedFuture(
+                        None if unchanged[1] is None else Activity(data=unchanged[1]))))
+                else:
+                    future = download_executor.submit(_downloadFile, syn, header['id'], directories[folder_id],
+                                                      ifcollision, followLink, provenance_executor)
+                downloads.append((folder_id, header, unchanged is None, future))
+
+        #Collect the results in the order the files were listed, setting failures aside
+        files = []
+        provenance = {}
+        downloaded = []
+        for folder_id, header, fetched, future in downloads:
+            try:
+                ent, provenance_future = future.result()
+                if provenance_future is not None:
+                    provenance[ent.id] = provenance_future.result()
+            except Exception as ex:
+                sys.stderr.write('Failed to download %s: %s\n' % (header['id'], ex))
+                errors.append((header['id'], ex))
+                continue
             allFiles.append(ent)
-            
+            files.append((folder_id, ent))
+            if fetched and state is not None:
+                downloaded.append((header, _entityToDict(ent), provenance.get(ent.id, None)))
+    finally:
+        download_executor.shutdown(wait=True)
+        if provenance_executor is not None:
+            provenance_executor.shutdown(wait=True)
+
+    if state is not None:
+        state.put_many(downloaded)
+        deleted = state.remove_many(recorded - listed)
+        if deleted:
+            sys.stdout.write('%i files were deleted from Synapse since the last sync and were left in place:\n%s\n'
+                             % (len(deleted), '\n'.join(sorted(p for p in deleted if p is not None))))
+
     if path is not None:  #If path is None files are stored in cache.
-        filename = os.path.join(path, MANIFEST_FILENAME)
-        filename = os.path.expanduser(os.path.normcase(filename))
-        generateManifest(syn, allFiles, filename)
+        #Each folder's manifest lists the files in it and in its subfolders
+        folder_files = {folder_id: [] for folder_id in directories}
+        for folder_id, ent in files:
+            while folder_id is not None:
+                folder_files[folder_id].append(ent)
+                folder_id = parents.get(folder_id, None)
+        for folder_id, entities in folder_files.items():
+            filename = os.path.join(directories[folder_id], MANIFEST_FILENAME)
+            filename = os.path.expanduser(os.path.normcase(filename))
+            generateManifest(syn, entities, filename, provenance=provenance)
+
+    if errors:
+        raise SynapseError('Failed to download %i of %i files: %s' % (len(errors), len(downloads),
+                                                                       ', '.join(file_id for file_id, ex in errors)))
     return allFiles
 
 
-def generateManifest(syn, allFiles, filename):
+def _completedFuture(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _entityToDict(entity):
+    return {'properties': dict(entity.properties),
+            'annotations': to_synapse_annotations(dict(entity.annotations)),
+            'local_state': entity.local_state()}
+
+
+def _entityFromDict(data):
+    return Entity.create(data['properties'], from_synapse_annotations(data['annotations']), data['local_state'])
+
+
+def _downloadFile(syn, file_id, downloadLocation, ifcollision, followLink, provenance_executor):
+    """Downloads a file, then hands it to the executor to fetch its provenance, if there is one."""
+    ent = syn.get(file_id, downloadLocation=downloadLocation, ifcollision=ifcollision, followLink=followLink)
+    provenance_future = None
+    if provenance_executor is not None:
+        provenance_future = provenance_executor.submit(_getProvenance, syn, ent)
+    return ent, provenance_future
+
+
+def _getProvenance(syn, entity):
+    try:
+        return syn.getProvenance(entity)
+    except SynapseHTTPError:
+        return None # No provenance present
+
+
+def generateManifest(syn, allFiles, filename, provenance=None):
     """Generates a manifest file based on a list of entities objects.
 
     :param allFiles:   A list of File Entities
 
     :param filename: file where manifest will be written
+
+    :param provenance: An optional dictionary from the ID of each entity to its provenance Activity,
+                       or None if it has none. Provenance not in it is fetched one entity at a time.
     """
     keys = ['path', 'parent', 'name', 'synapseStore', 'contentType', 'used',
             'executed', 'activityName', 'activityDescription']
@@ -107,14 +227,15 @@ def generateManifest(syn, allFiles, filename):
                'synapseStore': entity.synapseStore, 'contentType': allFiles[0]['contentType']}
         row.update({key:val[0] for key, val in entity.annotations.items()})
         annotKeys.update(set(entity.annotations.keys()))
-        try:
-            prov = syn.getProvenance(entity)
+        if provenance is not None and entity.id in provenance:
+            prov = provenance[entity.id]
+        else:
+            prov = _getProvenance(syn, entity)
+        if prov is not None:
             row['used'] = ';'.join(prov._getUsedStringList())
             row['executed'] = ';'.join(prov._getExecutedStringList())
             row['activityName'] = prov.get('name', '')
             row['activityDescription'] = prov.get('description', '')
-        except SynapseHTTPError:
-            pass # No provenance present
         data.append(row)
     keys.extend(annotKeys)
 
@@ -124,7 +245,20 @@ def generateManifest(syn, allFiles, filename):
         for  row in data:
             csvWriter.writerow(row)
 
+def _localPaths(paths):
+    """Maps each path in a manifest, with user and environment variables expanded, to how it is written."""
+    return {os.path.expandvars(os.path.expanduser(path)): path for path in paths}
+
+
+def _manifestReferences(refs, local):
+    """Gives the paths of the rows of a manifest that a list of provenance items refer to."""
+    return [local[os.path.expandvars(os.path.expanduser(ref))] for ref in refs
+            if isinstance(ref, six.string_types) and os.path.expandvars(os.path.expanduser(ref)) in local]
+
+
 def _sortAndFixProvenance(syn, df):
+    import pandas as pd
+
     df = df.set_index('path')
     uploadOrder = {}
     def _checkProvenace(item, path):
@@ -146,23 +280,44 @@ def _sortAndFixProvenance(syn, df):
                                           "Specifically %s, is neither a valid URL or synapseId.") %(path, item))
         return item
 
-    for path, row in df.iterrows():
-        allRefs = []
-        if ('used' in row):
-            used = row['used'].split(';')  if (row['used'].strip()!='') else []   #Get None or split if string
-            df.set_value(path, 'used', [_checkProvenace(item, path) for item in used])
-            allRefs.extend(df.loc[path, 'used'])
-        if ('executed' in row):
-            executed = row['executed'].split(';') if (row['executed'].strip()!='') else [] #Get None or split if string
-            df.set_value(path, 'executed',[_checkProvenace(item, path) for item in executed])
-            allRefs.extend(df.loc[path, 'executed'])
-        uploadOrder[path] = allRefs
-
+    #Work a column at a time, rather than setting values row by row
+    paths = list(df.index)
+    for path in paths:
+        uploadOrder[path] = []
+    for field in ('used', 'executed'):
+        if field in df:
+            values = []
+            for path, value in zip(paths, df[field]):
+                items = value.split(';') if (value.strip()!='') else []   #Get None or split if string
+                items = [_checkProvenace(item, path) for item in items]
+                values.append(items)
+                uploadOrder[path].extend(items)
+            df[field] = pd.Series(values, index=df.index, dtype=object)
+
+    #Only files in the manifest constrain the order of the uploads
+    local = _localPaths(paths)
+    uploadOrder = {path: _manifestReferences(refs, local) for path, refs in uploadOrder.items()}
     uploadOrder = utils.topolgical_sort(uploadOrder)
     df = df.reindex([l[0] for l in uploadOrder])
     return df.reset_index()
 
 
+def _precomputeMd5s(syn, df):
+    """
+    Hashes the local files to upload and those named in provenance together, so their MD5s are
+    in the index when validating provenance and uploading each file asks for them.
+    """
+    paths = [os.path.expandvars(os.path.expanduser(f)) for f in df.path if not is_url(f)]
+    for field in ('used', 'executed'):
+        if field in df:
+            for items in df[field]:
+                for item in items.split(';'):
+                    item = os.path.expandvars(os.path.expanduser(item.strip()))
+                    if item and os.path.isfile(item):
+                        paths.append(item)
+    syn._md5ForFiles(paths, progress=True)
+
+
 def readManifestFile(syn, manifest_file):
     """Verifies a file manifest and returns a reordered dataframe ready for upload.
 
@@ -210,26 +365,31 @@ def readManifestFile(syn, manifest_file):
         raise ValueError("All rows in manifest must contain a unique file to upload")
     sys.stdout.write('OK\n')
 
+    sys.stdout.write('Hashing files...\n')
+    _precomputeMd5s(syn, df)
+
     sys.stdout.write('Validating provenance...')
     df = _sortAndFixProvenance(syn, df)
     sys.stdout.write('OK\n')
 
     sys.stdout.write('Validating that parents exist and are containers...')
-    parents = set(df.parent)
-    for synId in parents:
-        try:
-            container = syn.get(synId, downloadFile=False)
-        except SynapseHTTPError as e:
-            sys.stdout.write('\n%s in the parent column is not a valid Synapse Id\n' %synId)
-            raise(e)
-        if not is_container(container):
-            sys.stdout.write('\n%s in the parent column is is not a Folder or Project\n' %synId)
-            raise SynapseHTTPError
+    parents = sorted(set(df.parent))
+    with ThreadPoolExecutor(DEFAULT_MAX_WORKERS) as executor:
+        futures = [executor.submit(syn.get, synId, downloadFile=False) for synId in parents]
+        for synId, future in zip(parents, futures):
+            try:
+                container = future.result()
+            except SynapseHTTPError as e:
+                sys.stdout.write('\n%s in the parent column is not a valid Synapse Id\n' %synId)
+                raise(e)
+            if not is_container(container):
+                sys.stdout.write('\n%s in the parent column is is not a Folder or Project\n' %synId)
+                raise SynapseHTTPError
     sys.stdout.write('OK\n')
     return df
 
 
-def syncToSynapse(syn, manifest_file, dry_run=False, sendMessages=True, retries=MAX_RETRIES):
+def syncToSynapse(syn, manifest_file, dry_run=False, sendMessages=True, retries=MAX_RETRIES, max_workers=DEFAULT_MAX_WORKERS):
     """Synchronizes files specified in the manifest file to Synapse
 
     :param syn:    A synapse object as obtained with syn = synapseclient.login()
@@ -239,10 +399,21 @@ def syncToSynapse(syn, manifest_file, dry_run=False, sendMessages=True, retries=
     
     :param dry_run: Performs validation without uploading if set to True (default is False)
 
+    :param max_workers: The number of files uploaded at the same time. Defaults to 8
+
     Given a file describing all of the uploads uploads the content to
     Synapse and optionally notifies you via Synapse messagging (email)
     at specific intervals, on errors and on completion.
 
+    Files are uploaded concurrently, each one only once the files in the
+    manifest that it names in its provenance have been stored. A file that
+    fails to upload doesn't stop the others, except those that depend on
+    it. Each stored row is recorded in a journal next to the manifest
+    (the manifest's name followed by .journal), so when an upload is run
+    again after failing or being interrupted, the rows that were stored
+    and haven't changed since are skipped. The journal is removed once
+    every row has been stored.
+
 
 
     **Manifest file format**
@@ -328,27 +499,103 @@ def syncToSynapse(syn, manifest_file, dry_run=False, sendMessages=True, retries=
         return
 
     sys.stdout.write('Starting upload...\n')
+    journal = UploadJournal(manifest_file + JOURNAL_SUFFIX)
     if sendMessages:
         upload = notifyMe(_manifest_upload, syn, 'Upload of %s' %manifest_file, retries=retries)
-        upload(syn, df)
+        upload(syn, df, max_workers, journal)
     else:
-        _manifest_upload(syn,df)
-    
-def _manifest_upload(syn, df):
-    for i, row in df.iterrows():
-        #Todo extract known constructor variables
-        kwargs = {key: row[key] for key in FILE_CONSTRUCTOR_FIELDS if key in row }
-        entity = File(row['path'], parent=row['parent'], **kwargs)
-        entity.annotations = dict(row.drop(FILE_CONSTRUCTOR_FIELDS+STORE_FUNCTION_FIELDS+REQUIRED_FIELDS, errors = 'ignore'))
-        
-        #Update provenance list again to replace all file references that were uploaded
-        if 'used' in row:
-            row['used'] = syn._convertProvenanceList(row['used'])
-        if 'executed' in row:
-            row['executed'] = syn._convertProvenanceList(row['executed'])
-        kwargs = {key: row[key] for key in STORE_FUNCTION_FIELDS if key in row}
-        entity = syn.store(entity, **kwargs)
+        _manifest_upload(syn, df, max_workers, journal)
+
+
+def _manifest_upload(syn, df, max_workers=DEFAULT_MAX_WORKERS, journal=None):
+    rows = [row for _, row in df.iterrows()]
+    paths = [row['path'] for row in rows]
+    rows = dict(zip(paths, rows))
+
+    #Each row waits for the rows it names in its provenance
+    local = _localPaths(paths)
+    dependents = {path: [] for path in paths}
+    waiting = {}
+    for path, row in rows.items():
+        refs = set(_manifestReferences(list(row.get('used', None) or []) + list(row.get('executed', None) or []), local))
+        refs.discard(path)
+        waiting[path] = len(refs)
+        for ref in refs:
+            dependents[ref].append(path)
+
+    ready = collections.deque(path for path in paths if waiting[path] == 0)
+    running = {}
+    errors = []
+    stored = set()
+    with ThreadPoolExecutor(max_workers) as executor:
+        while ready or running:
+            while ready:
+                path = ready.popleft()
+                digest = _rowDigest(syn, rows[path])
+                if journal is not None and journal.completed(path, digest):
+                    stored.add(path)
+                    ready.extend(_release(path, dependents, waiting))
+                else:
+                    running[executor.submit(_storeRow, syn, rows[path])] = (path, digest)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, digest = running.pop(future)
+                try:
+                    entity = future.result()
+                except Exception as ex:
+                    sys.stderr.write('Failed to upload %s: %s\n' % (path, ex))
+                    errors.append(path)
+                    continue
+                stored.add(path)
+                if journal is not None:
+                    journal.record(path, digest, entity.id)
+                ready.extend(_release(path, dependents, waiting))
+
+    if len(stored) < len(paths):
+        blocked = len(paths) - len(stored) - len(errors)
+        raise SynapseError('Failed to upload %i of %i files%s: %s' % (len(errors), len(paths),
+                           ' and %i files whose provenance depends on them' % blocked if blocked else '',
+                           ', '.join(errors)))
+    if journal is not None:
+        journal.remove()
     return True
 
+
+def _release(path, dependents, waiting):
+    """Records that a row was stored, giving the rows that no longer wait on any other."""
+    released = []
+    for dependent in dependents[path]:
+        waiting[dependent] -= 1
+        if waiting[dependent] == 0:
+            released.append(dependent)
+    return released
+
+
+def _rowDigest(syn, row):
+    """A digest of the values of a manifest row and of the content of its file."""
+    values = {key: value if isinstance(value, (list, six.string_types)) else str(value) for key, value in row.items()}
+    path = os.path.expandvars(os.path.expanduser(row['path']))
+    if os.path.isfile(path):
+        values['md5'] = syn._md5ForFile(path)
+    return hashlib.md5(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _storeRow(syn, row):
+    row = row.copy()
+    #Todo extract known constructor variables
+    kwargs = {key: row[key] for key in FILE_CONSTRUCTOR_FIELDS if key in row }
+    entity = File(row['path'], parent=row['parent'], **kwargs)
+    entity.annotations = dict(row.drop(FILE_CONSTRUCTOR_FIELDS+STORE_FUNCTION_FIELDS+REQUIRED_FIELDS, errors = 'ignore'))
+
+    #Update provenance list again to replace all file references that were uploaded
+    if 'used' in row:
+        row['used'] = syn._convertProvenanceList(row['used'])
+    if 'executed' in row:
+        row['executed'] = syn._convertProvenanceList(row['executed'])
+    kwargs = {key: row[key] for key in STORE_FUNCTION_FIELDS if key in row}
+    return syn.store(entity, **kwargs)
+
     
 
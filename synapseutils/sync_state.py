@@ -0,0 +1,168 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import contextlib
+import io
+import json
+import os
+import six
+import sqlite3
+import threading
+
+SYNC_STATE_FILENAME = '.SYNAPSE_SYNC_STATE.db'
+
+
+class SyncState(object):
+    """
+    Records what :py:func:`synapseutils.syncFromSynapse` downloaded into a directory, in a SQLite
+    database in that directory, so a later sync only fetches what changed.
+
+    Each file is recorded with its ID, version, etag and modification time in Synapse, its file
+    handle, the local path and size and modification time of the local file, and what is needed
+    to recreate the entity and its manifest row without asking Synapse: its properties,
+    annotations, local state and provenance.
+    """
+
+    def __init__(self, directory, file_name=SYNC_STATE_FILENAME):
+        self.path = os.path.join(directory, file_name)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS files ("
+                               "id TEXT PRIMARY KEY, version INTEGER, etag TEXT, modified_on TEXT, "
+                               "file_handle_id TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, "
+                               "entity TEXT NOT NULL, provenance TEXT)")
+
+
+    def _connect(self):
+        return contextlib.closing(sqlite3.connect(self.path, timeout=60, isolation_level=None))
+
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None, None
+        mtime_ns = getattr(st, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(st.st_mtime * 10**9)
+        return st.st_size, mtime_ns
+
+
+    def ids(self):
+        with self._connect() as connection:
+            return set(row[0] for row in connection.execute("SELECT id FROM files"))
+
+
+    def unchanged(self, header):
+        """
+        Looks up a file listed in a container.
+
+        :param header: the entity header of the file, as listed by :py:func:`synapseclient.Synapse.getChildren`
+
+        :returns: a tuple of the recorded entity as a dictionary of properties, annotations and local
+                  state, and its provenance, if the file hasn't changed in Synapse since it was
+                  recorded and its local copy is unchanged. Otherwise None.
+        """
+        if header.get('versionNumber', None) is None or header.get('modifiedOn', None) is None:
+            return None
+        with self._connect() as connection:
+            row = connection.execute("SELECT version, modified_on, path, size, mtime_ns, entity, provenance "
+                                     "FROM files WHERE id = ?", (header['id'],)).fetchone()
+        if row is None:
+            return None
+        version, modified_on, path, size, mtime_ns, entity, provenance = row
+        if version != header['versionNumber'] or modified_on != header['modifiedOn']:
+            return None
+        if path is not None and self._stat(path) != (size, mtime_ns):
+            return None
+        return json.loads(entity), (None if provenance is None else json.loads(provenance))
+
+
+    def put_many(self, items):
+        """
+        Records downloaded files in one transaction.
+
+        :param items: a list of tuples of the entity header each file was listed with, the dictionary
+                      of the entity's properties, annotations and local state, and its provenance.
+                      Files are recorded under the ID they were listed with, which for a followed
+                      link is that of the link rather than of the entity.
+        """
+        rows = []
+        for header, entity, provenance in items:
+            properties = entity['properties']
+            path = entity['local_state'].get('path', None)
+            size, mtime_ns = self._stat(path) if path is not None else (None, None)
+            rows.append((header['id'], header.get('versionNumber', None),
+                         properties.get('etag', None), header.get('modifiedOn', None),
+                         properties.get('dataFileHandleId', None), path, size, mtime_ns,
+                         json.dumps(entity), None if provenance is None else json.dumps(provenance)))
+        with self._connect() as connection:
+            connection.execute("BEGIN")
+            connection.executemany("INSERT OR REPLACE INTO files (id, version, etag, modified_on, file_handle_id, "
+                                   "path, size, mtime_ns, entity, provenance) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   rows)
+            connection.execute("COMMIT")
+
+
+    def remove_many(self, ids):
+        """
+        Forgets files, returning the local paths they were recorded with.
+        """
+        paths = []
+        with self._connect() as connection:
+            connection.execute("BEGIN")
+            for id in ids:
+                row = connection.execute("SELECT path FROM files WHERE id = ?", (id,)).fetchone()
+                if row is not None:
+                    paths.append(row[0])
+                    connection.execute("DELETE FROM files WHERE id = ?", (id,))
+            connection.execute("COMMIT")
+        return paths
+
+
+class UploadJournal(object):
+    """
+    An append-only record of the manifest rows :py:func:`synapseutils.syncToSynapse` has stored,
+    so an upload that stopped part way through skips them when it is run again.
+
+    Each line is a JSON object giving the path of a row, a digest of the row and of the content of
+    its file, and the Synapse ID it was stored as. A row is only skipped if its digest is unchanged.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._completed = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with io.open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # a line cut short by a crash
+                    self._completed[record['path']] = record
+
+
+    def completed(self, path, digest):
+        record = self._completed.get(path, None)
+        return record is not None and record['digest'] == digest
+
+
+    def record(self, path, digest, entity_id):
+        record = {'path': path, 'digest': digest, 'id': entity_id}
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            with io.open(self.path, 'a', encoding='utf-8') as f:
+                f.write(six.text_type(line))
+                f.flush()
+                os.fsync(f.fileno())
+            self._completed[path] = record
+
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,181 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import six
+
+from synapseclient import utils
+from synapseclient.table import RowSet, Row, PartialRowSet, PartialRow, RowSelection, to_boolean
+
+MAX_ROWS_PER_ROWSET = 5000
+
+
+def syncTable(syn, table_id, df, key_columns):
+    """Updates a Synapse table to match a data frame, sending only the cells that changed.
+
+    Rows are matched on the values of the key columns. The rows of the data frame are compared
+    with those of the current table snapshot over the columns of the data frame, then rows
+    missing from the table are appended, the cells that differ in the other rows are updated in
+    place with a :py:class:`synapseclient.table.PartialRowSet` and table rows missing from the
+    data frame are deleted. Unchanged rows and cells are not sent at all.
+
+    :param syn:          A synapse object as obtained with syn = synapseclient.login()
+
+    :param table_id:     The Synapse ID of the table, or the table schema
+
+    :param df:           A Pandas DataFrame whose columns are a subset of the table's columns
+
+    :param key_columns:  The names of the columns whose values identify a row, in both the
+                         data frame and the table
+
+    :returns: a dictionary giving the number of rows 'inserted', 'updated' and 'deleted'
+
+    Example::
+
+        import synapseutils
+        import synapseclient
+        syn = synapseclient.login()
+
+        df = pd.read_csv('daily_refresh.csv')
+        synapseutils.syncTable(syn, 'syn1234567', df, key_columns=['sample_id'])
+    """
+    table_id = utils.id_of(table_id)
+    if isinstance(key_columns, six.string_types):
+        key_columns = [key_columns]
+
+    columns = {column.name: column for column in syn.getTableColumns(table_id)}
+    names = [six.text_type(name) for name in df.columns]
+    missing = [name for name in names if name not in columns]
+    if missing:
+        raise ValueError("The data frame has columns that are not in table %s: %s" % (table_id, ', '.join(missing)))
+    missing = [name for name in key_columns if name not in names]
+    if missing:
+        raise ValueError("The key columns are not in the data frame: %s" % ', '.join(missing))
+    if df.columns.duplicated().any():
+        raise ValueError("The data frame has duplicate column names")
+
+    key_indices = [names.index(name) for name in key_columns]
+    normalizers = [_normalizer(columns[name].columnType) for name in names]
+
+    ## the current snapshot, restricted to the data frame's columns
+    results = syn.tableQuery('select %s from %s' % (', '.join('"%s"' % name.replace('"', '""') for name in names), table_id),
+                             resultsAs="csv", includeRowIdAndRowVersion=True)
+    ## values are found by the names of the columns of the results rather than by their position
+    indices = {header.name: i for i, header in enumerate(results.headers)}
+    row_id_index, row_version_index = indices['ROW_ID'], indices['ROW_VERSION']
+    value_indices = [indices[name] for name in names]
+    headers = [results.headers[i] for i in value_indices]
+
+    def remote_rows():
+        for row in results:
+            values = [normalize(row[i]) for normalize, i in zip(normalizers, value_indices)]
+            yield int(row[row_id_index]), tuple(values[i] for i in key_indices), values
+
+    def local_rows():
+        for row in df[list(df.columns)].itertuples(index=False, name=None):
+            values = [normalize(value) for normalize, value in zip(normalizers, row)]
+            yield tuple(values[i] for i in key_indices), values
+
+    inserts, updates, deletes = _diff_rows(remote_rows(), local_rows())
+
+    etag = results.etag
+    changes = [PartialRow({columns[names[i]].id: value for i, value in six.iteritems(cells)}, rowId=rowId)
+               for rowId, cells in updates]
+    for i in range(0, len(changes), MAX_ROWS_PER_ROWSET):
+        response = syn.store(PartialRowSet(table_id, changes[i:i + MAX_ROWS_PER_ROWSET]))
+        etag = response.get('etag', etag)
+
+    for i in range(0, len(inserts), MAX_ROWS_PER_ROWSET):
+        response = syn.store(RowSet(headers=headers, tableId=table_id, etag=etag,
+                                    rows=[Row(values) for values in inserts[i:i + MAX_ROWS_PER_ROWSET]]))
+        etag = response.get('etag', etag)
+
+    for i in range(0, len(deletes), MAX_ROWS_PER_ROWSET):
+        response = syn.delete(RowSelection(deletes[i:i + MAX_ROWS_PER_ROWSET], etag, table_id))
+        etag = response.get('etag', etag)
+
+    return {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletes)}
+
+
+def _diff_rows(remote_rows, local_rows):
+    """
+    Compare the rows of a table with the rows that should replace them.
+
+    :param remote_rows: an iterable of (rowId, key, values) for the rows of the table
+    :param local_rows:  an iterable of (key, values) for the new rows
+
+    :returns: a tuple of the values of the new rows to insert, (rowId, cells) for the rows to
+              update, where cells maps the index of each changed value to its new value, and
+              the IDs of the rows to delete
+    """
+    remote = {}
+    for rowId, key, values in remote_rows:
+        if key in remote:
+            raise ValueError("The table has more than one row with the key: %s" % (key,))
+        remote[key] = (rowId, values)
+
+    inserts = []
+    updates = []
+    seen = set()
+    for key, values in local_rows:
+        if key in seen:
+            raise ValueError("The data frame has more than one row with the key: %s" % (key,))
+        seen.add(key)
+        if key not in remote:
+            inserts.append(values)
+        else:
+            rowId, remote_values = remote[key]
+            cells = {i: value for i, (value, remote_value) in enumerate(zip(values, remote_values)) if value != remote_value}
+            if cells:
+                updates.append((rowId, cells))
+
+    deletes = [rowId for key, (rowId, values) in six.iteritems(remote) if key not in seen]
+    return inserts, updates, sorted(deletes)
+
+
+def _is_null(value):
+    ## NaN and NaT are the only values not equal to themselves and
+    ## pandas.NA refuses to be compared at all
+    try:
+        return bool(value is None or value == '' or value != value)
+    except TypeError:
+        return True
+
+
+def _to_boolean(value):
+    return to_boolean(value) if isinstance(value, six.string_types) else bool(value)
+
+
+def _to_epoch_millis(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = (value - value.utcoffset()).replace(tzinfo=None)
+        delta = value - utils.UNIX_EPOCH
+    elif isinstance(value, datetime.date):
+        delta = value - utils.UNIX_EPOCH.date()
+    else:
+        return int(value)
+    ## from the integer parts, as total_seconds() can be a floating point hair short of a millisecond
+    return delta.days * 86400000 + delta.seconds * 1000 + delta.microseconds // 1000
+
+
+def _to_text(value):
+    return value if isinstance(value, six.text_type) else six.text_type(value)
+
+
+## functions giving values from either a data frame or a table query the same
+## representation, used both to hash rows and as the values sent to Synapse
+_NORMALIZERS = {'INTEGER': int,
+                'DOUBLE': float,
+                'BOOLEAN': _to_boolean,
+                'DATE': _to_epoch_millis}
+
+
+def _normalizer(columnType):
+    convert = _NORMALIZERS.get(columnType, _to_text)
+
+    def normalize(value):
+        return None if _is_null(value) else convert(value)
+    return normalize
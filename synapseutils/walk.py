@@ -1,9 +1,10 @@
 import synapseclient
 from synapseclient.entity import is_container
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
 import json
 
-def walk(syn, synId):
+def walk(syn, synId, max_workers=4, ordered=True):
     """
     Traverse through the hierarchy of files and folders stored under the synId. Has the same behavior
     as os.walk()
@@ -12,6 +13,15 @@ def walk(syn, synId):
 
     :param synId:          A synapse ID of a folder or project
 
+    :param max_workers:    The number of folders whose children are listed at the same time
+
+    :param ordered:        If True (the default), folders are yielded in the same top down order as os.walk().
+                           Otherwise each folder is yielded as soon as its children have been listed, which
+                           keeps every worker busy on wide hierarchies.
+
+    As with os.walk(), removing entries from the list of folders before the walk resumes stops it from
+    listing those folders.
+
     Example::
 
         walkedPath = walk(syn, "syn1234")
@@ -22,30 +32,62 @@ def walk(syn, synId):
             print(filename) #All the files in the directory path
 
     """
-    return(_helpWalk(syn,synId))
+    return(_helpWalk(syn, synId, max_workers, ordered))
 
-#Helper function to hide the newpath parameter
-def _helpWalk(syn,synId,newpath=None):
+#Helper function that walks from the starting container, listing children on a pool of threads.
+#With headers set, folders and files are given as the entity headers of the listings rather than
+#as (name, id) tuples.
+def _helpWalk(syn, synId, max_workers=4, ordered=True, headers=False):
     starting = syn.get(synId,downloadFile=False)
     #If the first file is not a container, return immediately
-    if newpath is None and not is_container(starting):
+    if not is_container(starting):
         return
-    elif newpath is None:
-        dirpath = (starting.name, synId)
-    else:
-        dirpath = (newpath,synId)
+
+    executor = ThreadPoolExecutor(max(1, max_workers))
+    pending = []
+    def submit(dirpath):
+        future = executor.submit(_listChildren, syn, dirpath, headers)
+        pending.append(future)
+        return future
+
+    try:
+        #The names of folders come from the listing of their parent, so only the starting container is fetched
+        root = submit((starting.name, synId))
+        if ordered:
+            stack = [root]
+            while stack:
+                future = stack.pop()
+                pending.remove(future)
+                dirpath, dirs, nondirs = future.result()
+                yield dirpath, dirs, nondirs
+                stack.extend(reversed([submit((os.path.join(dirpath[0], name), id)) for name, id in map(_nameAndId, dirs)]))
+        else:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    dirpath, dirs, nondirs = future.result()
+                    yield dirpath, dirs, nondirs
+                    for name, id in map(_nameAndId, dirs):
+                        submit((os.path.join(dirpath[0], name), id))
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _listChildren(syn, dirpath, headers=False):
     dirs = []
     nondirs = []
-    results = syn.getChildren(synId)
+    results = syn.getChildren(dirpath[1])
     for i in results:
+        item = i if headers else (i['name'],i['id'])
         if is_container(i):
-            dirs.append((i['name'],i['id']))
+            dirs.append(item)
         else:
-            nondirs.append((i['name'],i['id']))
-    yield dirpath, dirs, nondirs
-    for name in dirs:
-        newpath = os.path.join(dirpath[0],name[0])
-        for x in _helpWalk(syn, name[1], newpath=newpath):
-            yield x
+            nondirs.append(item)
+    return dirpath, dirs, nondirs
 
 
+def _nameAndId(item):
+    return item if isinstance(item, tuple) else (item['name'], item['id'])
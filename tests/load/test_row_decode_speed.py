@@ -0,0 +1,52 @@
+"""
+Compare the rate at which rows of table query results are converted from strings
+by calling cast_values for each row versus using a decoder built once by row_decoder.
+
+    python tests/load/test_row_decode_speed.py --rows 1000000
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import time
+
+from synapseclient.table import SelectColumn, cast_values, row_decoder
+
+
+MIXED_HEADERS = [SelectColumn(name='name', columnType='STRING'),
+                 SelectColumn(name='x', columnType='DOUBLE'),
+                 SelectColumn(name='n', columnType='INTEGER'),
+                 SelectColumn(name='living', columnType='BOOLEAN'),
+                 SelectColumn(name='file', columnType='FILEHANDLEID')]
+MIXED_ROW = ['John Coltrane', '8.65', '1926', 'false', '']
+
+STRING_HEADERS = [SelectColumn(name='col%d' % i, columnType='STRING') for i in range(5)]
+STRING_ROW = ['a', 'b', '', 'd', 'e']
+
+
+def rows_per_second(convert, row, n_rows):
+    t0 = time.time()
+    for i in range(n_rows):
+        convert(row)
+    return n_rows / (time.time() - t0)
+
+
+def test_row_decode_speed(n_rows=100000):
+    for description, headers, row in [('mixed types', MIXED_HEADERS, MIXED_ROW),
+                                      ('all strings', STRING_HEADERS, STRING_ROW)]:
+        before = rows_per_second(lambda values: cast_values(values, headers), row, n_rows)
+        after = rows_per_second(row_decoder(headers), row, n_rows)
+        print('%-12s cast_values: %10.0f rows/sec   row_decoder: %10.0f rows/sec   (%0.1fx)' % (description, before, after, after / before))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+    test_row_decode_speed(args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -314,4 +314,129 @@ def test_set_cache_root_dir():
 
     #test that manually assigning cache_root_dir expands the path
     my_cache.cache_root_dir = non_expanded_path + "2"
-    assert_equal(expanded_path + "2", my_cache.cache_root_dir)
\ No newline at end of file
+    assert_equal(expanded_path + "2", my_cache.cache_root_dir)
+
+def test_normalize_sql():
+    assert_equal(cache.normalize_sql("  select *\n   from  syn123\twhere a='x  y' "),
+                 "select * from syn123 where a='x  y'")
+    assert_equal(cache.normalize_sql('select "my  col" from syn123'), 'select "my  col" from syn123')
+
+
+def test_query_result_cache():
+    my_cache = cache.Cache(cache_root_dir=tempfile.mkdtemp())
+    query_result_cache = cache.QueryResultCache(my_cache, max_size=20)
+    request = {"sql": "select * from syn123", "csvTableDescriptor": {"separator": ","}}
+
+    key = query_result_cache.key("select * from syn123", request, etag="etag-1")
+    assert_equal(key, query_result_cache.key(" select *  from syn123", request, etag="etag-1"))
+    assert key != query_result_cache.key("select * from syn123", request, etag="etag-2")
+    assert key != query_result_cache.key("select * from syn123", {"sql": "select * from syn123", "csvTableDescriptor": {"separator": "\t"}}, etag="etag-1")
+    assert_is_none(query_result_cache.get(key))
+
+    def add_result(file_handle_id, key):
+        path = os.path.join(my_cache.get_cache_dir(file_handle_id), "query_results.csv")
+        utils.touch(path)
+        with open(path, 'w') as f:
+            f.write("a,b\n1,2\n")
+        my_cache.add(file_handle_id, path)
+        query_result_cache.add(key, {"resultsFileHandleId": file_handle_id}, path)
+        return path
+
+    path1 = add_result(101, key)
+    assert_equal(({"resultsFileHandleId": 101}, path1), query_result_cache.get(key))
+    parquet_path1 = os.path.splitext(path1)[0] + '.parquet'
+    utils.touch(parquet_path1)
+
+    ## adding more than max_size bytes of results evicts the least recently used,
+    ## along with the Parquet files converted from them
+    path2 = add_result(102, "key2")
+    path3 = add_result(103, "key3")
+    assert_is_none(query_result_cache.get(key))
+    assert_false(os.path.exists(path1))
+    assert_false(os.path.exists(parquet_path1))
+    assert_equal(({"resultsFileHandleId": 102}, path2), query_result_cache.get("key2"))
+    assert_equal(({"resultsFileHandleId": 103}, path3), query_result_cache.get("key3"))
+
+    ## results whose files have been removed from the cache are forgotten
+    os.remove(path3)
+    assert_is_none(query_result_cache.get("key3"))
+    assert_false("key3" in query_result_cache._read_index())
+
+
+def test_entity_bundle_cache():
+    bundle_cache = cache.EntityBundleCache()
+    latest = cache.EntityBundleCache.key('syn123', None, 0x3)
+    version = cache.EntityBundleCache.key('syn123', '2', 0x3)
+    assert_equal(('syn123', 2, 0x3), version)
+    assert_equal((None, False), bundle_cache.get(latest, 60))
+
+    bundle_cache.put(latest, {'entity': {'id': 'syn123'}}, max_size=2)
+    bundle_cache.put(version, {'entity': {'id': 'syn123', 'versionNumber': 2}}, max_size=2)
+    assert_equal(({'entity': {'id': 'syn123'}}, False), bundle_cache.get(latest, 60))
+    assert_equal(({'entity': {'id': 'syn123'}}, True), bundle_cache.get(latest, 0))
+    assert_equal(({'entity': {'id': 'syn123', 'versionNumber': 2}}, False), bundle_cache.get(version, 0))
+
+    ## bundles with access requirements expire whatever their version
+    restricted = cache.EntityBundleCache.key('syn123', 2, 0x400 | 0x1)
+    assert_false(cache.EntityBundleCache.has_access_control(version))
+    assert_true(cache.EntityBundleCache.has_access_control(restricted))
+    bundle_cache.put(restricted, {'entity': {'id': 'syn123', 'versionNumber': 2}}, max_size=3)
+    assert_equal(({'entity': {'id': 'syn123', 'versionNumber': 2}}, False), bundle_cache.get(restricted, 60))
+    assert_equal(({'entity': {'id': 'syn123', 'versionNumber': 2}}, True), bundle_cache.get(restricted, 0))
+
+    bundle_cache.invalidate('syn123')
+    assert_equal((None, False), bundle_cache.get(latest, 60))
+    assert_equal((None, False), bundle_cache.get(version, 60))
+
+
+def test_metadata_store():
+    cache_root_dir = tempfile.mkdtemp()
+    store = cache.MetadataStore(cache_root_dir)
+    assert_is_none(store.get('column', 123))
+
+    store.put('column', 123, {'id': '123', 'name': 'foo'})
+    store.put_many('fileHandle', [('1', {'id': '1'}), ('2', {'id': '2'})])
+    assert_equal({'id': '123', 'name': 'foo'}, store.get('column', '123'))
+    assert_is_none(store.get('fileHandle', '123'))
+
+    ## values outlive the store that saved them
+    store = cache.MetadataStore(cache_root_dir)
+    assert_equal({'id': '2'}, store.get('fileHandle', 2))
+    assert_equal({'id': '2'}, store.get('fileHandle', 2, max_age=60))
+    assert_is_none(store.get('fileHandle', 2, max_age=0))
+    store.remove('fileHandle', 2)
+    assert_is_none(store.get('fileHandle', 2))
+
+    store.put_many('bundle', [('syn1.1.3', {'id': 'syn1'}), ('syn1.2.3', {'id': 'syn1'}), ('syn12.1.3', {'id': 'syn12'})])
+    assert_equal([{'id': 'syn1'}, {'id': 'syn1'}], store.remove_prefix('bundle', 'syn1.'))
+    assert_is_none(store.get('bundle', 'syn1.2.3'))
+    assert_equal({'id': 'syn12'}, store.get('bundle', 'syn12.1.3'))
+
+
+def test_md5_index():
+    cache_root_dir = tempfile.mkdtemp()
+    path = utils.touch(os.path.join(cache_root_dir, 'data.txt'))
+    with open(path, 'w') as f:
+        f.write('some data')
+    expected = utils.md5_for_file(path).hexdigest()
+
+    with patch.object(utils, "md5_for_file", wraps=utils.md5_for_file) as mocked_md5:
+        ## a file modified just now is hashed every time
+        index = cache.Md5Index(cache_root_dir)
+        assert_equal(expected, index.md5_for_file(path))
+        assert_is_none(index.get(path))
+
+        ## an older file is only hashed once, across sessions
+        past = time.time() - 60
+        os.utime(path, (past, past))
+        mocked_md5.reset_mock()
+        assert_equal(expected, index.md5_for_file(path))
+        assert_equal(expected, cache.Md5Index(cache_root_dir).md5_for_file(path))
+        assert_equal(1, mocked_md5.call_count)
+
+        ## and hashed again once it changes
+        with open(path, 'a') as f:
+            f.write(' and more')
+        os.utime(path, (past, past))
+        assert_is_none(index.get(path))
+        assert_equal(utils.md5_for_file(path).hexdigest(), index.md5_for_file(path))
@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import threading
+from mock import MagicMock
+from nose.tools import assert_equals, assert_raises
+
+import synapseclient
+from synapseclient.async_job import gather
+from synapseclient.exceptions import SynapseError, SynapseTimeoutError
+
+
+def setup(module):
+    print('\n')
+    print('~' * 60)
+    print(os.path.basename(__file__))
+    print('~' * 60)
+
+
+def _mock_synapse(responses):
+    """
+    Make a Synapse object whose asynchronous jobs, identified by their URIs, return the given
+    sequences of responses when polled.
+    """
+    syn = synapseclient.client.Synapse(debug=False, skip_checks=True)
+    syn.table_query_sleep = 0.001
+    syn.table_query_max_sleep = 0.01
+    syn.restPOST = MagicMock(side_effect=lambda uri, body, endpoint=None: {"token": "1234567"})
+    lock = threading.Lock()
+
+    def restGET(uri, endpoint=None):
+        with lock:
+            return responses[uri.split('/get/')[0]].pop(0)
+    syn.restGET = MagicMock(side_effect=restGET)
+    return syn
+
+
+def test_submitAsyncJob():
+    processing = {"jobState": "PROCESSING"}
+    syn = _mock_synapse({"/job/%d" % i: [processing] * i + [{"result": i}] for i in range(20)})
+
+    futures = [syn.submitAsyncJob("/job/%d" % i, {"i": i}) for i in range(20)]
+    results = gather(futures, timeout=10)
+
+    assert_equals([{"result": i} for i in range(20)], results)
+    assert_equals(20, syn.restPOST.call_count)
+    assert_equals(sum(range(20)) + 20, syn.restGET.call_count)
+
+
+def test_submitAsyncJob__failure():
+    syn = _mock_synapse({"/job/ok": [{"result": "ok"}],
+                         "/job/bad": [{"jobState": "FAILED", "errorMessage": "oops", "errorDetails": "details"}]})
+
+    ok = syn.submitAsyncJob("/job/ok", {})
+    bad = syn.submitAsyncJob("/job/bad", {})
+
+    assert_equals({"result": "ok"}, ok.result(timeout=10))
+    assert_raises(SynapseError, bad.result, 10)
+    assert_raises(SynapseError, gather, [ok, bad], 10)
+
+
+def test_submitAsyncJob__timeout():
+    syn = _mock_synapse({"/job/slow": [{"jobState": "PROCESSING"}] * 1000})
+    syn.table_query_timeout = 0.05
+
+    future = syn.submitAsyncJob("/job/slow", {})
+    assert_raises(SynapseTimeoutError, future.result, 10)
+
+
+def test_submitAsyncJob__continuation():
+    syn = _mock_synapse({"/job/1": [{"jobState": "PROCESSING"}, {"value": 21}]})
+
+    future = syn._async_job_scheduler.submit("/job/1", {}, then=lambda result: result["value"] * 2)
+    assert_equals(42, future.result(timeout=10))
+
+
+def test_tableQueryAsync__rowset():
+    bundle = {'concreteType': 'org.sagebionetworks.repo.model.table.QueryResultBundle',
+              'queryResult': {
+                  'concreteType': 'org.sagebionetworks.repo.model.table.QueryResult',
+                  'queryResults': {'etag': 'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee',
+                                   'headers': [{'columnType': 'STRING', 'name': 'State'},
+                                               {'columnType': 'INTEGER', 'name': 'Born'}],
+                                   'rows': [{'rowId': 1, 'versionNumber': 1, 'values': ['PA', '1935']}],
+                                   'tableId': 'syn2757980'}}}
+    syn = _mock_synapse({"/entity/syn2757980/table/query/async": [bundle]})
+
+    result = syn.tableQueryAsync("select State, Born from syn2757980", resultsAs="rowset").result(timeout=10)
+
+    assert_equals('syn2757980', result.tableId)
+    assert_equals([['PA', 1935]], [row['values'] for row in result])
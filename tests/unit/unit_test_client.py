@@ -1,5 +1,5 @@
 import os, json, tempfile, base64, sys
-from mock import patch, mock_open, call
+from mock import patch, mock_open, call, Mock
 from builtins import str
 
 import uuid
@@ -260,6 +260,33 @@ def test__uploadExternallyStoringProjects_external_user(mock_upload_destination)
     assert_equal(expected_local_state, local_state)
     assert_equal(expected_storage_location_id, storage_location_id)
 
+def test_getDefaultUploadDestination__cache():
+    syn = synapseclient.Synapse(debug=False, skip_checks=True)
+    destination = {'storageLocationId': 1234, 'concreteType': 'org.sagebionetworks.repo.model.file.S3UploadDestination'}
+    with patch.object(syn, "restGET", return_value=destination) as mocked_GET:
+        for i in range(3):
+            assert_equal(destination, syn._getDefaultUploadDestination({'parentId': 'syn123'}))
+        syn._getDefaultUploadDestination({'parentId': 'syn456'})
+        assert_equal(['/entity/syn123/uploadDestination', '/entity/syn456/uploadDestination'],
+                     [c[0][0] for c in mocked_GET.call_args_list])
+
+        ## changing project settings through the client forgets every destination
+        with patch("requests.put", return_value=Mock(status_code=200, headers={})), \
+             patch.object(syn, "_generateSignedHeaders", return_value={}):
+            syn.restPUT('/projectSettings', body='{}')
+        mocked_GET.reset_mock()
+        syn._getDefaultUploadDestination({'parentId': 'syn123'})
+        syn._getDefaultUploadDestination({'parentId': 'syn456'})
+        assert_equal(2, mocked_GET.call_count)
+
+        syn.invalidateUploadDestinations('syn123')
+        syn.upload_destination_cache_ttl = 0
+        mocked_GET.reset_mock()
+        syn._getDefaultUploadDestination({'parentId': 'syn456'})
+        syn._getDefaultUploadDestination({'parentId': 'syn456'})
+        assert_equal(2, mocked_GET.call_count)
+
+
 def test_login__only_username_config_file_username_mismatch():
     if (sys.version < '3'):
         configparser_package_name = 'ConfigParser'
@@ -362,3 +389,225 @@ def test_getChildren__nextPageToken():
         expected_POST_url = '/entity/children'
         mocked_POST.assert_has_calls([call(expected_POST_url, body=expected_request_JSON(None)), call(expected_POST_url, body=expected_request_JSON(nextPageToken))])
 
+
+
+def test_getEntityBundle__cache():
+    syn = synapseclient.Synapse(debug=False, skip_checks=True)
+    syn.entity_bundle_cache_size = 2
+    entity = {'id': 'syn123', 'etag': 'etag-1', 'versionNumber': 2}
+    bundles = {'/entity/syn123/bundle?mask=3': {'entity': entity, 'annotations': {}},
+               '/entity/syn123/version/1/bundle?mask=3': {'entity': dict(entity, versionNumber=1), 'annotations': {}},
+               '/entity/syn456/version/1/bundle?mask=3': {'entity': {'id': 'syn456'}, 'annotations': {}},
+               '/entity/syn123': entity}
+
+    with patch.object(syn, "restGET", side_effect=lambda uri: bundles[uri]) as mocked_GET:
+        assert_equal(bundles['/entity/syn123/bundle?mask=3'], syn._getEntityBundle('syn123', bitFlags=0x3))
+
+        ## the latest version is reused while its etag is unchanged, and changes to a
+        ## bundle don't reach the cache
+        bundle = syn._getEntityBundle('syn123', bitFlags=0x3)
+        bundle['annotations']['changed'] = True
+        assert_equal(bundles['/entity/syn123/bundle?mask=3'], syn._getEntityBundle('syn123', bitFlags=0x3))
+        assert_equal([call('/entity/syn123/bundle?mask=3'), call('/entity/syn123'), call('/entity/syn123')],
+                     mocked_GET.call_args_list)
+
+        entity['etag'] = 'etag-2'
+        mocked_GET.reset_mock()
+        syn._getEntityBundle('syn123', bitFlags=0x3)
+        assert_equal([call('/entity/syn123'), call('/entity/syn123/bundle?mask=3')], mocked_GET.call_args_list)
+
+        ## within the TTL the etag isn't checked, and a specific version is always reused
+        syn.entity_bundle_cache_ttl = 60
+        mocked_GET.reset_mock()
+        syn._getEntityBundle('syn123', bitFlags=0x3)
+        syn._getEntityBundle('syn123', version=1, bitFlags=0x3)
+        syn._getEntityBundle('syn123', version=1, bitFlags=0x3)
+        assert_equal([call('/entity/syn123/version/1/bundle?mask=3')], mocked_GET.call_args_list)
+
+        ## the least recently used bundle is evicted
+        mocked_GET.reset_mock()
+        syn._getEntityBundle('syn456', version=1, bitFlags=0x3)
+        syn._getEntityBundle('syn123', version=1, bitFlags=0x3)
+        syn._getEntityBundle('syn123', bitFlags=0x3)
+        assert_equal([call('/entity/syn456/version/1/bundle?mask=3'), call('/entity/syn123/bundle?mask=3')],
+                     mocked_GET.call_args_list)
+
+        ## changing the entity removes all of its bundles
+        with patch.object(syn, "restPUT", return_value={'id': 'syn123', 'etag': 'etag-3', 'annotations': {}}):
+            syn.setAnnotations(entity, {'foo': 'bar'})
+        mocked_GET.reset_mock()
+        syn._getEntityBundle('syn123', bitFlags=0x3)
+        syn._getEntityBundle('syn123', version=1, bitFlags=0x3)
+        assert_equal([call('/entity/syn123/bundle?mask=3'), call('/entity/syn123/version/1/bundle?mask=3')],
+                     mocked_GET.call_args_list)
+
+    ## bundles with access requirements are only reused within the TTL, without checking the etag
+    syn = synapseclient.Synapse(debug=False, skip_checks=True)
+    syn.entity_bundle_cache_size = 2
+    bundles = {'/entity/syn123/bundle?mask=1025': {'entity': entity, 'unmetAccessRequirements': []},
+               '/entity/syn123/version/1/bundle?mask=1025': {'entity': dict(entity, versionNumber=1), 'unmetAccessRequirements': []}}
+    with patch.object(syn, "restGET", side_effect=lambda uri: bundles[uri]) as mocked_GET:
+        for i in range(2):
+            syn._getEntityBundle('syn123', bitFlags=0x401)
+            syn._getEntityBundle('syn123', version=1, bitFlags=0x401)
+        assert_equal(2 * [call('/entity/syn123/bundle?mask=1025'), call('/entity/syn123/version/1/bundle?mask=1025')],
+                     mocked_GET.call_args_list)
+
+        syn.entity_bundle_cache_ttl = 60
+        mocked_GET.reset_mock()
+        syn._getEntityBundle('syn123', bitFlags=0x401)
+        syn._getEntityBundle('syn123', version=1, bitFlags=0x401)
+        assert_equal([], mocked_GET.call_args_list)
+
+
+def test_get__offline():
+    cache_root_dir = tempfile.mkdtemp()
+    bundle = {'entity': {'id': 'syn123', 'name': 'data.txt', 'versionNumber': 3, 'dataFileHandleId': '42',
+                         'concreteType': 'org.sagebionetworks.repo.model.FileEntity', 'parentId': 'syn1'},
+              'fileHandles': [{'id': '42', 'fileName': 'data.txt', 'contentMd5': 'abc',
+                               'concreteType': 'org.sagebionetworks.repo.model.file.S3FileHandle'}],
+              'annotations': {}, 'unmetAccessRequirements': []}
+
+    syn = synapseclient.Synapse(debug=False, skip_checks=True)
+    syn.cache = synapseclient.cache.Cache(cache_root_dir=cache_root_dir)
+    syn.prefer_cache = True
+    syn.entity_bundle_cache_size = 0
+    with patch.object(syn, "restGET", return_value=bundle) as mocked_GET:
+        assert_equal(bundle, syn._getEntityBundle('syn123', version=3, bitFlags=0x803))
+        assert_equal(bundle, syn._getEntityBundle('syn123', version=3, bitFlags=0x803))
+        assert_equal(bundle['fileHandles'][0], syn._getFileHandle('42'))
+        mocked_GET.assert_called_once_with('/entity/syn123/version/3/bundle?mask=2051')
+
+    ## bundles with access requirements are only reused within the TTL
+    with patch.object(syn, "restGET", return_value=bundle) as mocked_GET:
+        syn._getEntityBundle('syn123', version=3)
+        syn._getEntityBundle('syn123', version=3)
+        syn.entity_bundle_cache_ttl = 60
+        syn._getEntityBundle('syn123', version=3)
+        assert_equal(2 * [call('/entity/syn123/version/3/bundle?mask=3075')], mocked_GET.call_args_list)
+
+    path = os.path.join(syn.cache.get_cache_dir('42'), 'data.txt')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write('data')
+    syn.cache.add('42', path)
+
+    ## a new session in offline mode gets the entity without any request, however old its bundle
+    syn = synapseclient.Synapse(debug=False, skip_checks=True)
+    syn.cache = synapseclient.cache.Cache(cache_root_dir=cache_root_dir)
+    syn.offline = True
+    entity = syn.get('syn123', version=3)
+    assert_equal(path, entity.path)
+    assert_equal(3, entity.versionNumber)
+
+    assert_raises(SynapseOfflineError, syn.get, 'syn123')
+    assert_raises(SynapseOfflineError, syn.get, 'syn123', version=2)
+
+
+def test_metadata_store__invalidated():
+    cache_root_dir = tempfile.mkdtemp()
+    bundle = {'entity': {'id': 'syn123', 'etag': 'etag-1', 'versionNumber': 3, 'dataFileHandleId': '42',
+                         'concreteType': 'org.sagebionetworks.repo.model.FileEntity'},
+              'fileHandles': [{'id': '42', 'concreteType': 'org.sagebionetworks.repo.model.file.S3FileHandle'}],
+              'annotations': {}}
+
+    def session():
+        syn = synapseclient.Synapse(debug=False, skip_checks=True)
+        syn.cache = synapseclient.cache.Cache(cache_root_dir=cache_root_dir)
+        syn.prefer_cache = True
+        return syn
+
+    syn = session()
+    with patch.object(syn, "restGET", return_value=bundle):
+        syn._getEntityBundle('syn123', version=3)
+    other = session()
+    with patch.object(other, "restGET", return_value=bundle):
+        other._getEntityBundle('syn1234', version=3)
+
+    ## changing the entity removes its persisted bundles and file handles, but no others
+    with patch.object(syn, "restPUT", return_value={'id': 'syn123', 'etag': 'etag-2'}):
+        syn.setAnnotations(bundle['entity'], {'foo': 'bar'})
+    metadata_store = session()._metadataStore()
+    assert_is_none(metadata_store.get('bundle', 'syn123.3.%d' % (0x800 | 0x400 | 0x2 | 0x1)))
+    assert_is_none(metadata_store.get('fileHandle', '42'))
+    assert_equal(bundle, metadata_store.get('bundle', 'syn1234.3.%d' % (0x800 | 0x400 | 0x2 | 0x1)))
+
+    syn = session()
+    with patch.object(syn, "restGET", return_value=bundle) as mocked_GET:
+        syn._getEntityBundle('syn123', version=3)
+        mocked_GET.assert_called_once_with('/entity/syn123/version/3/bundle?mask=3075')
+
+
+def test_store__round_trips():
+    syn = synapseclient.Synapse(debug=False, skip_checks=True)
+    folder = {'id': 'syn456', 'etag': 'etag-1', 'name': 'folder', 'parentId': 'syn123',
+              'concreteType': 'org.sagebionetworks.repo.model.Folder'}
+    created = {'entity': folder, 'annotations': {'id': 'syn456', 'etag': 'etag-1', 'stringAnnotations': {'foo': ['bar']}}}
+
+    def post(uri, body):
+        return {'id': '789'} if uri == '/activity' else created
+
+    ## a new Entity is created with its annotations and provenance in one request
+    with patch.object(syn, "restPOST", side_effect=post) as mocked_POST, \
+         patch.object(syn, "restPUT") as mocked_PUT, \
+         patch.object(syn, "restGET") as mocked_GET, \
+         patch.object(syn, "_findEntityIdByNameAndParent", return_value=None):
+        stored = syn.store(Folder('folder', parent='syn123', foo='bar'), used='syn999', forceVersion=False)
+        assert_equal(['/activity', '/entity/bundle?generatedBy=789'], [c[0][0] for c in mocked_POST.call_args_list])
+        body = json.loads(mocked_POST.call_args[1]['body'])
+        assert_equal({'foo': ['bar']}, body['annotations']['stringAnnotations'])
+        assert_equal('folder', body['entity']['name'])
+        assert_equal('syn456', stored.id)
+        assert_equal(['bar'], stored.foo)
+        mocked_PUT.assert_not_called()
+        mocked_GET.assert_not_called()
+
+    ## an update links the provenance without another request for the new etag
+    with patch.object(syn, "restPOST", return_value={'id': '789'}), \
+         patch.object(syn, "restPUT", side_effect=lambda uri, body=None: {'id': 'syn456', 'etag': 'etag-2'}
+                      if uri.endswith('/annotations') else dict(folder, etag='etag-2')) as mocked_PUT, \
+         patch.object(syn, "restGET") as mocked_GET:
+        stored = syn.store(Folder('folder', parent='syn123', id='syn456', etag='etag-1'), used='syn999')
+        assert_equal(['/entity/syn456?generatedBy=789', '/entity/syn456/annotations'],
+                     [c[0][0] for c in mocked_PUT.call_args_list])
+        assert_equal('etag-2', stored.etag)
+        mocked_GET.assert_not_called()
+
+
+def test_store__failure_deletes_new_activity():
+    syn = synapseclient.Synapse(debug=False, skip_checks=True)
+    error = SynapseHTTPError(response=DictObject({'status_code': 500}))
+
+    def post(uri, body):
+        if uri == '/activity':
+            return {'id': '789'}
+        raise error
+
+    ## an Activity created for the Entity is deleted when the Entity can't be created
+    with patch.object(syn, "restPOST", side_effect=post), \
+         patch.object(syn, "restDELETE") as mocked_DELETE:
+        assert_raises(SynapseHTTPError, syn.store, Folder('folder', parent='syn123'), used='syn999')
+        mocked_DELETE.assert_called_once_with('/activity/789')
+
+    ## but an existing Activity is kept
+    with patch.object(syn, "restPUT", return_value={'id': '789', 'etag': 'etag-1'}), \
+         patch.object(syn, "restPOST", side_effect=error), \
+         patch.object(syn, "restDELETE") as mocked_DELETE:
+        assert_raises(SynapseHTTPError, syn.store, Folder('folder', parent='syn123'),
+                      activity=synapseclient.Activity(name='existing', data={'id': '789'}))
+        mocked_DELETE.assert_not_called()
+
+
+def test_md5ForFiles__progress():
+    stats = synapseclient.hashing.HashingStats()
+    stats.files = stats.hashed = 1
+    md5s = {'/tmp/a.txt': 'd41d8cd98f00b204e9800998ecf8427e'}
+    with patch('synapseclient.hashing.md5_for_files', return_value=(md5s, stats)) as md5_for_files_mock, \
+         patch('sys.stdout') as stdout_mock:
+        ## quiet unless asked
+        assert_equal(md5s, syn._md5ForFiles(['/tmp/a.txt']))
+        assert not stdout_mock.write.called
+        assert_equal(False, md5_for_files_mock.call_args[1]['progress'])
+
+        assert_equal(md5s, syn._md5ForFiles(['/tmp/a.txt'], progress=True))
+        stdout_mock.write.assert_called_once_with('%s\n' % stats)
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from nose.tools import assert_equals
+
+import synapseclient.cache as cache
+from synapseclient.hashing import md5_for_files
+
+
+def setup(module):
+    print('\n')
+    print('~' * 60)
+    print(os.path.basename(__file__))
+    print('~' * 60)
+
+
+def test_md5_for_files():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        expected = {}
+        for i, size in enumerate([0, 1, 1000, 3*2**20 + 7]):
+            data = os.urandom(size)
+            path = os.path.join(temp_dir, 'file%d' % i)
+            with open(path, 'wb') as f:
+                f.write(data)
+            past = time.time() - 60
+            os.utime(path, (past, past))
+            expected[path] = hashlib.md5(data).hexdigest()
+        paths = sorted(expected) + sorted(expected)[:2]
+
+        for use_processes in (False, True):
+            md5s, stats = md5_for_files(paths, max_workers=3, use_processes=use_processes, block_size=2**20)
+            assert_equals(sorted(expected), list(md5s))
+            assert_equals(expected, dict(md5s))
+            assert_equals((4, 4, 3*2**20 + 1008), (stats.files, stats.hashed, stats.bytes))
+
+        ## files found in the index aren't read again
+        index = cache.Md5Index(temp_dir)
+        md5s, stats = md5_for_files(paths, md5_index=index)
+        assert_equals(4, stats.hashed)
+        md5s, stats = md5_for_files(paths, md5_index=index)
+        assert_equals(expected, dict(md5s))
+        assert_equals((4, 0, 0), (stats.files, stats.hashed, stats.bytes))
+    finally:
+        shutil.rmtree(temp_dir)
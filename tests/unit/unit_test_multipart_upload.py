@@ -1,6 +1,8 @@
-import filecmp, math, os, tempfile
-from nose.tools import assert_raises
+import filecmp, hashlib, math, os, tempfile
+from mock import patch
+from nose.tools import assert_raises, assert_equals
 from synapseclient.multipart_upload import find_parts_to_upload, count_completed_parts, calculate_part_size, get_file_chunk
+from synapseclient.multipart_upload import get_generated_chunk, multipart_upload_chunks
 from synapseclient.utils import MB, GB, make_bogus_binary_file
 
 
@@ -55,3 +57,51 @@ def test_chunks():
             os.remove(filepath)
         if 'out' in locals() and out:
             os.remove(out.name)
+
+
+def test_generated_chunks():
+    pieces = [b'a' * 10, b'bb' * 7, b'', b'c' * 3, b'd' * 25]
+    data = b''.join(pieces)
+    calls = []
+
+    def generate_chunks(start):
+        calls.append(start)
+        return iter(pieces[start:])
+
+    offsets = [0, 10, 24, 24, 27]
+    for chunksize in (1, 4, 7, 10, 13, 52, 100):
+        nchunks = int(math.ceil(float(len(data)) / chunksize))
+        assert_equals(data, b''.join(get_generated_chunk(generate_chunks, offsets, i, chunksize) for i in range(1, nchunks+1)))
+
+    ## only the pieces from the one holding the start of the chunk are generated
+    del calls[:]
+    assert_equals(b'ddddd', get_generated_chunk(generate_chunks, offsets, 7, 5))
+    assert_equals([4], calls)
+
+    ## and none past its end
+    generated = []
+
+    def count_pieces(start):
+        for piece in pieces[start:]:
+            generated.append(piece)
+            yield piece
+
+    assert_equals(b'a' * 10, get_generated_chunk(count_pieces, offsets, 1, 10))
+    assert_equals([pieces[0]], generated)
+    del generated[:]
+    assert_equals(b'aaabbbb', get_generated_chunk(count_pieces, offsets, 2, 7))
+    assert_equals(pieces[:2], generated)
+
+
+def test_multipart_upload_chunks():
+    pieces = [b'col1,col2\n', b'1,2\n', b'3,4\n']
+    data = b''.join(pieces)
+
+    with patch("synapseclient.multipart_upload._multipart_upload", return_value={"resultFileHandleId": "123"}) as mock_upload:
+        assert_equals("123", multipart_upload_chunks(None, lambda start: iter(pieces[start:]), "table.csv", contentType="text/csv"))
+
+        args, kwargs = mock_upload.call_args
+        assert_equals(hashlib.md5(data).hexdigest(), kwargs['md5'])
+        assert_equals(len(data), kwargs['fileSize'])
+        assert_equals(data, kwargs['get_chunk_function'](1, 8*MB))
+        assert_equals(b'2\n3', kwargs['get_chunk_function'](5, 3))
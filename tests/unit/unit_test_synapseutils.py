@@ -0,0 +1,211 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import six
+import tempfile
+from mock import patch, call
+from nose.tools import assert_equal, assert_false, assert_in, assert_raises, assert_true
+
+import synapseclient
+import synapseclient.utils as utils
+import synapseutils
+from synapseclient import Activity, File, Folder
+from synapseclient.exceptions import SynapseError, SynapseHTTPError
+from synapseutils.sync import _manifest_upload
+from synapseutils.sync_state import UploadJournal
+
+
+def setup(module):
+    print('\n')
+    print('~' * 60)
+    print(os.path.basename(__file__))
+    print('~' * 60)
+
+
+FOLDER = 'org.sagebionetworks.repo.model.Folder'
+FILE = 'org.sagebionetworks.repo.model.FileEntity'
+
+## syn1 -> (a -> (c, x.txt), b -> y.txt, z.txt)
+CHILDREN = {'syn1': [{'name': 'a', 'id': 'syn2', 'type': FOLDER},
+                     {'name': 'b', 'id': 'syn3', 'type': FOLDER},
+                     {'name': 'z.txt', 'id': 'syn4', 'type': FILE}],
+            'syn2': [{'name': 'c', 'id': 'syn5', 'type': FOLDER},
+                     {'name': 'x.txt', 'id': 'syn6', 'type': FILE}],
+            'syn3': [{'name': 'y.txt', 'id': 'syn7', 'type': FILE}],
+            'syn5': []}
+
+
+def test_walk():
+    syn = synapseclient.Synapse(debug=False, skip_checks=True)
+    expected = [(('top', 'syn1'), [('a', 'syn2'), ('b', 'syn3')], [('z.txt', 'syn4')]),
+                ((os.path.join('top', 'a'), 'syn2'), [('c', 'syn5')], [('x.txt', 'syn6')]),
+                ((os.path.join('top', 'a', 'c'), 'syn5'), [], []),
+                ((os.path.join('top', 'b'), 'syn3'), [], [('y.txt', 'syn7')])]
+
+    with patch.object(syn, "get", return_value=Folder('top', id='syn1', parentId='syn0')) as mocked_get, \
+         patch.object(syn, "getChildren", side_effect=lambda synId: iter(CHILDREN[synId])) as mocked_children:
+        for max_workers in (1, 4):
+            assert_equal(expected, list(synapseutils.walk(syn, 'syn1', max_workers=max_workers)))
+            assert_equal(sorted(expected), sorted(synapseutils.walk(syn, 'syn1', max_workers=max_workers, ordered=False)))
+        ## names come from the listings, only the starting folder is fetched
+        assert_equal(4, mocked_get.call_count)
+
+        ## folders removed from the list aren't walked
+        mocked_children.reset_mock()
+        walked = []
+        for dirpath, dirs, files in synapseutils.walk(syn, 'syn1'):
+            walked.append(dirpath[1])
+            dirs[:] = [d for d in dirs if d[0] != 'a']
+        assert_equal(['syn1', 'syn3'], walked)
+        assert_equal(['syn1', 'syn3'], sorted(c[0][0] for c in mocked_children.call_args_list))
+
+
+def test_syncFromSynapse():
+    syn = synapseclient.Synapse(debug=False, skip_checks=True)
+    temp_dir = tempfile.mkdtemp()
+    names = {child['id']: (parent, child['name']) for parent, children in CHILDREN.items() for child in children}
+
+    def get(synId, downloadLocation=None, **kwargs):
+        if synId == 'syn1':
+            return Folder('top', id='syn1', parentId='syn0')
+        if synId == 'syn6':
+            raise SynapseHTTPError('403 Client Error: Forbidden')
+        parent, name = names[synId]
+        return File(os.path.join(downloadLocation, name), parentId=parent, id=synId, contentType='text/plain',
+                    annotations={'sample': [synId]})
+
+    def getProvenance(entity):
+        if entity.id != 'syn7':
+            raise SynapseHTTPError('404 Client Error: Not Found')
+        return Activity(name='made', used=['syn4'])
+
+    try:
+        allFiles = []
+        with patch.object(syn, "get", side_effect=get), \
+             patch.object(syn, "getChildren", side_effect=lambda synId: iter(CHILDREN[synId])), \
+             patch.object(syn, "getProvenance", side_effect=getProvenance) as mocked_provenance:
+            ## a failed file doesn't stop the others, but is reported at the end
+            assert_raises(SynapseError, synapseutils.syncFromSynapse, syn, 'syn1', path=temp_dir, allFiles=allFiles)
+            assert_equal(2, mocked_provenance.call_count)
+
+        assert_equal(['syn4', 'syn7'], sorted(f.id for f in allFiles))
+        assert_true(os.path.isdir(os.path.join(temp_dir, 'a', 'c')))
+        with open(os.path.join(temp_dir, synapseutils.sync.MANIFEST_FILENAME)) as f:
+            rows = f.read().splitlines()
+        assert_equal(3, len(rows))
+        assert_equal(['path', 'parent', 'name', 'synapseStore', 'contentType', 'used', 'executed',
+                      'activityName', 'activityDescription', 'sample'], rows[0].split('\t'))
+        assert_equal(os.path.join(temp_dir, 'z.txt'), rows[1].split('\t')[0])
+        assert_equal([os.path.join(temp_dir, 'b', 'y.txt'), 'syn3', 'y.txt', 'True', 'text/plain', 'syn4', '', 'made', '', 'syn7'],
+                     rows[2].split('\t'))
+        with open(os.path.join(temp_dir, 'b', synapseutils.sync.MANIFEST_FILENAME)) as f:
+            assert_equal(2, len(f.read().splitlines()))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_syncFromSynapse__incremental():
+    syn = synapseclient.Synapse(debug=False, skip_checks=True)
+    temp_dir = tempfile.mkdtemp()
+    children = {'syn1': [{'name': 'x.txt', 'id': 'syn6', 'type': FILE, 'versionNumber': 1, 'modifiedOn': 'monday'},
+                         {'name': 'y.txt', 'id': 'syn7', 'type': FILE, 'versionNumber': 2, 'modifiedOn': 'monday'}]}
+
+    def get(synId, downloadLocation=None, **kwargs):
+        if synId == 'syn1':
+            return Folder('top', id='syn1', parentId='syn0')
+        name = [child['name'] for child in children['syn1'] if child['id'] == synId][0]
+        path = utils.touch(os.path.join(downloadLocation, name))
+        return File(path, parentId='syn1', id=synId, annotations={'sample': [synId]})
+
+    def sync():
+        return synapseutils.syncFromSynapse(syn, 'syn1', path=temp_dir)
+
+    try:
+        with patch.object(syn, "get", side_effect=get) as mocked_get, \
+             patch.object(syn, "getChildren", side_effect=lambda synId: iter(children[synId])), \
+             patch.object(syn, "getProvenance", return_value=Activity(name='made', used=['syn4'])) as mocked_provenance:
+            sync()
+            assert_equal(3, mocked_get.call_count)
+
+            ## unchanged files aren't fetched, their entities and provenance come from the sync state
+            mocked_get.reset_mock()
+            mocked_provenance.reset_mock()
+            files = sync()
+            assert_equal([call('syn1', downloadFile=False)], mocked_get.call_args_list)
+            mocked_provenance.assert_not_called()
+            assert_equal([os.path.join(temp_dir, 'x.txt'), os.path.join(temp_dir, 'y.txt')], [f.path for f in files])
+            assert_equal(['syn7'], files[1].sample)
+            with open(os.path.join(temp_dir, synapseutils.sync.MANIFEST_FILENAME)) as f:
+                assert_in('syn4', f.read())
+
+            ## files changed in Synapse or locally are fetched again, and deletions reported
+            children['syn1'][0]['modifiedOn'] = 'tuesday'
+            children['syn1'].append({'name': 'z.txt', 'id': 'syn8', 'type': FILE, 'versionNumber': 1, 'modifiedOn': 'monday'})
+            mocked_get.reset_mock()
+            sync()
+            assert_equal(['syn1', 'syn6', 'syn8'], sorted(c[0][0] for c in mocked_get.call_args_list))
+            children['syn1'].pop(1)
+            mocked_get.reset_mock()
+            with patch('sys.stdout', new_callable=six.StringIO) as stdout:
+                sync()
+            assert_equal([call('syn1', downloadFile=False)], mocked_get.call_args_list)
+            assert_in(os.path.join(temp_dir, 'y.txt'), stdout.getvalue())
+
+            os.utime(os.path.join(temp_dir, 'z.txt'), (0, 0))
+            mocked_get.reset_mock()
+            sync()
+            assert_equal(['syn1', 'syn8'], [c[0][0] for c in mocked_get.call_args_list])
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_manifest_upload():
+    import pandas as pd
+
+    syn = synapseclient.Synapse(debug=False, skip_checks=True)
+    temp_dir = tempfile.mkdtemp()
+    syn.cache = synapseclient.cache.Cache(cache_root_dir=os.path.join(temp_dir, 'cache'))
+    paths = []
+    for name in ('a.txt', 'b.txt', 'c.txt', 'd.txt'):
+        paths.append(os.path.join(temp_dir, name))
+        with open(paths[-1], 'w') as f:
+            f.write(name)
+    ## c was made from b, which was made from a
+    df = pd.DataFrame({'path': paths, 'parent': ['syn1'] * 4,
+                       'used': [[], [paths[0]], [paths[1], 'syn99'], []], 'foo': ['bar'] * 4})
+    journal = UploadJournal(os.path.join(temp_dir, 'manifest.tsv.journal'))
+    stored = []
+    done = set()
+    failing = set([paths[1]])
+
+    def store(entity, used=None, **kwargs):
+        if entity.path in failing:
+            raise SynapseHTTPError('500 Server Error')
+        ## the rows used are stored first
+        assert_true(all(item in done for item in used if item != 'syn99'))
+        stored.append(entity.path)
+        done.add(entity.path)
+        return File(entity.path, parent='syn1', id='syn%d' % (100 + paths.index(entity.path)))
+
+    try:
+        with patch.object(syn, "store", side_effect=store), \
+             patch.object(syn, "_convertProvenanceList", side_effect=lambda items: items):
+            ## rows that depend on a failed one aren't stored
+            assert_raises(SynapseError, _manifest_upload, syn, df, 4, journal)
+            assert_equal(sorted([paths[0], paths[3]]), sorted(stored))
+
+            ## a rerun resumes after the rows that were stored and haven't changed
+            failing.clear()
+            with open(paths[3], 'w') as f:
+                f.write('changed')
+            del stored[:]
+            journal = UploadJournal(journal.path)
+            assert_true(_manifest_upload(syn, df, 4, journal))
+            assert_equal(sorted(paths[1:]), sorted(stored))
+            assert_false(os.path.exists(journal.path))
+    finally:
+        shutil.rmtree(temp_dir)
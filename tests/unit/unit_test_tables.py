@@ -5,11 +5,18 @@ from __future__ import unicode_literals
 from builtins import str
 
 from backports import csv
+import datetime
 import io
+import json
 import math
 import os
+import shutil
 import sys
 import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
 from builtins import zip
 from mock import MagicMock
 from nose.tools import assert_raises, assert_equals, assert_not_equals, raises, assert_false
@@ -22,9 +29,10 @@ except ImportError:
     pandas_found = True
 
 import synapseclient
+import synapseclient.utils as utils
 from synapseclient import Entity
 from synapseclient.exceptions import SynapseError
-from synapseclient.table import Column, Schema, CsvFileTable, TableQueryResult, cast_values, as_table_columns, Table, RowSet, SelectColumn, EntityViewSchema
+from synapseclient.table import Column, Schema, CsvFileTable, ColumnarRows, Row, TableQueryResult, cast_values, row_decoder, as_table_columns, Table, RowSet, SelectColumn, EntityViewSchema
 from mock import patch
 
 
@@ -68,6 +76,29 @@ def test_cast_values():
     assert cast_values(row, selectColumns)==[True, 211, 1.61803398875, 1421365]
 
 
+def test_row_decoder():
+    selectColumns = [{'name': 'name', 'columnType': 'STRING'},
+                     {'name': 'x', 'columnType': 'DOUBLE'},
+                     {'name': 'n', 'columnType': 'INTEGER'},
+                     {'name': 'bonk', 'columnType': 'BOOLEAN'},
+                     {'name': 'link', 'columnType': 'LINK'}]
+    decode = row_decoder(selectColumns)
+    assert_equals(decode(['Finklestein', '3.14159', '65535', 'true', 'http://www.synapse.org']),
+                  ['Finklestein', 3.14159, 65535, True, 'http://www.synapse.org'])
+    assert_equals(decode(['', '', None, '', '']), [None, None, None, None, None])
+    assert_raises(ValueError, decode, ['Finklestein', '3.14159'])
+
+    ## all string columns
+    decode = row_decoder([{'name': 'name', 'columnType': 'STRING'}, {'name': 'id', 'columnType': 'ENTITYID'}])
+    assert_equals(decode(['Finklestein', '']), ['Finklestein', None])
+    assert_raises(ValueError, decode, ['Finklestein'])
+
+    ## unknown column types are an error only when there's a value to convert
+    decode = row_decoder([{'name': 'mystery', 'columnType': 'FOO'}])
+    assert_equals(decode(['']), [None])
+    assert_raises(ValueError, decode, ['bar'])
+
+
 def test_schema():
     schema = Schema(name='My Table', parent="syn1000001")
 
@@ -103,6 +134,50 @@ def test_schema():
     assert Column(name='Hipness', columnType='DOUBLE') in schema.columns_to_store
 
 
+def test_ColumnarRows():
+    rows = ColumnarRows(2, [Row(['a', 1], rowId=5, versionNumber=3), Row(['b', None], rowId=6, versionNumber=1)])
+    rows.append(['c', 3])
+
+    assert_equals(3, len(rows))
+    assert_equals([['a', 'b', 'c'], [1, None, 3]], rows.columns)
+    assert_equals(Row(['b', None], rowId=6, versionNumber=1), rows[1])
+    assert_equals(Row(['c', 3]), rows[-1])
+    assert_equals([Row(['a', 1], rowId=5, versionNumber=3), Row(['c', 3])], rows[::2])
+    assert_equals([rows[i] for i in range(3)], list(rows))
+    assert_raises(ValueError, rows.append, ['d'])
+
+    rowset = RowSet(headers=[SelectColumn(id='1', columnType='STRING', name='s'),
+                             SelectColumn(id='2', columnType='INTEGER', name='n')],
+                    tableId='syn123', rows=rows)
+    expected = [{'values': ['a', 1], 'rowId': 5, 'versionNumber': 3},
+                {'values': ['b', None], 'rowId': 6, 'versionNumber': 1},
+                {'values': ['c', 3]}]
+    assert_equals(expected, json.loads(rowset.json())['rows'])
+
+    ## storing serializes the rows straight from the columns, without a dict or Row per row
+    syn = synapseclient.client.Synapse(debug=False, skip_checks=True)
+    syn._waitForAsync = MagicMock(return_value={'rowReferenceSet': {'etag': 'etag-1'}})
+    with patch.object(ColumnarRows, 'iter_json', side_effect=AssertionError('rows materialized')), \
+            patch.object(ColumnarRows, '__getitem__', side_effect=AssertionError('rows materialized')):
+        assert_equals({'etag': 'etag-1'}, syn.store(rowset))
+    request = json.loads(syn._waitForAsync.call_args[1]['request'])
+    assert_equals('org.sagebionetworks.repo.model.table.AppendableRowSetRequest', request['concreteType'])
+    assert_equals('syn123', request['entityId'])
+    assert_equals('syn123', request['toAppend']['tableId'])
+    assert_equals(['s', 'n'], [header['name'] for header in request['toAppend']['headers']])
+    assert_equals(expected, request['toAppend']['rows'])
+    assert_equals([], json.loads(ColumnarRows(2).json()))
+
+    table = Table('syn123', RowSet(headers=rowset.headers, tableId='syn123', rows=ColumnarRows(2, rows[:2])))
+    try:
+        import pandas as pd
+        df = table.asDataFrame()
+        assert_equals(['a', 'b'], list(df['s']))
+        assert_equals(['5_3', '6_1'], list(df.index))
+    except ImportError as e1:
+        sys.stderr.write('Pandas is apparently not installed, skipping part of test_ColumnarRows.\n\n')
+
+
 def test_RowSetTable():
     row_set_json = {
         'etag': 'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee',
@@ -325,6 +400,213 @@ def test_csv_table():
         raise
 
 
+def test_csv_table__use_column_types():
+    cols = [Column(id='1', name='Name', columnType='STRING'),
+            Column(id='2', name='Instrument', columnType='STRING'),
+            Column(id='3', name='Born', columnType='INTEGER'),
+            Column(id='4', name='Living', columnType='BOOLEAN'),
+            Column(id='5', name='Photo', columnType='ENTITYID')]
+    schema = Schema(id='syn1234', name='Jazz Guys', columns=cols, parent="syn1000001")
+
+    with tempfile.NamedTemporaryFile(delete=False) as temp:
+        filename = temp.name
+    try:
+        with io.open(filename, mode='w', encoding="utf-8", newline='') as temp:
+            temp.write('ROW_ID,ROW_VERSION,Name,Instrument,Born,Living,Photo\n'
+                       '1,1,John Coltrane,sax,1926,false,syn1\n'
+                       '2,1,Miles Davis,sax,,false,\n'
+                       '3,2,Sonny Rollins,sax,1930,true,syn3\n'
+                       '4,1,Paul Chambers,bass,1935,,syn4\n')
+
+        table = CsvFileTable(schema, filename, includeRowIdAndRowVersion=True,
+                             headers=[SelectColumn.from_column(col) for col in cols])
+        df = table.asDataFrame(use_column_types=True)
+
+        assert_equals(list(df.index), ['1_1', '2_1', '3_2', '4_1'])
+        assert_equals(str(df['Name'].dtype), 'string')
+        assert_equals(str(df['Instrument'].dtype), 'category')
+        assert_equals(str(df['Born'].dtype), 'Int64')
+        assert_equals(str(df['Living'].dtype), 'boolean')
+        assert_equals(str(df['Photo'].dtype), 'string')
+        assert df['Born'].isna().tolist() == [False, True, False, False]
+        assert_equals(df['Born'].sum(), 1926 + 1930 + 1935)
+        assert_equals(df['Living'].tolist()[:3], [False, False, True])
+
+        df = table.asDataFrame(use_column_types=True, columns=['Name', 'Born'])
+        assert_equals(list(df.columns), ['Name', 'Born'])
+        assert_equals(list(df.index), ['1_1', '2_1', '3_2', '4_1'])
+
+        chunks = list(table.iterDataFrames(chunksize=3, use_column_types=True, columns=['Name', 'Born']))
+        assert_equals([len(chunk) for chunk in chunks], [3, 1])
+        assert_equals(list(chunks[0].index), ['1_1', '2_1', '3_2'])
+        assert_equals(list(chunks[1].index), ['4_1'])
+        assert_equals(list(chunks[1].columns), ['Name', 'Born'])
+        assert_equals(str(chunks[0]['Born'].dtype), 'Int64')
+    finally:
+        os.remove(filename)
+
+
+def test_csv_table_to_parquet():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise SkipTest('pyarrow is not installed')
+
+    cols = [Column(id='1', name='Name', columnType='STRING'),
+            Column(id='2', name='Born', columnType='INTEGER'),
+            Column(id='3', name='Hipness', columnType='DOUBLE'),
+            Column(id='4', name='Living', columnType='BOOLEAN'),
+            Column(id='5', name='Recorded', columnType='DATE')]
+    schema = Schema(id='syn1234', name='Jazz Guys', columns=cols, parent="syn1000001")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(temp_dir, 'query_results.csv')
+        with io.open(filename, mode='w', encoding="utf-8", newline='') as temp:
+            temp.write('"ROW_ID","ROW_VERSION","Name","Born","Hipness","Living","Recorded"\n'
+                       '"1","1","John Coltrane","1926","8.65","false","1420070400000"\n'
+                       '"2","3","Miles Davis","","9.87","true",""\n')
+
+        table = CsvFileTable(schema, filename, includeRowIdAndRowVersion=True,
+                             headers=[SelectColumn.from_column(col) for col in cols])
+        arrow_table = table.asArrowTable()
+
+        parquet_path = os.path.join(temp_dir, 'query_results.parquet')
+        assert os.path.exists(parquet_path)
+        assert_equals(arrow_table.column_names, ['ROW_ID', 'ROW_VERSION', 'Name', 'Born', 'Hipness', 'Living', 'Recorded'])
+        assert_equals(arrow_table.schema.field('ROW_VERSION').type, pa.int64())
+        assert_equals(arrow_table.schema.field('Born').type, pa.int64())
+        assert_equals(arrow_table.schema.field('Living').type, pa.bool_())
+        assert_equals(arrow_table.schema.field('Recorded').type, pa.timestamp('ms', tz='UTC'))
+        assert_equals(arrow_table.column('Name').to_pylist(), ['John Coltrane', 'Miles Davis'])
+        assert_equals(arrow_table.column('Born').to_pylist(), [1926, None])
+        assert_equals(arrow_table.column('Living').to_pylist(), [False, True])
+        assert_equals(arrow_table.column('Recorded').to_pylist()[0].year, 2015)
+
+        ## the converted file is reused
+        with patch("pyarrow.csv.open_csv") as mock_open_csv:
+            assert_equals(table.toParquet(), parquet_path)
+            assert not mock_open_csv.called
+
+        other_path = os.path.join(temp_dir, 'other.parquet')
+        assert_equals(table.toParquet(other_path), other_path)
+        assert os.path.exists(other_path)
+
+        ## a failed conversion leaves no temporary file behind
+        failed_path = os.path.join(temp_dir, 'failed.parquet')
+        with patch("pyarrow.parquet.ParquetWriter.write_table", side_effect=IOError('disk full')):
+            assert_raises(IOError, table.toParquet, failed_path)
+        assert_false(os.path.exists(failed_path + '.tmp'))
+        assert_false(os.path.exists(failed_path))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_csv_table_from_data_frame__streaming():
+    try:
+        import pandas as pd
+    except ImportError:
+        raise SkipTest('pandas is not installed')
+
+    df = pd.DataFrame({'name': ['row%d' % i for i in range(25)], 'n': list(range(25))},
+                      index=['%d_1' % i for i in range(25)], columns=['name', 'n'])
+    schema = Schema(id='syn1234', name='Numbers', columns=as_table_columns(df[['name', 'n']]), parent="syn1000001")
+    table = Table(schema, df)
+
+    ## the data frame isn't written to a file until the file is needed
+    assert table._filepath is None
+    with patch('synapseclient.table.DATA_FRAME_CHUNK_ROWS', 10):
+        chunks = list(table._generate_data_frame_csv())
+        assert_equals(3, len(chunks))
+        assert_equals(chunks[1:], list(table._generate_data_frame_csv(1)))
+    with open(table.filepath, 'rb') as f:
+        assert_equals(f.read(), b''.join(chunks))
+
+    batches = list(table._data_frame_batches(10))
+    assert_equals([10, 10, 5], [n_rows for n_rows, data in batches])
+    assert all(data.startswith(b'ROW_ID,ROW_VERSION,name,n') for n_rows, data in batches)
+
+    syn = synapseclient.client.Synapse(debug=False, skip_checks=True)
+    table = Table(schema, df)
+    with patch('synapseclient.table.multipart_upload_chunks', return_value='999') as mock_upload_chunks, \
+            patch('synapseclient.table.multipart_upload') as mock_upload, \
+            patch.object(syn, '_uploadCsvFileHandle',
+                         return_value={'results': [{'concreteType': 'org.sagebionetworks.repo.model.table.UploadToTableResult', 'etag': 'abc'}]}) as mock_uploadCsvFileHandle:
+        table = syn.store(table)
+        assert mock_upload_chunks.called
+        assert not mock_upload.called
+        assert_equals('999', mock_uploadCsvFileHandle.call_args[0][0])
+        assert_equals('abc', table.etag)
+        assert table._filepath is None
+
+    ## what's stored is the data frame as it was when the table was built
+    df = pd.DataFrame({'name': ['a', 'b'], 'n': [1, 2]}, columns=['name', 'n'])
+    table = Table(schema, df)
+    df.loc[0, 'n'] = 100
+    df.loc[2] = ['c', 3]
+    assert_equals(b'name,n\na,1\nb,2\n', b''.join(table._generate_data_frame_csv()).replace(b'\r\n', b'\n'))
+
+
+def test_csv_table_batches():
+    cols = [Column(id='1', name='name', columnType='STRING'), Column(id='2', name='n', columnType='INTEGER')]
+    schema = Schema(id='syn1234', name='Numbers', columns=cols, parent="syn1000001")
+    rows = ['"plain",1\n', '"two\nlines",2\n', '"escaped \\" quote",3\n', '"more\n\\"lines\\"\n",4\n', 'unquoted,5\n']
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(temp_dir, 'table.csv')
+        with io.open(filename, mode='w', encoding='utf-8', newline='') as f:
+            f.write('name,n\n' + ''.join(rows))
+        table = CsvFileTable(schema, filename, headers=[SelectColumn.from_column(col) for col in cols])
+
+        batches = list(table._csv_file_batches(2))
+        assert_equals([2, 2, 1], [n_rows for n_rows, data in batches])
+        assert_equals([('name,n\n' + ''.join(rows[i:i+2])).encode('utf-8') for i in (0, 2, 4)],
+                      [data for n_rows, data in batches])
+
+        ## batches are uploaded concurrently but applied in order, each with the etag of the one before
+        syn = synapseclient.client.Synapse(debug=False, skip_checks=True)
+        table.etag = 'etag-0'
+        etags = []
+        failures = [True]
+
+        def upload_csv_file_handle(fileHandleId, schema, updateEtag=None, **kwargs):
+            etags.append((fileHandleId, updateEtag))
+            return {'results': [{'concreteType': 'org.sagebionetworks.repo.model.table.UploadToTableResult',
+                                 'etag': 'etag-%d' % (len(etags))}]}
+
+        uploaded = []
+
+        def upload_chunks(syn, generate_chunks, filename, contentType=None):
+            data = b''.join(generate_chunks(0))
+            uploaded.append(data)
+            if data == batches[1][1] and failures:
+                failures.pop()
+                raise SynapseError('upload failed')
+            return 'fh-%d' % [d for n, d in batches].index(data)
+
+        with patch('synapseclient.table.multipart_upload_chunks', side_effect=upload_chunks), \
+                patch.object(syn, '_uploadCsvFileHandle', side_effect=upload_csv_file_handle) as mock_uploadCsvFileHandle:
+            table = syn.store(table, batch_rows=2, max_parallel=2)
+
+        assert_equals([('fh-0', 'etag-0'), ('fh-1', 'etag-1'), ('fh-2', 'etag-2')], etags)
+        assert_equals('etag-3', table.etag)
+        ## the batch that failed to upload was uploaded again
+        assert_equals(3, mock_uploadCsvFileHandle.call_count)
+        assert_equals(4, len(uploaded))
+
+        ## a failed transaction may have been applied, so it isn't retried
+        with patch('synapseclient.table.multipart_upload_chunks', side_effect=upload_chunks), \
+                patch.object(syn, '_uploadCsvFileHandle', side_effect=SynapseError('timed out')) as mock_uploadCsvFileHandle:
+            assert_raises(SynapseError, syn.store, table, batch_rows=2, max_parallel=2)
+        assert_equals(1, mock_uploadCsvFileHandle.call_count)
+
+        ## only tables backed by a CSV file or DataFrame are uploaded in batches
+        assert_raises(ValueError, syn.store, schema, batch_rows=2)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
 def test_list_of_rows_table():
     data = [["John Coltrane",  1926, 8.65, False],
             ["Miles Davis",    1926, 9.87, False],
@@ -430,6 +712,182 @@ def test_aggregate_query_result_to_data_frame():
         sys.stderr.write('Pandas is apparently not installed, skipping asDataFrame portion of test_aggregate_query_result_to_data_frame.\n\n')
 
 
+def _paged_query_mock_synapse(n_pages):
+    headers = [{'columnType': 'STRING', 'name': 'name'}, {'columnType': 'INTEGER', 'name': 'n'}]
+
+    def page(i):
+        return {'concreteType': 'org.sagebionetworks.repo.model.table.QueryResult',
+                'nextPageToken': {'token': i + 1} if i + 1 < n_pages else None,
+                'queryResults': {'etag': 'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee',
+                                 'headers': headers,
+                                 'rows': [{'rowId': 2*i, 'versionNumber': 1, 'values': ['row%d' % (2*i), str(2*i)]},
+                                          {'rowId': 2*i+1, 'versionNumber': 1, 'values': ['row%d' % (2*i+1), str(2*i+1)]}],
+                                 'tableId': 'syn2757980'}}
+
+    class MockSynapse(object):
+        pages_requested = []
+
+        def _queryTable(self, query, limit=None, offset=None, isConsistent=True, partMask=None):
+            first = page(0)
+            return {'concreteType': 'org.sagebionetworks.repo.model.table.QueryResultBundle',
+                    'maxRowsPerPage': 2,
+                    'queryCount': 2 * n_pages,
+                    'queryResult': first}
+
+        def _queryTableNext(self, nextPageToken, tableId):
+            self.pages_requested.append(nextPageToken['token'])
+            return page(nextPageToken['token'])
+
+    return MockSynapse()
+
+
+def test_table_query_result_prefetch():
+    syn = _paged_query_mock_synapse(5)
+    result = TableQueryResult(synapse=syn, query="select * from syn2757980", prefetch=2)
+    assert_equals([row['values'][1] for row in result], list(range(10)))
+    assert_equals(syn.pages_requested, [1, 2, 3, 4])
+
+
+def test_table_query_result_prefetch__stop_early():
+    syn = _paged_query_mock_synapse(50)
+    with TableQueryResult(synapse=syn, query="select * from syn2757980", prefetch=1) as result:
+        for row in result:
+            if row['rowId'] == 3:
+                break
+    assert_raises(StopIteration, next, result)
+    ## the read-ahead is bounded, so most pages were never requested
+    assert len(syn.pages_requested) < 10
+
+
+def test_table_query_result_to_data_frame__multiple_pages():
+    syn = _paged_query_mock_synapse(5)
+    df = TableQueryResult(synapse=syn, query="select * from syn2757980").asDataFrame()
+    assert_equals(list(df.columns), ['name', 'n'])
+    assert_equals(list(df.index), ['%d_1' % i for i in range(10)])
+    assert_equals(list(df['name']), ['row%d' % i for i in range(10)])
+    assert_equals(list(df['n']), list(range(10)))
+
+
+def test_table_query_result_iter_data_frames():
+    syn = _paged_query_mock_synapse(3)
+    chunks = list(TableQueryResult(synapse=syn, query="select * from syn2757980").iterDataFrames())
+    assert_equals(len(chunks), 3)
+    for i, df in enumerate(chunks):
+        assert_equals(list(df.columns), ['name', 'n'])
+        assert_equals(list(df.index), ['%d_1' % (2*i), '%d_1' % (2*i+1)])
+        assert_equals(list(df['n']), [2*i, 2*i+1])
+
+
+def test_queryTableCsv__query_result_cache():
+    syn = synapseclient.client.Synapse(debug=False, skip_checks=True)
+    syn.cache = synapseclient.cache.Cache(cache_root_dir=tempfile.mkdtemp())
+    syn.table_query_cache_size = utils.MB
+    result = {'concreteType': 'org.sagebionetworks.repo.model.table.DownloadFromTableResult',
+              'resultsFileHandleId': 1234, 'tableId': 'syn123', 'etag': 'xyz',
+              'headers': [{'columnType': 'STRING', 'name': 'a'}]}
+    table = {'concreteType': 'org.sagebionetworks.repo.model.table.TableEntity', 'id': 'syn123', 'etag': 'etag-1'}
+
+    def download(file_handle_id, objectId, objectType, destination):
+        path = os.path.join(destination, 'query_results.csv')
+        with open(path, 'w') as f:
+            f.write('a\nfoo\n')
+        syn.cache.add(file_handle_id, path)
+        return path
+
+    with patch.object(syn, "restGET", return_value=table) as mock_restGET, \
+            patch.object(syn, "_waitForAsync", return_value=result) as mock_waitForAsync, \
+            patch.object(syn, "_downloadFileHandle", side_effect=download):
+        first = syn._queryTableCsv("select * from syn123")
+        second = syn._queryTableCsv("select *\n  from syn123")
+        assert_equals(first, second)
+        assert_equals(1, mock_waitForAsync.call_count)
+        mock_restGET.assert_called_with('/entity/syn123')
+
+        ## a change to the table changes its etag
+        mock_restGET.return_value = dict(table, etag='etag-2')
+        syn._queryTableCsv("select * from syn123")
+        assert_equals(2, mock_waitForAsync.call_count)
+
+        ## views are never cached
+        mock_restGET.return_value = dict(table, concreteType='org.sagebionetworks.repo.model.table.EntityView')
+        syn._queryTableCsv("select * from syn123")
+        syn._queryTableCsv("select * from syn123")
+        assert_equals(4, mock_waitForAsync.call_count)
+
+
+def test_queryTableCsv__shards():
+    syn = synapseclient.client.Synapse(debug=False, skip_checks=True)
+    syn.cache = synapseclient.cache.Cache(cache_root_dir=tempfile.mkdtemp())
+    rows = ['%d,1,row%d\n' % (i, i) for i in range(5)]
+
+    def wait_for_jobs(jobs):
+        results = []
+        for i, (uri, request) in enumerate(jobs):
+            assert_equals('/entity/syn123/table/download/csv/async', uri)
+            results.append({'resultsFileHandleId': 100 + i, 'tableId': 'syn123', 'etag': 'xyz',
+                            'headers': [{'columnType': 'STRING', 'name': 'name'}]})
+        return results
+
+    def download(file_handle_id, objectId, objectType, destination):
+        i = file_handle_id - 100
+        path = os.path.join(destination, 'query_results.csv')
+        with open(path, 'w') as f:
+            f.write('ROW_ID,ROW_VERSION,name\n' + ''.join(rows[2*i:2*i+2]))
+        return path
+
+    count_bundle = {'queryCount': 5, 'queryResult': {'queryResults': {'etag': 'xyz', 'rows': []}}}
+    with patch.object(syn, "_queryTable", return_value=count_bundle) as mock_queryTable, \
+            patch.object(syn, "_waitForAsyncJobs", side_effect=wait_for_jobs) as mock_waitForAsyncJobs, \
+            patch.object(syn, "_downloadFileHandle", side_effect=download):
+        table = syn.tableQuery("select * from syn123 where name <> 'limit'", shards=3)
+
+        mock_queryTable.assert_called_once_with("select * from syn123 where name <> 'limit'", limit=1, partMask=0x3)
+        queries = [request['sql'] for uri, request in mock_waitForAsyncJobs.call_args[0][0]]
+        assert_equals(["select * from syn123 where name <> 'limit' ORDER BY ROW_ID LIMIT 2 OFFSET 0",
+                       "select * from syn123 where name <> 'limit' ORDER BY ROW_ID LIMIT 2 OFFSET 2",
+                       "select * from syn123 where name <> 'limit' ORDER BY ROW_ID LIMIT 2 OFFSET 4"], queries)
+        with open(table.filepath) as f:
+            assert_equals('ROW_ID,ROW_VERSION,name\n' + ''.join(rows), f.read())
+        assert_equals([['row%d' % i] for i in range(5)], [row['values'] for row in table.asRowSet()['rows']])
+        ## only the joined file is left behind, cached in place of the CSV files of the shards
+        files = [os.path.join(dirpath, name) for dirpath, dirnames, names in os.walk(syn.cache.cache_root_dir)
+                 for name in names if not name.startswith('.cacheMap')]
+        assert_equals([table.filepath], files)
+        assert_equals(table.filepath, syn.cache.get(100))
+        assert_equals(None, syn.cache.get(101))
+        assert_equals(None, syn.cache.get(102))
+
+    ## the joined file is reused when the shards are the same
+    with patch.object(syn, "_queryTable", return_value=count_bundle), \
+            patch.object(syn, "_waitForAsyncJobs", side_effect=wait_for_jobs), \
+            patch.object(syn, "_downloadFileHandle", side_effect=download) as mock_downloadFileHandle:
+        assert_equals(table.filepath, syn._queryTableCsvSharded("select * from syn123 where name <> 'limit'", 3)[1])
+        assert_false(mock_downloadFileHandle.called)
+
+    with patch.object(syn, "_queryTable", return_value=count_bundle):
+        ## rows with equal sort keys are ordered by ROW_ID
+        etag, queries = syn._shardQuery("select * from syn123 order by name desc", 3)
+        assert_equals('xyz', etag)
+        assert_equals("select * from syn123 order by name desc, ROW_ID LIMIT 2 OFFSET 0", queries[0])
+        etag, queries = syn._shardQuery("select * from syn123 order by row_id", 3)
+        assert_equals("select * from syn123 order by row_id LIMIT 2 OFFSET 0", queries[0])
+
+    ## if the table changes between the shards, the query is run unsharded
+    def wait_for_changing_jobs(jobs):
+        return [dict(result, etag='etag-%d' % i) for i, result in enumerate(wait_for_jobs(jobs))]
+
+    with patch.object(syn, "_queryTable", return_value=count_bundle), \
+            patch.object(syn, "_waitForAsyncJobs", side_effect=wait_for_changing_jobs), \
+            patch.object(syn, "_downloadFileHandle", side_effect=download) as mock_downloadFileHandle:
+        assert_equals(None, syn._queryTableCsvSharded("select * from syn123", 3))
+        assert_false(mock_downloadFileHandle.called)
+
+    ## aggregate queries are not split
+    syn = synapseclient.client.Synapse(debug=False, skip_checks=True)
+    assert_equals(None, syn._shardQuery("select count(*) from syn123", 3))
+    assert_equals(None, syn._shardQuery("select * from syn123 limit 10", 3))
+
+
 def test_waitForAsync():
     syn = synapseclient.client.Synapse(debug=True, skip_checks=True)
     syn.table_query_timeout = 0.05
@@ -447,6 +905,53 @@ def test_waitForAsync():
 
     assert_raises(synapseclient.exceptions.SynapseTimeoutError, syn._waitForAsync, uri="foo/bar", request={"foo": "bar"})
 
+def test_waitForAsync__quick_job():
+    syn = synapseclient.client.Synapse(debug=True, skip_checks=True)
+    syn.restPOST = MagicMock(return_value={"token": "1234567"})
+    syn.restGET = MagicMock(side_effect=[{"jobState": "PROCESSING"}, {"jobState": "PROCESSING"}, {"foo": "bar"}])
+
+    with patch("time.sleep") as mocked_sleep:
+        assert_equals({"foo": "bar"}, syn._waitForAsync(uri="foo/bar", request={"foo": "bar"}))
+        ## starts polling in well under a second and backs off from there
+        sleeps = [args[0] for args, kwargs in mocked_sleep.call_args_list]
+        assert_equals(2, len(sleeps))
+        assert sleeps[0] < 1
+        assert sleeps[0] < sleeps[1]
+
+
+def test_asyncPollIntervals():
+    syn = synapseclient.client.Synapse(debug=True, skip_checks=True)
+    syn.table_query_sleep = 0.1
+    syn.table_query_backoff = 2
+    syn.table_query_max_sleep = 1
+    syn.table_query_jitter = 0.2
+    intervals = syn._asyncPollIntervals()
+    sleeps = [next(intervals) for i in range(10)]
+    assert 0.08 <= sleeps[0] <= 0.12
+    assert all(s <= 1 for s in sleeps)
+    assert sleeps[-1] >= 0.8
+
+
+def test_waitForAsyncJobs():
+    syn = synapseclient.client.Synapse(debug=True, skip_checks=True)
+    syn.restPOST = MagicMock(side_effect=[{"token": "1"}, {"token": "2"}])
+    responses = {"foo/bar/get/1": [{"jobState": "PROCESSING"}, {"result": 1}],
+                 "foo/baz/get/2": [{"result": 2}]}
+    syn.restGET = MagicMock(side_effect=lambda uri, endpoint=None: responses[uri].pop(0))
+
+    with patch("time.sleep"):
+        results = syn._waitForAsyncJobs([("foo/bar", {"a": 1}), ("foo/baz", {"b": 2})])
+    assert_equals([{"result": 1}, {"result": 2}], results)
+    assert_equals(3, syn.restGET.call_count)
+
+
+def test_waitForAsyncJobs__failed_job():
+    syn = synapseclient.client.Synapse(debug=True, skip_checks=True)
+    syn.restPOST = MagicMock(return_value={"token": "1"})
+    syn.restGET = MagicMock(return_value={"jobState": "FAILED", "errorMessage": "oops", "errorDetails": "details"})
+    assert_raises(SynapseError, syn._waitForAsyncJobs, [("foo/bar", {"a": 1})])
+
+
 def _insert_dataframe_column_if_not_exist__setup():
     df = pd.DataFrame()
     column_name = "panda"
@@ -556,4 +1061,208 @@ def test_entityViewSchema__add_scope():
     entity_view.add_scope(Entity(parent="also idk", id=123))
     entity_view.add_scope(456)
     entity_view.add_scope("789")
-    assert_equals([str(x) for x in ["123","456","789"]], entity_view.scopeIds)
\ No newline at end of file
+    assert_equals([str(x) for x in ["123","456","789"]], entity_view.scopeIds)
+
+def test_syncTable():
+    if pandas_found:
+        raise SkipTest("pandas could not be found. please run\
+                         pip install pandas")
+    import synapseutils
+
+    cols = [Column(id='1', name='key', columnType='STRING'),
+            Column(id='2', name='n', columnType='INTEGER'),
+            Column(id='3', name='x', columnType='DOUBLE')]
+    temp_dir = tempfile.mkdtemp()
+    try:
+        filepath = os.path.join(temp_dir, 'table.csv')
+        ## values are found by name, whatever the order of the columns in the results
+        with io.open(filepath, 'w', encoding='utf-8') as f:
+            f.write('x,ROW_ID,key,ROW_VERSION,n\n'
+                    '1.5,1,a,3,1\n'
+                    ',2,b,1,2\n'
+                    '3.0,3,c,1,3\n'
+                    '4.0,4,d,2,4\n')
+        headers = [SelectColumn.from_column(cols[2]), SelectColumn(name='ROW_ID', columnType='INTEGER'),
+                   SelectColumn.from_column(cols[0]), SelectColumn(name='ROW_VERSION', columnType='INTEGER'),
+                   SelectColumn.from_column(cols[1])]
+        table = CsvFileTable('syn123', filepath, etag='etag-0', includeRowIdAndRowVersion=False, headers=headers)
+
+        syn = synapseclient.client.Synapse(debug=False, skip_checks=True)
+        syn.getTableColumns = MagicMock(return_value=iter(cols))
+        syn.tableQuery = MagicMock(return_value=table)
+        syn.store = MagicMock(side_effect=[{'etag': 'etag-1'}, {'etag': 'etag-2'}])
+        syn.delete = MagicMock(return_value={'etag': 'etag-3'})
+
+        ## a is unchanged (an integer column holding NaN is read as floats), b and c change,
+        ## d is deleted and e is new
+        df = pd.DataFrame({'key': ['e', 'c', 'b', 'a'],
+                           'n': [5, 30, 2, 1],
+                           'x': [5.0, 3.0, 2.5, 1.5]})
+        df.loc[4] = ['f', float('nan'), float('nan')]
+
+        counts = synapseutils.syncTable(syn, 'syn123', df, ['key'])
+
+        assert_equals({'inserted': 2, 'updated': 2, 'deleted': 1}, counts)
+
+        ## only the changed cells of the changed rows are sent
+        partial_rowset = syn.store.call_args_list[0][0][0]
+        assert_equals('org.sagebionetworks.repo.model.table.PartialRowSet', partial_rowset.concreteType)
+        assert_equals('syn123', partial_rowset.tableId)
+        assert_equals([(3, {'2': '30'}), (2, {'3': '2.5'})],
+                      [(row.rowId, row['values']) for row in partial_rowset.rows])
+
+        rowset = syn.store.call_args_list[1][0][0]
+        assert_equals('etag-1', rowset.etag)
+        assert_equals(['key', 'n', 'x'], [header.name for header in rowset.headers])
+        assert_equals([['e', 5, 5.0], ['f', None, None]], [row['values'] for row in rowset.rows])
+        selection = syn.delete.call_args[0][0]
+        assert_equals([4], selection.rowIds)
+        assert_equals('etag-2', selection.etag)
+
+        ## dates are compared to the millisecond
+        from synapseutils.table_sync import _to_epoch_millis
+        assert_equals(1420070400001, _to_epoch_millis(datetime.datetime(2015, 1, 1, 0, 0, 0, 1000)))
+        assert_equals(1420070400123, _to_epoch_millis(pd.Timestamp('2015-01-01 00:00:00.123')))
+        assert_equals(1420070400000, _to_epoch_millis(datetime.date(2015, 1, 1)))
+        assert_equals([1, 2, 999], [_to_epoch_millis(datetime.datetime(1970, 1, 1, 0, 0, 0, i * 1000)) for i in (1, 2, 999)])
+
+        ## keys must identify a single row
+        syn.getTableColumns = MagicMock(return_value=iter(cols))
+        assert_raises(ValueError, synapseutils.syncTable, syn, 'syn123', pd.concat([df, df]), ['key'])
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_iterDownloadTableColumns():
+    syn = synapseclient.client.Synapse(debug=False, skip_checks=True)
+    syn.cache = synapseclient.cache.Cache(cache_root_dir=tempfile.mkdtemp())
+    syn.table_query_sleep = 0.001
+    syn.table_query_max_sleep = 0.01
+    temp_dir = tempfile.mkdtemp()
+    try:
+        cached_path = os.path.join(temp_dir, 'cached.txt')
+        with open(cached_path, 'w') as f:
+            f.write('cached')
+        syn.cache.add('100', cached_path)
+
+        filepath = os.path.join(temp_dir, 'table.csv')
+        with io.open(filepath, 'w', encoding='utf-8') as f:
+            f.write('ROW_ID,ROW_VERSION,file\n' + ''.join('%d,1,%d\n' % (i, 100 + i) for i in range(6)) + '6,1,101\n')
+        table = CsvFileTable('syn123', filepath, includeRowIdAndRowVersion=True,
+                             headers=[SelectColumn(id='1', name='file', columnType='FILEHANDLEID')])
+
+        ## 105 doesn't fit in its first zip file and 104 doesn't exist
+        requests = []
+        exceeds_size_limit = set(['105'])
+
+        def restPOST(uri, body, endpoint=None):
+            requests.append([fha['fileHandleId'] for fha in json.loads(body)['requestedFiles']])
+            return {'token': str(len(requests) - 1)}
+
+        def restGET(uri, endpoint=None):
+            summaries = []
+            for file_handle_id in requests[int(uri.split('/get/')[1])]:
+                if file_handle_id == '104':
+                    summaries.append({'fileHandleId': file_handle_id, 'status': 'FAILURE', 'failureCode': 'NOT_FOUND'})
+                elif file_handle_id in exceeds_size_limit:
+                    exceeds_size_limit.remove(file_handle_id)
+                    summaries.append({'fileHandleId': file_handle_id, 'status': 'FAILURE', 'failureCode': 'EXCEEDS_SIZE_LIMIT'})
+                else:
+                    summaries.append({'fileHandleId': file_handle_id, 'status': 'SUCCESS',
+                                      'zipEntryName': '%s/%s/file%s.txt' % (file_handle_id, file_handle_id, file_handle_id)})
+            return {'resultZipFileHandleId': 'zip' + uri.split('/get/')[1], 'fileSummary': summaries}
+
+        def download(file_handle_id, objectId, objectType, destination, chunk_callback=None):
+            summaries = restGET('/get/' + file_handle_id[3:])['fileSummary']
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for summary in summaries:
+                    if summary['status'] == 'SUCCESS':
+                        zf.writestr(summary['zipEntryName'], 'contents of %s' % summary['fileHandleId'])
+            data = buf.getvalue()
+            with open(destination, 'wb') as f:
+                f.write(data)
+            ## only the first zip file is streamed
+            if file_handle_id == 'zip0':
+                for offset in range(0, len(data), 10):
+                    chunk_callback(offset, data[offset:offset + 10])
+            return destination
+
+        syn.restPOST = MagicMock(side_effect=restPOST)
+        syn.restGET = MagicMock(side_effect=restGET)
+        with patch.object(syn, "_downloadFileHandle", side_effect=download):
+            files = list(syn.iterDownloadTableColumns(table, 'file', max_files_per_request=2, max_parallel=2))
+
+        assert_equals(('100', cached_path), files[0])
+        assert_equals(['101', '102', '103', '105'], sorted(file_handle_id for file_handle_id, path in files[1:]))
+        for file_handle_id, path in files[1:]:
+            with open(path) as f:
+                assert_equals('contents of %s' % file_handle_id, f.read())
+            assert_equals(path, syn.cache.get(file_handle_id))
+        assert_equals([['101', '102'], ['103', '104'], ['105'], ['105']], sorted(requests))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_iterDownloadTableColumns__max_parallel():
+    syn = synapseclient.client.Synapse(debug=False, skip_checks=True)
+    syn.cache = synapseclient.cache.Cache(cache_root_dir=tempfile.mkdtemp())
+    syn.table_query_sleep = 0.001
+    syn.table_query_max_sleep = 0.01
+    temp_dir = tempfile.mkdtemp()
+    try:
+        filepath = os.path.join(temp_dir, 'table.csv')
+        with io.open(filepath, 'w', encoding='utf-8') as f:
+            f.write('ROW_ID,ROW_VERSION,file\n' + ''.join('%d,1,%d\n' % (i, 100 + i) for i in range(6)))
+        table = CsvFileTable('syn123', filepath, includeRowIdAndRowVersion=True,
+                             headers=[SelectColumn(id='1', name='file', columnType='FILEHANDLEID')])
+
+        requests = []
+
+        def restPOST(uri, body, endpoint=None):
+            requests.append(json.loads(body)['requestedFiles'][0]['fileHandleId'])
+            return {'token': str(len(requests) - 1)}
+
+        def restGET(uri, endpoint=None):
+            file_handle_id = requests[int(uri.split('/get/')[1])]
+            return {'resultZipFileHandleId': 'zip' + file_handle_id,
+                    'fileSummary': [{'fileHandleId': file_handle_id, 'status': 'SUCCESS',
+                                     'zipEntryName': '%s/%s/file.txt' % (file_handle_id, file_handle_id)}]}
+
+        ## each download waits, for a while, until all of them are running
+        lock = threading.Condition()
+        running = [0]
+        peak = [0]
+
+        def download(file_handle_id, objectId, objectType, destination, chunk_callback=None):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                lock.notify_all()
+                deadline = time.time() + 5
+                while peak[0] < 6 and time.time() < deadline:
+                    lock.wait(0.1)
+                running[0] -= 1
+            file_handle_id = file_handle_id[3:]
+            with zipfile.ZipFile(destination, 'w') as zf:
+                zf.writestr('%s/%s/file.txt' % (file_handle_id, file_handle_id), 'contents of %s' % file_handle_id)
+            return destination
+
+        syn.restPOST = MagicMock(side_effect=restPOST)
+        syn.restGET = MagicMock(side_effect=restGET)
+        with patch.object(syn, "_downloadFileHandle", side_effect=download):
+            files = list(syn.iterDownloadTableColumns(table, 'file', max_files_per_request=1, max_parallel=6))
+
+        assert_equals(['100', '101', '102', '103', '104', '105'], sorted(file_handle_id for file_handle_id, path in files))
+        assert_equals(6, peak[0])
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_downloadTableColumns():
+    syn = synapseclient.client.Synapse(debug=False, skip_checks=True)
+    with patch.object(syn, "iterDownloadTableColumns", return_value=iter([('1', 'a.txt'), ('2', 'b.txt')])) as mock_iter:
+        file_map = syn.downloadTableColumns('table', ['foo'], max_parallel=2, downloadLocation='ignored')
+    assert_equals(OrderedDict([('1', 'a.txt'), ('2', 'b.txt')]), file_map)
+    ## only the options of iterDownloadTableColumns are passed on
+    mock_iter.assert_called_once_with('table', ['foo'], max_parallel=2)
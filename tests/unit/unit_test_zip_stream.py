@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import random
+import shutil
+import tempfile
+import zipfile
+from nose.tools import assert_equals, assert_true, assert_false
+
+from synapseclient.zip_stream import ZipStreamExtractor
+
+
+def setup(module):
+    print('\n')
+    print('~' * 60)
+    print(os.path.basename(__file__))
+    print('~' * 60)
+
+
+class _Unseekable(io.RawIOBase):
+    """A write-only stream that makes zipfile write data descriptors after each entry."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data.extend(b)
+        return len(b)
+
+
+def _make_zip(contents, compression, seekable=True):
+    out = io.BytesIO() if seekable else _Unseekable()
+    with zipfile.ZipFile(out, 'w', compression) as zf:
+        for name, data in contents:
+            zf.writestr(name, data)
+    return bytes(out.getvalue() if seekable else out.data)
+
+
+def _feed(extractor, data, max_chunk):
+    offset = 0
+    while offset < len(data):
+        chunk = data[offset:offset + random.randint(1, max_chunk)]
+        extractor.feed(offset, chunk)
+        offset += len(chunk)
+
+
+def test_extract_stream():
+    contents = [('123/4123/a.txt', b'a' * 10000),
+                ('124/124/b.bin', os.urandom(5000)),
+                ('125/125/empty.txt', b''),
+                ('126/126/skipped.txt', b'not wanted')]
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            for seekable in (True, False):
+                if not seekable and compression == zipfile.ZIP_STORED:
+                    continue
+                data = _make_zip(contents, compression, seekable)
+                targets = {name: os.path.join(temp_dir, str(i)) for i, (name, _) in enumerate(contents[:3])}
+                callbacks = []
+                extractor = ZipStreamExtractor(targets, lambda name, path: callbacks.append(name))
+                _feed(extractor, data, 700)
+
+                assert_false(extractor.failed)
+                assert_true(extractor.finished)
+                assert_equals([name for name, _ in contents[:3]], callbacks)
+                for i, (name, expected) in enumerate(contents[:3]):
+                    path = extractor.extracted[name]
+                    assert_equals(os.path.join(temp_dir, str(i), os.path.basename(name)), path)
+                    with open(path, 'rb') as f:
+                        assert_equals(expected, f.read())
+                assert_false(os.path.exists(os.path.join(temp_dir, '3')))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_extract_stream__unsupported():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        ## stored entries followed by data descriptors have no known end
+        data = _make_zip([('a.txt', b'a' * 1000)], zipfile.ZIP_STORED, seekable=False)
+        extractor = ZipStreamExtractor({'a.txt': temp_dir})
+        _feed(extractor, data, 100)
+        assert_true(extractor.failed)
+        assert_equals({}, extractor.extracted)
+
+        ## a download that starts over can not be followed
+        data = _make_zip([('a.txt', os.urandom(1000)), ('b.txt', os.urandom(1000))], zipfile.ZIP_DEFLATED)
+        extractor = ZipStreamExtractor({'a.txt': temp_dir, 'b.txt': temp_dir})
+        extractor.feed(0, data[:50])
+        extractor.feed(0, data)
+        assert_true(extractor.failed)
+        assert_equals([], os.listdir(temp_dir))
+    finally:
+        shutil.rmtree(temp_dir)
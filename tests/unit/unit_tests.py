@@ -434,4 +434,18 @@ def test_calling_module():
     # 'unit_test' is the name of the module in which this test resides
     # we made a helper so that the call order is: case.some_function_for_running_tests() -> unit_test.test_calling_module() -> unit_test._calling_module_test_helper()
     # since both _calling_module_test_helper and test_calling_module are a part of the unit_test module, we can test that callers of the same module do indeed are skipped
-    assert_equal("case", _calling_module_test_helper())
\ No newline at end of file
+    assert_equal("case", _calling_module_test_helper())
+
+def test_md5_for_file():
+    import hashlib
+    temp_dir = tempfile.mkdtemp()
+    try:
+        ## empty, shorter than a block, a whole number of blocks and a short last block
+        for size in (0, 5, 32, 37):
+            data = os.urandom(size)
+            path = os.path.join(temp_dir, 'file%d' % size)
+            with open(path, 'wb') as f:
+                f.write(data)
+            assert_equal(hashlib.md5(data).hexdigest(), utils.md5_for_file(path, block_size=16).hexdigest())
+    finally:
+        rmtree(temp_dir)